@@ -0,0 +1,551 @@
+###################################################################
+
+# This file is benchmarkSuite.py. It times the pieces of the analysis that
+# have to keep up with big data files: filling histograms (one value at a
+# time and from arrays), hintegrate, hrandom, reading flowmeter files and
+# working out flow rates. The data are made up, so the benchmarks can be
+# run at any size from 10^3 to 10^7 rows without real recordings that big:
+#   - synthetic_run makes a recording that looks like a DPS310E run (pump
+#     off, then plateaus at a series of flow rates, with sensor noise and a
+#     drifting ambient pressure);
+#   - write_dps310e writes one out as a DPS310E CSV file;
+#   - write_insert writes a file in the Initial Insert format (blocks of
+#     "n,In,Mid,Out,Ambient,t (ms),..." rows, one block per flow rate).
+
+# For each stage and size we keep the best time out of a few repeats, the
+# throughput (rows per second) and the peak memory the stage allocated
+# (measured in a separate run, under tracemalloc, so the timing isn't
+# slowed down by it). The results go into a JSON file that can be compared
+# with one from another commit: anything more than threshold (a fraction)
+# slower, or bigger, than before is reported as a regression.
+
+# use this way:
+#   import benchmarkSuite as bs
+#
+#   results = bs.run_benchmarks([1000, 100000, 1000000])
+#   bs.print_results(results)
+#   bs.save_results(results, "bench.json")
+#
+#   regressions = bs.print_comparison(bs.compare_results( \
+#   bs.load_results("bench_before.json"), results, threshold = 0.2))
+#
+# or from the command line:
+#   python benchmarkSuite.py --sizes 1000 100000 1000000 --out bench.json
+#   python benchmarkSuite.py --out bench_new.json --compare bench.json
+# which exits with status 1 if anything got slower than the threshold.
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import flowmeterLoader as fl
+import formatRegistry as fr
+import histogramObject as hb
+import venturiFlow as vf
+
+# bump this if the layout of the results file changes.
+_RESULTS_FORMAT = 1
+
+# the stages, in the order they are run. hfill goes through the values
+# one at a time in python, so it only gets the first max_scalar_rows.
+stage_names = ("hfill", "hfill_array", "hfill_array_2d", "hintegrate", \
+"hrandom", "load_dps310e", "load_insert", "flow")
+
+# flow rates (L/s) the synthetic runs step through, like the pump settings
+# in the Initial Insert runs.
+_flow_rates = (0.15, 0.3, 0.45, 0.66, 0.8, 1.0, 1.2)
+
+###########################################################################
+
+# here is a function to make a synthetic DPS310E recording of nrows
+# samples (a structured array with fl.dps310e_dtype). The first tenth of
+# it is pump off; the rest steps through the flow rates in _flow_rates,
+# with short ramps in between. p0 is upstream of the constriction, p1 in
+# it, p2 downstream and p4 the ambient sensor; p3's slot is empty, as in
+# the real files.
+
+def synthetic_run(nrows, seed = 0):
+
+    rng = np.random.default_rng(seed)
+
+    run = np.zeros(nrows, dtype = fl.dps310e_dtype)
+
+    # about two samples a second, with a little jitter.
+    run["millis"] = np.cumsum(rng.integers(430, 470, nrows))
+
+    # flow rate at each sample: pump off, then equal plateaus joined by
+    # ramps a twentieth as long.
+    flow = np.zeros(nrows)
+    off = nrows // 10
+    plateau = max(1, (nrows - off) // len(_flow_rates))
+    ramp = max(1, plateau // 20)
+
+    for step, rate in enumerate(_flow_rates):
+        start = off + step * plateau
+        previous = _flow_rates[step - 1] if step > 0 else 0.
+        flow[start:start + plateau] = rate
+        stop = min(start + ramp, nrows)
+        if stop > start:
+            flow[start:stop] = np.linspace(previous, rate, stop - start)
+
+    dp = vf.expected_differential(flow)
+
+    # ambient pressure drifting slowly about 998.6 hPa, and the sensors'
+    # own offsets and noise (hPa).
+    ambient = 998.6 + np.cumsum(rng.normal(0., 2.e-4, nrows))
+    noise = 0.004
+
+    run["p4"] = ambient + rng.normal(0., noise, nrows)
+    run["p0"] = ambient - 0.35 + 3. * dp / 100. + rng.normal(0., noise, nrows)
+    run["p1"] = run["p0"] + 0.003 - dp / 100. + rng.normal(0., noise, nrows)
+    run["p2"] = run["p1"] - 0.037 + 0.8 * dp / 100. + rng.normal(0., noise, nrows)
+
+    run["t0"] = 23.40 + rng.normal(0., 0.01, nrows)
+    run["t1"] = 24.18 + rng.normal(0., 0.01, nrows)
+    run["t2"] = 23.84 + rng.normal(0., 0.01, nrows)
+    run["t4"] = 24.63 + rng.normal(0., 0.01, nrows)
+
+    # the firmware's corrected differentials: raw difference minus the
+    # pump-off difference, in Pa, to two decimal places.
+    baseline01 = np.mean(run["p0"][:max(off, 1)] - run["p1"][:max(off, 1)])
+    baseline12 = np.mean(run["p1"][:max(off, 1)] - run["p2"][:max(off, 1)])
+    run["dp01"] = np.round(100. * (run["p0"] - run["p1"] - baseline01), 2)
+    run["dp12"] = np.round(100. * (run["p1"] - run["p2"] - baseline12), 2)
+
+    # 21/04/2022 18:32:43 UTC, plus the elapsed time.
+    run["utc_ms"] = 1650565963000 + (run["millis"] - run["millis"][0]) // 1000 * 1000
+    run["patient_id"] = 6
+
+    return run
+
+###########################################################################
+# end of function synthetic_run
+###########################################################################
+
+# here is a function to write a synthetic (or any) run out as a DPS310E
+# CSV file, the way the flowmeter writes them.
+
+def write_dps310e(filename, run, chunk_rows = 65536):
+
+    line_format = "%d,T and P:,%.2f,%.6f,%.2f,%.6f,%.2f,%.6f,%.2f,%.6f,%.2f,%.6f," \
+    "corrected P0 - P1 in Pa:,%.2f,corrected P1 - P2 in Pa:,%.2f," \
+    "Current time (UTC):,%s,Date (dd/mm/yyyy):,%s,patient ID,%d\n"
+
+    with open(filename, "w") as f:
+
+        for start in range(0, run.size, chunk_rows):
+
+            chunk = run[start:start + chunk_rows]
+
+            # "2022-04-21T18:32:43" -> "18:32:43" and "21/04/2022"
+            stamps = np.datetime_as_string(chunk["utc_ms"].astype("datetime64[ms]"), unit = "s")
+            times = [stamp[11:19] for stamp in stamps]
+            dates = [stamp[8:10] + "/" + stamp[5:7] + "/" + stamp[0:4] for stamp in stamps]
+
+            columns = [chunk[name].tolist() for name in ("millis", "t0", "p0", \
+            "t1", "p1", "t2", "p2", "t3", "p3", "t4", "p4", "dp01", "dp12")]
+
+            f.writelines([line_format % (row + (time_string, date_string, patient)) \
+            for row, time_string, date_string, patient in \
+            zip(zip(*columns), times, dates, chunk["patient_id"].tolist())])
+
+###########################################################################
+# end of function write_dps310e
+###########################################################################
+
+# here is a function to write a file in the Initial Insert format with
+# nrows data rows: a pump-off block of 15 samples and then a block of 30
+# for each flow rate, over and over. Pressures are in Pa.
+
+def write_insert(filename, nrows, seed = 0):
+
+    rng = np.random.default_rng(seed)
+
+    header = "n,In,Mid,Out,Ambient,t (ms),In - Mid,In - Out,In - Ambient," \
+    "Mid - Out,Mid - Ambient,Out - Ambient\n"
+    row_format = "%d,%.5f,%.5f,%.5f,%.5f,%d,%.2f,%.2f,%.2f,%.2f,%.2f,%.2f\n"
+
+    written = 0
+    block = 0
+
+    with open(filename, "w") as f:
+
+        f.write("new meter diffuser on input,,,,,,,,,,,\n")
+
+        while written < nrows:
+
+            # blocks alternate pump off, flow rate, pump off, next flow rate...
+            if block % 2 == 0:
+                rate = 0.
+                size = 15
+                f.write("Oct 22 2021 14:35:00,Pump Off Samples,N=%d,,,,,,,,,\n" % size)
+            else:
+                rate = _flow_rates[(block // 2) % len(_flow_rates)]
+                size = 30
+                f.write("Oct 22 2021 14:35:00,flow rate=%g,N=%d,,,,,,,,,\n" % (rate, size))
+
+            size = min(size, nrows - written)
+            dp = float(vf.expected_differential(rate))
+
+            ambient = 98993.1 + rng.normal(0., 0.15, size)
+            inlet = 99012.2 + 4. * dp + rng.normal(0., 0.15, size)
+            middle = inlet + 0.9 - dp + rng.normal(0., 0.15, size)
+            outlet = middle - 7.4 + 0.8 * dp + rng.normal(0., 0.15, size)
+            elapsed = np.concatenate(([13], rng.integers(205, 210, size - 1)))
+
+            f.write(header)
+            f.writelines([row_format % (i + 1, a, b, c, d, t, a - b, a - c, a - d, \
+            b - c, b - d, c - d) for i, (a, b, c, d, t) in \
+            enumerate(zip(inlet, middle, outlet, ambient, elapsed))])
+
+            written = written + size
+            block = block + 1
+
+###########################################################################
+# end of function write_insert
+###########################################################################
+
+# here is a function to read an Initial Insert file the way the analysis
+# does, through formatRegistry: every data row, with its block's header
+# and section, as an array of fr.block_dtype.
+
+def load_insert(filename):
+
+    return fr.load_blocks(filename, "insert")
+
+###########################################################################
+# end of function load_insert
+###########################################################################
+
+# here is the function to run the benchmarks. For each number of rows in
+# sizes it makes a synthetic run (and files, in work_dir, for the loading
+# stages) and times each stage in stages, keeping the best of repeat tries.
+# The files are only written for sizes up to max_file_rows. It hands back a
+# dictionary that save_results writes out as JSON.
+
+def run_benchmarks(sizes = (1000, 10000, 100000, 1000000), stages = stage_names, \
+repeat = 3, max_scalar_rows = 100000, max_file_rows = 1000000, work_dir = None, \
+verbose = True):
+
+    for stage in stages:
+        if stage not in stage_names:
+            raise ValueError("no benchmark stage called '" + str(stage) + "'")
+
+    results = {"format": _RESULTS_FORMAT, "environment": _environment(), \
+    "repeat": repeat, "results": []}
+
+    with tempfile.TemporaryDirectory(dir = work_dir) as scratch:
+
+        for nrows in sizes:
+
+            nrows = int(nrows)
+            run = synthetic_run(nrows)
+
+            for stage in stages:
+
+                if stage.startswith("load") and nrows > max_file_rows:
+                    continue
+
+                prepare, work, rows = _stage(stage, run, scratch, max_scalar_rows)
+
+                seconds = _best_time(prepare, work, repeat)
+                peak_bytes = _peak_memory(prepare, work)
+
+                row = {"stage": stage, "rows": nrows, "rows_timed": rows, \
+                "seconds": seconds, \
+                "rows_per_second": rows / seconds if seconds > 0. else float("inf"), \
+                "peak_bytes": peak_bytes}
+                results["results"].append(row)
+
+                if verbose:
+                    _print_row(row)
+
+    return results
+
+###########################################################################
+# end of function run_benchmarks
+###########################################################################
+
+# here is a function to set up one stage. It hands back prepare (which
+# makes whatever the stage works on, outside the timing), work (the part
+# that's timed, given what prepare made) and how many rows work handles.
+
+def _stage(stage, run, scratch, max_scalar_rows):
+
+    nrows = run.size
+    dp = run["dp01"]
+
+    if stage == "hfill":
+
+        values = dp[:max_scalar_rows].tolist()
+
+        def prepare():
+            return hb.histo("dp01", 100, -5., 60.)
+
+        def work(h):
+            for value in values:
+                h.hfill(value)
+
+        return prepare, work, len(values)
+
+    if stage == "hfill_array":
+
+        def prepare():
+            return hb.histo("dp01", 100, -5., 60.)
+
+        def work(h):
+            h.hfill_array(dp)
+
+        return prepare, work, nrows
+
+    if stage == "hfill_array_2d":
+
+        seconds = run["millis"] / 1000.
+
+        def prepare():
+            return hb.histo("dp01 vs. time", 200, 0., max(float(seconds.max()), 1.), \
+            200, -5., 60.)
+
+        def work(h):
+            h.hfill_array(seconds, dp)
+
+        return prepare, work, nrows
+
+    if stage in ("hintegrate", "hrandom"):
+
+        filled = hb.histo("dp01", 1000, -5., 60.)
+        filled.hfill_array(dp)
+
+        def prepare():
+            h = filled.hclone()
+            h.hmerge(filled)
+            if stage == "hrandom":
+                h.hintegrate()
+            return h
+
+        if stage == "hintegrate":
+            def work(h):
+                h.hintegrate()
+        else:
+            rng = np.random.default_rng(1)
+            def work(h):
+                h.hrandom(nrows, rng)
+
+        return prepare, work, nrows
+
+    if stage == "load_dps310e":
+
+        filename = os.path.join(scratch, "DPS310E_%d.CSV" % nrows)
+        if not os.path.exists(filename):
+            write_dps310e(filename, run)
+
+        return (lambda: filename), fl.load_dps310e, nrows
+
+    if stage == "load_insert":
+
+        filename = os.path.join(scratch, "Insert_%d.csv" % nrows)
+        if not os.path.exists(filename):
+            write_insert(filename, nrows)
+
+        return (lambda: filename), load_insert, nrows
+
+    # stage == "flow": segments, baseline and flow rates for the whole run.
+    return (lambda: [run]), vf.summarize_runs, nrows
+
+###########################################################################
+# end of function _stage
+###########################################################################
+
+# here is a function to time work, keeping the best of repeat tries. What
+# prepare makes for each try isn't included in the time.
+
+def _best_time(prepare, work, repeat):
+
+    best = float("inf")
+
+    for attempt in range(max(1, repeat)):
+        argument = prepare()
+        start = time.perf_counter()
+        work(argument)
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+###########################################################################
+# end of function _best_time
+###########################################################################
+
+# here is a function to find the most memory work has allocated at once,
+# over and above what was already allocated before it started. numpy
+# reports its arrays to tracemalloc, so they are included.
+
+def _peak_memory(prepare, work):
+
+    argument = prepare()
+
+    tracemalloc.start()
+    try:
+        work(argument)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return int(peak)
+
+###########################################################################
+# end of function _peak_memory
+###########################################################################
+
+# here is a function to describe where the benchmarks were run, so results
+# from different machines aren't mixed up by mistake.
+
+def _environment():
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output = True, \
+        text = True, cwd = os.path.dirname(os.path.abspath(__file__)), \
+        timeout = 10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ""
+
+    return {"commit": commit, "python": platform.python_version(), \
+    "numpy": np.__version__, "machine": platform.machine(), \
+    "processor": platform.processor(), "cpus": os.cpu_count(), \
+    "platform": platform.platform(), \
+    "time": time.strftime("%Y-%m-%dT%H:%M:%S%z")}
+
+###########################################################################
+# end of function _environment
+###########################################################################
+
+# here are functions to write the results to a JSON file and read them
+# back.
+
+def save_results(results, filename):
+
+    with open(filename, "w") as f:
+        json.dump(results, f, indent = 1)
+
+def load_results(filename):
+
+    with open(filename, "r") as f:
+        results = json.load(f)
+
+    if results.get("format") != _RESULTS_FORMAT:
+        raise ValueError(filename + " is not a benchmark results file this version can read")
+
+    return results
+
+###########################################################################
+# end of functions save_results and load_results
+###########################################################################
+
+# here is a function to compare two sets of results, stage by stage and
+# size by size. It hands back one row per stage and size found in both,
+# with the ratios of the times and of the peak memory (current over
+# baseline). A row is a regression if either ratio is more than
+# 1 + threshold. Stages that took less than min_seconds in the baseline
+# are too quick to time reliably, so their times aren't judged.
+
+def compare_results(baseline, current, threshold = 0.2, min_seconds = 1.e-3):
+
+    before = {(row["stage"], row["rows"]): row for row in baseline["results"]}
+
+    comparison = []
+
+    for row in current["results"]:
+
+        old = before.get((row["stage"], row["rows"]))
+        if old is None:
+            continue
+
+        time_ratio = row["seconds"] / old["seconds"] if old["seconds"] > 0. else 1.
+        memory_ratio = row["peak_bytes"] / old["peak_bytes"] if old["peak_bytes"] > 0 else 1.
+
+        slower = old["seconds"] >= min_seconds and time_ratio > 1. + threshold
+        bigger = old["peak_bytes"] > 0 and memory_ratio > 1. + threshold
+
+        comparison.append({"stage": row["stage"], "rows": row["rows"], \
+        "seconds_before": old["seconds"], "seconds": row["seconds"], \
+        "time_ratio": time_ratio, "memory_ratio": memory_ratio, \
+        "regression": bool(slower or bigger)})
+
+    return comparison
+
+###########################################################################
+# end of function compare_results
+###########################################################################
+
+# here are functions to print a table of results and of a comparison.
+# print_comparison hands back the number of regressions.
+
+def _print_row(row):
+
+    print("%-15s %9d %11.5f %14.4g %12.1f" % (row["stage"], row["rows"], \
+    row["seconds"], row["rows_per_second"], row["peak_bytes"] / 2.**20))
+
+def print_results(results):
+
+    print("%-15s %9s %11s %14s %12s" % ("stage", "rows", "seconds", "rows/s", "peak MiB"))
+
+    for row in results["results"]:
+        _print_row(row)
+
+def print_comparison(comparison):
+
+    print("%-15s %9s %11s %11s %8s %8s" % ("stage", "rows", "before (s)", \
+    "now (s)", "time", "memory"))
+
+    regressions = 0
+
+    for row in comparison:
+        regressions = regressions + row["regression"]
+        print("%-15s %9d %11.5f %11.5f %8.2f %8.2f %s" % (row["stage"], row["rows"], \
+        row["seconds_before"], row["seconds"], row["time_ratio"], \
+        row["memory_ratio"], "REGRESSION" if row["regression"] else ""))
+
+    return regressions
+
+###########################################################################
+# end of functions print_results and print_comparison
+###########################################################################
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = \
+    "time the histogram and flowmeter analysis code on synthetic data")
+    parser.add_argument("--sizes", type = int, nargs = "+", \
+    default = [1000, 10000, 100000, 1000000])
+    parser.add_argument("--stages", nargs = "+", default = list(stage_names), \
+    choices = stage_names)
+    parser.add_argument("--repeat", type = int, default = 3)
+    parser.add_argument("--max-file-rows", type = int, default = 1000000, \
+    help = "largest size to write files for in the load stages")
+    parser.add_argument("--out", default = None, help = "write the results to this JSON file")
+    parser.add_argument("--compare", default = None, \
+    help = "compare with the results in this JSON file")
+    parser.add_argument("--threshold", type = float, default = 0.2, \
+    help = "fraction slower (or bigger) than before that counts as a regression")
+    arguments = parser.parse_args()
+
+    print("%-15s %9s %11s %14s %12s" % ("stage", "rows", "seconds", "rows/s", "peak MiB"))
+
+    results = run_benchmarks(arguments.sizes, arguments.stages, arguments.repeat, \
+    max_file_rows = arguments.max_file_rows)
+
+    if arguments.out is not None:
+        save_results(results, arguments.out)
+
+    if arguments.compare is not None:
+        print()
+        regressions = print_comparison(compare_results(load_results(arguments.compare), \
+        results, arguments.threshold))
+        sys.exit(1 if regressions > 0 else 0)
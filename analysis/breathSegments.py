@@ -0,0 +1,367 @@
+###################################################################
+
+# This file is breathSegments.py. It splits a flow recording from the
+# ventilator insert into breaths, and works out how much air went in and
+# out in each one (the tidal volume). flowSegments finds the steady pump
+# plateaus; this is for flows that go back and forth.
+
+# Inspiration is flow one way through the insert (positive flow, in L/s,
+# from venturiFlow), expiration is flow the other way (negative). A
+# breath starts where the flow turns positive, switches where it turns
+# negative, and ends where it turns positive again, which is where the next
+# breath starts. Near zero the flow is mostly sensor noise, so the phase
+# only changes once the flow gets past +threshold or -threshold; the
+# boundary is put back at the last sign change before that (hysteresis).
+
+# The volumes are the integral of the flow over each phase (trapezoidal
+# rule, with the times from the millis column), so
+#   inspired_volume = integral of flow from start to switch   (L)
+#   expired_volume  = -integral of flow from switch to stop   (L)
+
+# breath_detector does this a sample (update) or a chunk of samples
+# (update_array) at a time, keeping only a handful of numbers between
+# calls, and hands back each breath as soon as it is over. find_breaths
+# runs a whole recording through one in one go, for going back over old
+# files; both give the same breaths.
+
+# use this way:
+#   import flowmeterLoader as fl
+#   import breathSegments as br
+#
+#   run = fl.load_dps310e("Data/DPS310E_22_04_21_a.CSV")
+#   breaths = br.find_breaths(run["millis"], br.run_flow(run))
+#   print(breaths["inspired_volume"])
+#
+# or as the data arrive:
+#   detector = br.breath_detector(threshold = 0.05)
+#   for chunk in fl.iter_dps310e_chunks("Data/DPS310E_22_04_21_a.CSV", 100):
+#       for breath in detector.update_array(chunk["millis"], flow_of(chunk)):
+#           print(breath["number"], breath["inspired_volume"])
+
+import math
+
+import numpy as np
+
+import runningStats as rs
+import venturiFlow as vf
+
+# one row per breath. start, switch and stop are sample numbers (counting
+# every sample the detector has seen), with their millis values; the
+# breath is samples start to stop - 1, inspiration up to switch - 1.
+breath_dtype = np.dtype([
+    ("number", np.int64),
+    ("start", np.int64),
+    ("switch", np.int64),
+    ("stop", np.int64),
+    ("start_ms", np.int64),
+    ("switch_ms", np.int64),
+    ("stop_ms", np.int64),
+    ("inspired_volume", np.float64),        # L
+    ("expired_volume", np.float64),         # L
+    ("peak_inspiratory_flow", np.float64),  # L/s
+    ("peak_expiratory_flow", np.float64),   # L/s, as a positive number
+])
+
+###########################################################################
+
+# here is a class to find breaths in a flow signal as it arrives. threshold
+# (L/s) is how far past zero the flow has to go before the phase changes.
+
+class breath_detector:
+
+    __slots__ = ("threshold", "phase", "count", "breaths", "volume", \
+    "last_flow", "last_ms", "last_rise", "last_fall", "start", "switch", \
+    "peak_in", "peak_out")
+
+    def __init__(self, threshold = 0.05):
+
+        if threshold <= 0.:
+            raise ValueError("threshold has to be bigger than zero")
+
+        self.threshold = float(threshold)
+
+        # 1 breathing in, -1 breathing out, 0 not known yet.
+        self.phase = 0
+
+        # samples seen, and breaths handed back.
+        self.count = 0
+        self.breaths = 0
+
+        # integral of the flow (L) up to the last sample, and the last sample.
+        self.volume = 0.
+        self.last_flow = None
+        self.last_ms = None
+
+        # (sample, millis, volume) at the last turn to positive and to
+        # negative flow, and at the start and switch of the breath going on.
+        self.last_rise = None
+        self.last_fall = None
+        self.start = None
+        self.switch = None
+
+        # biggest flow in and out in the phases so far.
+        self.peak_in = 0.
+        self.peak_out = 0.
+
+    ###########################################################################
+
+    # here is a function to add one sample: millis and flow (L/s). It hands
+    # back the breath that just ended (a row of breath_dtype), or None. Each
+    # sample only does a few comparisons and additions.
+
+    def update(self, millis, flow):
+
+        millis = int(millis)
+        flow = float(flow)
+
+        # a sensor dropout: carry on with the last flow.
+        if not math.isfinite(flow):
+            flow = self.last_flow if self.last_flow is not None else 0.
+
+        i = self.count
+        self.count = self.count + 1
+
+        if self.last_flow is None:
+            self.last_rise = self.last_fall = (i, millis, self.volume)
+        else:
+            self.volume = self.volume + 0.5 * (flow + self.last_flow) * \
+            max(millis - self.last_ms, 0) / 1000.
+            if self.last_flow <= 0. < flow:
+                self.last_rise = (i, millis, self.volume)
+            elif self.last_flow >= 0. > flow:
+                self.last_fall = (i, millis, self.volume)
+
+        self.last_flow = flow
+        self.last_ms = millis
+
+        breath = None
+
+        if flow > self.threshold and self.phase != 1:
+            breath = self._breathe_in(flow)
+        elif flow < -self.threshold and self.phase != -1:
+            self._breathe_out(flow)
+        elif self.phase == 1:
+            self.peak_in = max(self.peak_in, flow)
+        elif self.phase == -1:
+            self.peak_out = max(self.peak_out, -flow)
+
+        return breath
+
+    ###########################################################################
+    # end of class function update
+    ###########################################################################
+
+    # here is a function to add a chunk of samples at once. It hands back
+    # the breaths that ended in it (an array of breath_dtype). The work on
+    # the samples is done with numpy; only the phase changes (a few per
+    # breath) are gone through one by one.
+
+    def update_array(self, millis, flows):
+
+        millis = np.asarray(millis, dtype = np.int64).ravel()
+        flows = np.asarray(flows, dtype = float).ravel()
+
+        if millis.size != flows.size:
+            raise ValueError("millis and flows have to be the same length")
+
+        n = flows.size
+        if n == 0:
+            return np.zeros(0, dtype = breath_dtype)
+
+        flows = self._fill_dropouts(flows)
+        first = self.count
+        index = first + np.arange(n)
+
+        # the running integral, and the sign changes, carrying on from the
+        # last sample of the last chunk.
+        if self.last_flow is None:
+            previous_flow = np.concatenate(([flows[0]], flows[:-1]))
+            previous_ms = np.concatenate(([millis[0]], millis[:-1]))
+        else:
+            previous_flow = np.concatenate(([self.last_flow], flows[:-1]))
+            previous_ms = np.concatenate(([self.last_ms], millis[:-1]))
+
+        steps = 0.5 * (flows + previous_flow) * np.maximum(millis - previous_ms, 0) / 1000.
+        volume = self.volume + np.cumsum(steps)
+
+        rises = np.flatnonzero((previous_flow <= 0.) & (flows > 0.))
+        falls = np.flatnonzero((previous_flow >= 0.) & (flows < 0.))
+
+        if self.last_flow is None:
+            self.last_rise = self.last_fall = (first, int(millis[0]), self.volume)
+
+        # the phase each sample wants, and where it actually changes: the
+        # first sample past the threshold the other way.
+        wanted = np.where(flows > self.threshold, 1, np.where(flows < -self.threshold, -1, 0))
+        decided = np.flatnonzero(wanted)
+        phase = np.concatenate(([self.phase], wanted[decided]))
+        changes = decided[phase[1:] != phase[:-1]]
+
+        # the biggest flows in and out between one change and the next (the
+        # first piece is the end of the phase carried over).
+        bounds = np.concatenate(([0], changes, [n]))
+        highest = np.maximum.reduceat(flows, bounds[:-1])
+        lowest = np.minimum.reduceat(flows, bounds[:-1])
+
+        breaths = []
+
+        for piece in range(bounds.size - 1):
+
+            if piece > 0:
+
+                change = bounds[piece]
+
+                # the last sign changes at or before it are where the phase
+                # turned.
+                k = np.searchsorted(rises, change, side = "right") - 1
+                if k >= 0:
+                    self.last_rise = (int(index[rises[k]]), int(millis[rises[k]]), \
+                    float(volume[rises[k]]))
+                k = np.searchsorted(falls, change, side = "right") - 1
+                if k >= 0:
+                    self.last_fall = (int(index[falls[k]]), int(millis[falls[k]]), \
+                    float(volume[falls[k]]))
+
+                if wanted[change] == 1:
+                    breath = self._breathe_in(flows[change])
+                    if breath is not None:
+                        breaths.append(breath)
+                else:
+                    self._breathe_out(flows[change])
+
+            if bounds[piece + 1] > bounds[piece]:
+                if self.phase == 1:
+                    self.peak_in = max(self.peak_in, float(highest[piece]))
+                elif self.phase == -1:
+                    self.peak_out = max(self.peak_out, -float(lowest[piece]))
+
+        # and remember the last sign changes for the next chunk.
+        if rises.size > 0:
+            self.last_rise = (int(index[rises[-1]]), int(millis[rises[-1]]), float(volume[rises[-1]]))
+        if falls.size > 0:
+            self.last_fall = (int(index[falls[-1]]), int(millis[falls[-1]]), float(volume[falls[-1]]))
+
+        self.count = first + n
+        self.volume = float(volume[-1])
+        self.last_flow = float(flows[-1])
+        self.last_ms = int(millis[-1])
+
+        if not breaths:
+            return np.zeros(0, dtype = breath_dtype)
+
+        return np.array(breaths, dtype = breath_dtype)
+
+    ###########################################################################
+    # end of class function update_array
+    ###########################################################################
+
+    # here is a function to replace dropouts (NaN) with the last good flow
+    # before them.
+
+    def _fill_dropouts(self, flows):
+
+        bad = ~np.isfinite(flows)
+
+        if not bad.any():
+            return flows
+
+        last = self.last_flow if self.last_flow is not None else 0.
+        good_index = np.where(bad, -1, np.arange(flows.size))
+        good_index = np.maximum.accumulate(good_index)
+
+        return np.where(good_index >= 0, flows[np.maximum(good_index, 0)], last)
+
+    ###########################################################################
+    # end of class function _fill_dropouts
+    ###########################################################################
+
+    # here are the functions for the two phase changes. Turning to
+    # inspiration ends the breath going on (if one has been seen all the
+    # way through its expiration) and starts the next one at the last turn
+    # to positive flow; turning to expiration marks the switch at the last
+    # turn to negative flow.
+
+    def _breathe_in(self, flow):
+
+        breath = None
+
+        if self.phase == -1 and self.start is not None and self.switch is not None:
+
+            start, switch, stop = self.start, self.switch, self.last_rise
+
+            breath = (self.breaths, start[0], switch[0], stop[0], start[1], \
+            switch[1], stop[1], switch[2] - start[2], switch[2] - stop[2], \
+            self.peak_in, self.peak_out)
+
+            self.breaths = self.breaths + 1
+
+        self.start = self.last_rise
+        self.switch = None
+        self.phase = 1
+        self.peak_in = float(flow)
+        self.peak_out = 0.
+
+        return None if breath is None else np.array(breath, dtype = breath_dtype)
+
+    def _breathe_out(self, flow):
+
+        if self.phase == 1:
+            self.switch = self.last_fall
+
+        self.phase = -1
+        self.peak_out = -float(flow)
+
+    ###########################################################################
+    # end of class functions _breathe_in and _breathe_out
+    ###########################################################################
+
+###########################################################################
+# end of class breath_detector
+###########################################################################
+
+# here is the function to find all the breaths in a whole recording at
+# once: millis and flow (L/s) arrays.
+
+def find_breaths(millis, flow, threshold = 0.05):
+
+    return breath_detector(threshold).update_array(millis, flow)
+
+###########################################################################
+# end of function find_breaths
+###########################################################################
+
+# here is a function to work out the flow (L/s) through the insert for a
+# whole run, from the pressure drop between high and low: p0 - p1 across
+# the constriction by default, or p1 - p2 (high = "p1", low = "p2") for
+# the other side of it. The no-flow offset is followed through the run
+# with runningStats.tracked_baseline, and each half of a breath gets the
+# right sign: air going the other way drops the pressure the other way.
+
+def run_flow(run, high = "p0", low = "p1", rho = vf.RHO_AIR, a1 = vf.A1, a2 = vf.A2):
+
+    dp = vf.corrected_differential(run[high], run[low]) - \
+    rs.tracked_baseline(run, high, low)
+
+    return vf.volumetric_flow(dp, rho, a1, a2)
+
+###########################################################################
+# end of function run_flow
+###########################################################################
+
+# here is a function to print a table of breaths.
+
+def print_breaths(breaths):
+
+    print("%6s %12s %8s %8s %10s %10s %9s %9s" % ("breath", "start (ms)", \
+    "in (s)", "out (s)", "in (L)", "out (L)", "peak in", "peak out"))
+
+    for breath in breaths:
+        print("%6d %12d %8.3f %8.3f %10.4f %10.4f %9.4f %9.4f" % (breath["number"], \
+        breath["start_ms"], (breath["switch_ms"] - breath["start_ms"]) / 1000., \
+        (breath["stop_ms"] - breath["switch_ms"]) / 1000., breath["inspired_volume"], \
+        breath["expired_volume"], breath["peak_inspiratory_flow"], \
+        breath["peak_expiratory_flow"]))
+
+###########################################################################
+# end of function print_breaths
+###########################################################################
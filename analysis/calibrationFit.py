@@ -0,0 +1,597 @@
+###################################################################
+
+# This file is calibrationFit.py. It calibrates the venturi inserts
+# against the reference flows they were run at, instead of comparing
+# measured and expected by eye ("Measured Flow Rate Minus Expected",
+# "Expected: 1.3 Pa" ...).
+
+# The reference flows come from the block format files (formatRegistry):
+# the "flow rate=0.66" headers of the insert files and the pump settings of
+# the long tube files. Each run at a flow gives one calibration point: its
+# mean pressure drop, in Pa, less that of the pump-off run before it. The
+# points are grouped by device (the data file, unless you say otherwise)
+# and insert configuration ("diffuser on input" or "diffuser on output",
+# from the set-up notes in the file).
+
+# Each group gets a least-squares polynomial
+#   dp = c0 + c1 Q + c2 Q**2 (+ c3 Q**3)          (Pa, Q in L/s)
+# weighted by the number of samples in each run; Bernoulli says dp goes as
+# Q**2 alone (venturiFlow), so c2 should come out near
+# expected_coefficients()[2]. All the groups are fitted at once: the normal
+# equations of every group are added up with np.add.at and solved as one
+# stack of small matrices.
+
+# Fits are saved to a JSON file that keeps every version: saving again
+# adds a new version for each group whose coefficients changed, and
+# load_fits hands back the latest (or any earlier) one.
+
+# To turn pressure drops into flows, calibration_curve inverts a fitted
+# curve once, into a table of flows at evenly spaced pressure drops, so
+# converting any number of samples is one multiply, one gather and one
+# linear interpolation, with no square roots. The curve is taken to be odd
+# about dp = c0 (air going the other way gives the same pressure drop the
+# other way), and is extrapolated in a straight line past the ends of the
+# table.
+
+# use this way:
+#   import calibrationFit as cf
+#
+#   points = cf.calibration_points(["Data/Initial Insert Data.csv", \
+#   "Data/Extended Insert Data.csv"])
+#   fits = cf.fit_curves(points)
+#   cf.print_fits(fits)
+#   cf.save_fits(fits, "calibration.json", note = "Nov 2021 insert runs")
+#
+#   curve = cf.load_curve("calibration.json", "Initial Insert Data", \
+#   "diffuser on input")
+#   flow = curve.flow(dp)
+#
+# or from the command line:
+#   python calibrationFit.py "Data/Initial Insert Data.csv" --save calibration.json
+
+import argparse
+import datetime
+import functools
+import json
+import os
+import tempfile
+
+import numpy as np
+
+import formatRegistry as fr
+import venturiFlow as vf
+
+# bump this if the layout of the saved file changes.
+_FIT_FORMAT = 1
+
+# highest polynomial degree fit_curves will do.
+max_degree = 3
+
+# one row per calibration point (a run at a reference flow).
+point_dtype = np.dtype([
+    ("device", "U40"),
+    ("configuration", "U24"),
+    ("source", "U40"),
+    ("run", np.int32),
+    ("flow", np.float64),          # L/s, reference
+    ("n", np.int64),
+    ("dp_mean", np.float64),       # Pa, pump-off corrected
+    ("dp_std", np.float64),
+])
+
+# one row per fitted curve. coefficients[k] multiplies Q**k, and the ones
+# past degree are zero. rms is the weighted rms residual, in Pa.
+fit_dtype = np.dtype([
+    ("device", "U40"),
+    ("configuration", "U24"),
+    ("version", np.int32),
+    ("degree", np.int32),
+    ("coefficients", np.float64, (max_degree + 1,)),
+    ("npoints", np.int64),
+    ("flow_min", np.float64),
+    ("flow_max", np.float64),
+    ("rms", np.float64),
+])
+
+###########################################################################
+
+# here is a function to work out the insert configuration from a set-up
+# note: "diffuser on input" or "diffuser on output" (the notes aren't
+# always spelled the same way), or "" if the note doesn't say.
+
+def configuration_of(section):
+
+    section = section.lower()
+
+    if "output" in section:
+        return "diffuser on output"
+
+    if "input" in section:
+        return "diffuser on input"
+
+    return ""
+
+###########################################################################
+# end of function configuration_of
+###########################################################################
+
+# here is the function to get the calibration points out of block format
+# files: one per run at a reference flow, with the mean of
+# 100 * (high - low) less that of the last pump-off run before it. device
+# is a name for each file (or one name for all of them); it defaults to the
+# file name without its extension.
+
+def calibration_points(filenames, high = "c0", low = "c1", device = None):
+
+    if isinstance(filenames, str):
+        filenames = [filenames]
+
+    if device is None or isinstance(device, str):
+        device = [device] * len(filenames)
+
+    points = []
+
+    for filename, name in zip(filenames, device):
+
+        if name is None:
+            name = os.path.splitext(os.path.basename(filename))[0]
+
+        rows = fr.load_blocks(filename)
+        rows = rows[rows["run"] >= 0]
+
+        if rows.size == 0:
+            continue
+
+        runs, first, group = np.unique(rows["run"], return_index = True, \
+        return_inverse = True)
+
+        dp = vf.corrected_differential(rows[high], rows[low])
+        good = np.isfinite(dp)
+        count, dp_mean, dp_std = vf.group_mean_std(dp[good], group[good], runs.size)
+
+        flow = rows["flow_rate"][first]
+        sections = rows["section"][first]
+
+        # the pump-off run each run is measured from: the last one before it.
+        off = (flow == 0.) & (count > 0)
+        last_off = np.maximum.accumulate(np.where(off, np.arange(runs.size), -1))
+        baseline = np.where(last_off >= 0, dp_mean[np.maximum(last_off, 0)], 0.)
+
+        keep = np.isfinite(flow) & (flow > 0.) & (count > 0)
+
+        table = np.zeros(np.count_nonzero(keep), dtype = point_dtype)
+        table["device"] = name
+        table["configuration"] = [configuration_of(section) for section in sections[keep]]
+        table["source"] = os.path.basename(filename)
+        table["run"] = runs[keep]
+        table["flow"] = flow[keep]
+        table["n"] = count[keep]
+        table["dp_mean"] = dp_mean[keep] - baseline[keep]
+        table["dp_std"] = dp_std[keep]
+
+        points.append(table)
+
+    if not points:
+        return np.zeros(0, dtype = point_dtype)
+
+    return np.concatenate(points)
+
+###########################################################################
+# end of function calibration_points
+###########################################################################
+
+# here is the function to fit a polynomial of the given degree to every
+# (device, configuration) group of points at once. Groups with fewer
+# points (distinct flows) than coefficients come back with the
+# minimum-norm solution rather than an error.
+
+def fit_curves(points, degree = 2):
+
+    if degree < 1 or degree > max_degree:
+        raise ValueError("degree has to be between 1 and %d" % max_degree)
+
+    if points.size == 0:
+        return np.zeros(0, dtype = fit_dtype)
+
+    keys, group = np.unique(np.stack((points["device"], points["configuration"]), \
+    axis = 1), axis = 0, return_inverse = True)
+    group = group.reshape(-1)
+    ngroups = len(keys)
+    ncoefficients = degree + 1
+
+    flow = points["flow"]
+    dp = points["dp_mean"]
+    weight = points["n"].astype(float)
+
+    # X[i, k] = flow[i]**k
+    X = flow[:, None] ** np.arange(ncoefficients)
+
+    # the normal equations (X^T W X) c = X^T W dp, for every group at once.
+    XtX = np.zeros((ngroups, ncoefficients, ncoefficients))
+    Xty = np.zeros((ngroups, ncoefficients))
+    np.add.at(XtX, group, weight[:, None, None] * X[:, :, None] * X[:, None, :])
+    np.add.at(Xty, group, (weight * dp)[:, None] * X)
+
+    coefficients = np.einsum("gij,gj->gi", np.linalg.pinv(XtX), Xty)
+
+    residual = dp - np.einsum("ik,ik->i", X, coefficients[group])
+    wsum = np.bincount(group, weights = weight, minlength = ngroups)
+    chi2 = np.bincount(group, weights = weight * residual * residual, minlength = ngroups)
+
+    fits = np.zeros(ngroups, dtype = fit_dtype)
+    fits["device"] = keys[:, 0]
+    fits["configuration"] = keys[:, 1]
+    fits["degree"] = degree
+    fits["coefficients"][:, :ncoefficients] = coefficients
+    fits["npoints"] = np.bincount(group, minlength = ngroups)
+    fits["flow_min"] = np.full(ngroups, np.inf)
+    fits["flow_max"] = np.full(ngroups, -np.inf)
+    np.minimum.at(fits["flow_min"], group, flow)
+    np.maximum.at(fits["flow_max"], group, flow)
+    fits["rms"] = np.sqrt(chi2 / wsum)
+
+    return fits
+
+###########################################################################
+# end of function fit_curves
+###########################################################################
+
+# here is a function to give the coefficients Bernoulli's equation says a
+# curve should have (see venturiFlow.expected_differential), to compare
+# fits with.
+
+def expected_coefficients(rho = vf.RHO_AIR, a1 = vf.A1, a2 = vf.A2):
+
+    coefficients = np.zeros(max_degree + 1)
+    coefficients[2] = vf.expected_differential(1., rho, a1, a2)
+
+    return coefficients
+
+###########################################################################
+# end of function expected_coefficients
+###########################################################################
+
+# here is a function to work out, for each point, the flow its fitted curve
+# gives for its pressure drop less the reference flow (L/s): the measured
+# minus expected of the plots, after calibration. Points whose curve can't
+# be inverted (see invertible) are left as NaN.
+
+def flow_residuals(points, fits):
+
+    residuals = np.full(points.size, np.nan)
+
+    for fit in fits:
+        mine = (points["device"] == fit["device"]) & \
+        (points["configuration"] == fit["configuration"])
+        if not mine.any():
+            continue
+        try:
+            curve = calibration_curve(fit)
+        except ValueError:
+            continue
+        residuals[mine] = curve.flow(points["dp_mean"][mine]) - points["flow"][mine]
+
+    return residuals
+
+###########################################################################
+# end of function flow_residuals
+###########################################################################
+
+# here is a function to tell whether a fitted curve can be turned into a
+# calibration_curve (one that goes up all the way from zero flow to
+# flow_limit; a quarter past the highest calibrated flow if not given).
+# A fitted c1 well below zero can make the curve dip first.
+
+def invertible(fit, table_size = 1 << 16, flow_limit = None):
+
+    coefficients, flow_limit = _curve_setup(fit, table_size, flow_limit)
+    fine, rise = _fine_curve(coefficients, flow_limit, table_size)
+
+    return bool(np.all(np.diff(rise) > 0.))
+
+###########################################################################
+# end of function invertible
+###########################################################################
+
+# here is the function to save fits to a calibration file. Each fit becomes
+# a new version of its (device, configuration), unless its coefficients are
+# the same as the latest version's already. note is kept with the new
+# versions (where the points came from, say). Hands back the fits with
+# their version numbers filled in.
+
+def save_fits(fits, path, note = ""):
+
+    saved = _read_file(path)
+    curves = saved["curves"]
+
+    created = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+    fits = fits.copy()
+
+    for fit in fits:
+
+        history = [curve for curve in curves if curve["device"] == fit["device"] \
+        and curve["configuration"] == fit["configuration"]]
+
+        if history and history[-1]["coefficients"] == fit["coefficients"].tolist() \
+        and history[-1]["degree"] == fit["degree"]:
+            fit["version"] = history[-1]["version"]
+            continue
+
+        fit["version"] = history[-1]["version"] + 1 if history else 1
+
+        curve = {name: fit[name].tolist() for name in fit_dtype.names}
+        curve["created"] = created
+        curve["note"] = note
+        curves.append(curve)
+
+    # write a new file and swap it in, so nobody ever reads half of one.
+    parent = os.path.dirname(os.path.abspath(path))
+    handle, scratch = tempfile.mkstemp(dir = parent, suffix = ".json")
+
+    with os.fdopen(handle, "w") as f:
+        json.dump(saved, f, indent = 1)
+
+    os.replace(scratch, path)
+
+    return fits
+
+###########################################################################
+# end of function save_fits
+###########################################################################
+
+# here is the function to read fits back: the latest version of each
+# (device, configuration), or the given version where there is one.
+
+def load_fits(path, version = None):
+
+    latest = {}
+
+    for curve in _read_file(path)["curves"]:
+        if version is None or curve["version"] == version:
+            latest[(curve["device"], curve["configuration"])] = curve
+
+    fits = np.zeros(len(latest), dtype = fit_dtype)
+
+    for fit, curve in zip(fits, latest.values()):
+        for name in fit_dtype.names:
+            fit[name] = curve[name]
+
+    return fits
+
+###########################################################################
+# end of function load_fits
+###########################################################################
+
+# here is a function to list every saved version of one curve, oldest
+# first, as dictionaries (with when each was saved and its note).
+
+def fit_history(path, device, configuration):
+
+    return [curve for curve in _read_file(path)["curves"] \
+    if curve["device"] == device and curve["configuration"] == configuration]
+
+###########################################################################
+# end of function fit_history
+###########################################################################
+
+# here is a function to read a calibration file, or start a new one if
+# there isn't one yet.
+
+def _read_file(path):
+
+    if not os.path.exists(path):
+        return {"format": _FIT_FORMAT, "curves": []}
+
+    with open(path) as f:
+        saved = json.load(f)
+
+    if saved.get("format") != _FIT_FORMAT:
+        raise ValueError(repr(path) + " isn't a calibration file this version can read")
+
+    return saved
+
+###########################################################################
+# end of function _read_file
+###########################################################################
+
+# here is the function to get the curve for a device and configuration
+# from a calibration file, ready to use. Curves are kept once made (until
+# the file changes), so asking again costs nothing.
+
+def load_curve(path, device, configuration, version = None, table_size = 1 << 16, \
+flow_limit = None):
+
+    stat = os.stat(path)
+
+    return _cached_curve(os.path.abspath(path), stat.st_mtime_ns, stat.st_size, \
+    device, configuration, version, table_size, flow_limit)
+
+@functools.lru_cache(maxsize = 64)
+def _cached_curve(path, mtime_ns, size, device, configuration, version, \
+table_size, flow_limit):
+
+    fits = load_fits(path, version)
+    mine = fits[(fits["device"] == device) & (fits["configuration"] == configuration)]
+
+    if mine.size == 0:
+        raise ValueError("no calibration for " + repr(device) + ", " + \
+        repr(configuration) + " in " + repr(path))
+
+    return calibration_curve(mine[0], table_size, flow_limit)
+
+###########################################################################
+# end of function load_curve
+###########################################################################
+
+# here is the class that turns pressure drops (Pa) into flows (L/s) with a
+# fitted curve (a row of fit_dtype, or just the coefficients). The table
+# covers flows out to flow_limit either way (a quarter past the highest
+# calibrated flow if not given), in table_size steps of equal dp.
+
+class calibration_curve:
+
+    __slots__ = ("coefficients", "flow_limit", "dp_start", "dp_step", "flows", "slopes")
+
+    def __init__(self, fit, table_size = 1 << 16, flow_limit = None):
+
+        self.coefficients, self.flow_limit = _curve_setup(fit, table_size, flow_limit)
+
+        fine, rise = _fine_curve(self.coefficients, self.flow_limit, table_size)
+
+        if not np.all(np.diff(rise) > 0.):
+            raise ValueError("the curve doesn't go up all the way from 0 to " + \
+            "%g L/s, so it can't be inverted (try a lower degree)" % self.flow_limit)
+
+        fine = np.concatenate((-fine[:0:-1], fine))
+        rise = np.concatenate((-rise[:0:-1], rise))
+
+        dp = np.linspace(rise[0], rise[-1], table_size)
+
+        self.dp_start = dp[0] + self.coefficients[0]
+        self.dp_step = dp[1] - dp[0]
+        self.flows = np.interp(dp, rise, fine)
+        self.slopes = np.append(np.diff(self.flows), 0.)
+
+    ###########################################################################
+
+    # here is a function to work out the pressure drop (Pa) for flows (L/s)
+    # from the polynomial itself.
+
+    def differential(self, flow):
+
+        flow = np.asarray(flow, dtype = float)
+        size = np.abs(flow)
+
+        rise = np.polynomial.polynomial.polyval(size, self.coefficients) - \
+        self.coefficients[0]
+
+        return self.coefficients[0] + np.sign(flow) * rise
+
+    ###########################################################################
+    # end of class function differential
+    ###########################################################################
+
+    # here is the function to turn pressure drops (Pa, any shape) into flows
+    # (L/s) from the table.
+
+    def flow(self, dp):
+
+        dp = np.asarray(dp, dtype = float)
+
+        x = dp.reshape(-1) * (1. / self.dp_step)
+        x -= self.dp_start / self.dp_step
+
+        # which table entry each one is past. fmax and fmin send NaN to 0
+        # (it stays NaN in x), and past the ends the end entries' slopes
+        # carry on.
+        index = np.fmax(x, 0.)
+        np.fmin(index, self.flows.size - 2, out = index)
+        index = index.astype(np.intp)
+
+        x -= index
+        x *= self.slopes[index]
+        x += self.flows[index]
+
+        return x.reshape(dp.shape)
+
+    ###########################################################################
+    # end of class function flow
+    ###########################################################################
+
+###########################################################################
+# end of class calibration_curve
+###########################################################################
+
+# here is a function to check and sort out what calibration_curve (and
+# invertible) are given: the coefficients, as an array, and the flow_limit.
+
+def _curve_setup(fit, table_size, flow_limit):
+
+    if isinstance(fit, np.void):
+        coefficients = fit["coefficients"]
+        if flow_limit is None:
+            flow_limit = 1.25 * fit["flow_max"]
+    else:
+        coefficients = fit
+
+    if flow_limit is None or not flow_limit > 0.:
+        raise ValueError("calibration_curve needs a flow_limit above zero")
+
+    if table_size < 2:
+        raise ValueError("the table needs at least 2 entries")
+
+    return np.array(coefficients, dtype = float), float(flow_limit)
+
+###########################################################################
+# end of function _curve_setup
+###########################################################################
+
+# here is a function to work out a curve on a fine grid of flows from 0 to
+# flow_limit, closer together near zero where dp changes slowest, to
+# invert it from: the flows, and how far dp has risen above c0 at each.
+
+def _fine_curve(coefficients, flow_limit, table_size):
+
+    fine = flow_limit * np.linspace(0., 1., 8 * table_size) ** 2
+    rise = np.polynomial.polynomial.polyval(fine, coefficients) - coefficients[0]
+
+    return fine, rise
+
+###########################################################################
+# end of function _fine_curve
+###########################################################################
+
+# here is a function to print fits, one line per curve, with how far c2 is
+# from what Bernoulli's equation expects. Curves that can't be inverted
+# (so load_curve and calibration_curve will refuse them) are marked "no".
+
+def print_fits(fits, rho = vf.RHO_AIR):
+
+    expected = expected_coefficients(rho)[2]
+
+    print("%-28s %-20s %4s %4s %9s %9s %9s %9s %5s %11s %8s %4s" % ("device", \
+    "configuration", "ver", "deg", "c0", "c1", "c2", "c3", "n", "Q range", \
+    "rms (Pa)", "inv"))
+
+    inverts = [invertible(fit) for fit in fits]
+
+    for fit, inverts_ok in zip(fits, inverts):
+        c = fit["coefficients"]
+        print("%-28s %-20s %4d %4d %9.3f %9.3f %9.3f %9.3f %5d %5.2f-%5.2f %8.3f %4s" % \
+        (fit["device"][:28], fit["configuration"][:20], fit["version"], \
+        fit["degree"], c[0], c[1], c[2], c[3], fit["npoints"], fit["flow_min"], \
+        fit["flow_max"], fit["rms"], "yes" if inverts_ok else "no"))
+
+    print("Bernoulli c2 = %.3f Pa/(L/s)^2" % expected)
+
+    if not all(inverts):
+        print("curves marked \"no\" don't go up all the way from zero flow, " + \
+        "so they can't be turned into flows (try a lower degree)")
+
+###########################################################################
+# end of function print_fits
+###########################################################################
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = \
+    "fit calibration curves of pressure drop against reference flow")
+    parser.add_argument("files", nargs = "+")
+    parser.add_argument("--high", default = "c0")
+    parser.add_argument("--low", default = "c1")
+    parser.add_argument("--degree", type = int, default = 2)
+    parser.add_argument("--device", default = None, \
+    help = "one device name for all the files (default: each file's name)")
+    parser.add_argument("--save", default = None, help = "calibration file to add to")
+    parser.add_argument("--note", default = "")
+    arguments = parser.parse_args()
+
+    points = calibration_points(arguments.files, arguments.high, arguments.low, \
+    arguments.device)
+    fits = fit_curves(points, arguments.degree)
+
+    if arguments.save is not None:
+        fits = save_fits(fits, arguments.save, arguments.note)
+
+    print_fits(fits)
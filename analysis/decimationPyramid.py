@@ -0,0 +1,459 @@
+###################################################################
+
+# This file is decimationPyramid.py. It is for looking at long recordings
+# (a day at 128 samples a second is 11 million points per channel) without
+# plotting every sample: a pyramid keeps the min, max and mean of every
+# block of 2**k samples, for k = first_level, first_level + 1, ... up to
+# one block for the whole recording. Any range of samples can then be
+# drawn at screen resolution (pixels points) from the level whose blocks
+# are just smaller than a pixel, which takes time in proportion to pixels,
+# however long the range is. The min/max envelope still shows every spike
+# that a plain "every n-th sample" would miss.
+
+# Levels below first_level would take more room than the samples
+# themselves, so ranges short enough to need them are worked out from the
+# samples directly (at most pixels * 2**first_level of them). Blocks are
+# whole blocks: at the ends of a range a pixel can take in a few samples
+# from just outside it. NaNs (dropouts) are left out of the min, max and
+# mean; a block with nothing but NaNs gives NaN.
+
+# New samples can be added to the end (extend) as they come in: only the
+# last block or two of each level is redone, so adding a batch of samples
+# takes a fraction of a millisecond however long the recording is.
+
+# cached_pyramid keeps each pyramid next to the run's cached copy (see
+# runCache), so it is only worked out once; if the data file has grown
+# since, the pyramid is extended to the new length rather than worked out
+# again.
+
+# use this way:
+#   import decimationPyramid as dm
+#
+#   pyramid = dm.cached_pyramid("Data/DPS310E_22_04_21_a.CSV", "p0")
+#   view = pyramid.query(0, len(pyramid), pixels = 1000)
+#   plt.fill_between(view["start"], view["min"], view["max"])
+#
+#   dm.zoom_plot(pyramid, title = "inlet")      # redrawn as you zoom
+#
+# or as the data arrive:
+#   pyramid = dm.pyramid()
+#   pyramid.extend(new["flow"])
+
+import os
+import tempfile
+
+import numpy as np
+
+import runCache as rc
+
+# bump this if the layout of the saved pyramids changes.
+_PYRAMID_FORMAT = 1
+
+# one row per point of a view: the samples it covers (start up to stop - 1)
+# and their min, max and mean.
+view_dtype = np.dtype([
+    ("start", np.int64),
+    ("stop", np.int64),
+    ("min", np.float64),
+    ("max", np.float64),
+    ("mean", np.float64),
+])
+
+# samples to work through at once when making the first level.
+_chunk_samples = 1 << 22
+
+###########################################################################
+
+# here is the class. values are the samples to start with (a numpy array
+# or memory map; it isn't copied until samples are added with extend).
+
+class pyramid:
+
+    __slots__ = ("first_level", "values", "size", "mins", "maxs", "sums", "counts")
+
+    def __init__(self, values = None, first_level = 3):
+
+        if first_level < 1:
+            raise ValueError("first_level has to be at least 1")
+
+        self.first_level = int(first_level)
+        self.values = np.zeros(0) if values is None else values
+        self.size = 0
+
+        # one array per level, with room to grow past the blocks in use.
+        self.mins = []
+        self.maxs = []
+        self.sums = []
+        self.counts = []
+
+        self._update(len(self.values))
+
+    def __len__(self):
+        return self.size
+
+    ###########################################################################
+
+    # here is a function to add samples to the end.
+
+    def extend(self, values):
+
+        values = np.asarray(values, dtype = float).ravel()
+        size = self.size + values.size
+
+        # the samples live in a buffer of our own from now on, twice as big
+        # as it needs to be each time it fills up.
+        if not isinstance(self.values, np.ndarray) or \
+        isinstance(self.values, np.memmap) or size > self.values.size or \
+        not self.values.flags.writeable:
+            buffer = np.empty(max(size, 2 * self.size, 1024))
+            buffer[:self.size] = self.values[:self.size]
+            self.values = buffer
+
+        self.values[self.size:size] = values
+
+        self._update(size)
+
+    ###########################################################################
+    # end of class function extend
+    ###########################################################################
+
+    # here is the function to get a view of samples start up to stop - 1,
+    # as at most pixels points (view_dtype). A range of pixels samples or
+    # fewer comes back one sample a point.
+
+    def query(self, start, stop, pixels = 1000):
+
+        pixels = max(1, int(pixels))
+        start = max(0, int(start))
+        stop = min(self.size, int(stop))
+
+        n = stop - start
+        if n <= 0:
+            return np.zeros(0, dtype = view_dtype)
+
+        if n <= pixels:
+            view = np.zeros(n, dtype = view_dtype)
+            view["start"] = np.arange(start, stop)
+            view["stop"] = view["start"] + 1
+            values = np.asarray(self.values[start:stop], dtype = float)
+            view["min"] = view["max"] = view["mean"] = values
+            return view
+
+        level = int(np.log2(n / pixels))
+
+        if level < self.first_level or not self.mins:
+            # straight from the samples: there are fewer than
+            # pixels * 2**first_level of them.
+            edges = np.unique(start + np.arange(pixels + 1) * n // pixels)
+            lowest, highest, total, count = _block_stats( \
+            np.asarray(self.values[start:stop], dtype = float), edges[:-1] - start)
+            return _view(edges[:-1], edges[1:], lowest, highest, total, count)
+
+        level = min(level, self.first_level + len(self.mins) - 1)
+        i = level - self.first_level
+
+        first_block = start >> level
+        stop_block = ((stop - 1) >> level) + 1
+        nblocks = stop_block - first_block
+
+        # group the blocks in the range into (at most) pixels points.
+        edges = np.unique(np.arange(pixels + 1) * nblocks // pixels)
+        where = first_block + edges[:-1]
+
+        lowest = np.fmin.reduceat(self.mins[i][first_block:stop_block], edges[:-1])
+        highest = np.fmax.reduceat(self.maxs[i][first_block:stop_block], edges[:-1])
+        total = np.add.reduceat(self.sums[i][first_block:stop_block], edges[:-1])
+        count = np.add.reduceat(self.counts[i][first_block:stop_block], edges[:-1])
+
+        return _view(where << level, np.minimum((first_block + edges[1:]) << level, \
+        self.size), lowest, highest, total, count)
+
+    ###########################################################################
+    # end of class function query
+    ###########################################################################
+
+    # here is the function to bring every level up to date with the first
+    # size samples, when it was up to date with the first self.size of
+    # them: only the blocks from the one holding sample self.size onwards
+    # change.
+
+    def _update(self, size):
+
+        old_size = self.size
+        self.size = size
+
+        level = self.first_level
+        i = 0
+
+        while True:
+
+            block = 1 << level
+            nblocks = -(-size // block)
+            first = old_size // block
+
+            if nblocks == 0:
+                break
+
+            if i == len(self.mins):
+                self.mins.append(np.zeros(0))
+                self.maxs.append(np.zeros(0))
+                self.sums.append(np.zeros(0))
+                self.counts.append(np.zeros(0, dtype = np.int64))
+                first = 0
+
+            self._make_room(i, nblocks)
+
+            if i == 0:
+                # from the samples, a chunk at a time.
+                for chunk_start in range(first * block, size, _chunk_samples):
+                    chunk_stop = min(chunk_start + _chunk_samples, size)
+                    values = np.asarray(self.values[chunk_start:chunk_stop], dtype = float)
+                    where = chunk_start // block
+                    stats = _block_stats(values, np.arange(0, values.size, block))
+                    for array, stat in zip((self.mins, self.maxs, self.sums, self.counts), stats):
+                        array[0][where:where + stat.size] = stat
+            else:
+                # from pairs of blocks on the level below.
+                below = -(-size // (block >> 1))
+                starts = np.arange(2 * first, below, 2) - 2 * first
+                pieces = slice(2 * first, below)
+                self.mins[i][first:nblocks] = np.fmin.reduceat(self.mins[i - 1][pieces], starts)
+                self.maxs[i][first:nblocks] = np.fmax.reduceat(self.maxs[i - 1][pieces], starts)
+                self.sums[i][first:nblocks] = np.add.reduceat(self.sums[i - 1][pieces], starts)
+                self.counts[i][first:nblocks] = np.add.reduceat(self.counts[i - 1][pieces], starts)
+
+            if nblocks == 1:
+                break
+
+            level = level + 1
+            i = i + 1
+
+    ###########################################################################
+    # end of class function _update
+    ###########################################################################
+
+    # here is a function to make sure level i has room for nblocks blocks,
+    # doubling its arrays when they fill up.
+
+    def _make_room(self, i, nblocks):
+
+        if nblocks <= self.mins[i].size:
+            return
+
+        room = max(nblocks, 2 * self.mins[i].size)
+
+        for arrays in (self.mins, self.maxs, self.sums, self.counts):
+            grown = np.zeros(room, dtype = arrays[i].dtype)
+            grown[:arrays[i].size] = arrays[i]
+            arrays[i] = grown
+
+    ###########################################################################
+    # end of class function _make_room
+    ###########################################################################
+
+###########################################################################
+# end of class pyramid
+###########################################################################
+
+# here is a function to work out the min, max, sum and count of the
+# samples in blocks starting at starts (the last one runs to the end),
+# leaving NaNs out.
+
+def _block_stats(values, starts):
+
+    good = np.isfinite(values)
+
+    lowest = np.fmin.reduceat(values, starts)
+    highest = np.fmax.reduceat(values, starts)
+    total = np.add.reduceat(np.where(good, values, 0.), starts)
+    count = np.add.reduceat(good.astype(np.int64), starts)
+
+    return lowest, highest, total, count
+
+###########################################################################
+# end of function _block_stats
+###########################################################################
+
+# here is a function to put a view together.
+
+def _view(start, stop, lowest, highest, total, count):
+
+    view = np.zeros(len(start), dtype = view_dtype)
+    view["start"] = start
+    view["stop"] = stop
+    view["min"] = lowest
+    view["max"] = highest
+
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        view["mean"] = total / count
+
+    return view
+
+###########################################################################
+# end of function _view
+###########################################################################
+
+# here is a function to save a pyramid (just the levels; the samples are
+# the run's) to an .npz file. The first and last samples go in too, so
+# load_pyramid can tell whether it still goes with a run.
+
+def save_pyramid(levels, filename):
+
+    arrays = {"format": np.array(_PYRAMID_FORMAT), "size": np.array(levels.size), \
+    "first_level": np.array(levels.first_level), \
+    "ends": np.array([levels.values[0], levels.values[levels.size - 1]], dtype = float) \
+    if levels.size > 0 else np.zeros(0)}
+
+    for i in range(len(levels.mins)):
+        nblocks = -(-levels.size // (1 << (levels.first_level + i)))
+        arrays["min_%d" % i] = levels.mins[i][:nblocks]
+        arrays["max_%d" % i] = levels.maxs[i][:nblocks]
+        arrays["sum_%d" % i] = levels.sums[i][:nblocks]
+        arrays["count_%d" % i] = levels.counts[i][:nblocks]
+
+    parent = os.path.dirname(os.path.abspath(filename))
+    os.makedirs(parent, exist_ok = True)
+    handle, scratch = tempfile.mkstemp(dir = parent, suffix = ".npz")
+
+    with os.fdopen(handle, "wb") as f:
+        np.savez(f, **arrays)
+
+    os.replace(scratch, filename)
+
+###########################################################################
+# end of function save_pyramid
+###########################################################################
+
+# here is a function to read a saved pyramid back, for the samples in
+# values. If they don't start the same way (or there are fewer of them
+# than the pyramid was made from) it hands back None.
+
+def load_pyramid(filename, values):
+
+    try:
+        saved = np.load(filename)
+    except (OSError, ValueError):
+        return None
+
+    with saved:
+
+        if int(saved["format"]) != _PYRAMID_FORMAT:
+            return None
+
+        size = int(saved["size"])
+        if size > len(values) or size == 0:
+            return None
+
+        ends = np.asarray([values[0], values[size - 1]], dtype = float)
+        if not np.array_equal(ends, saved["ends"], equal_nan = True):
+            return None
+
+        levels = pyramid(np.zeros(0), int(saved["first_level"]))
+
+        i = 0
+        while "min_%d" % i in saved:
+            levels.mins.append(saved["min_%d" % i])
+            levels.maxs.append(saved["max_%d" % i])
+            levels.sums.append(saved["sum_%d" % i])
+            levels.counts.append(saved["count_%d" % i])
+            i = i + 1
+
+    levels.values = values
+    levels.size = size
+
+    return levels
+
+###########################################################################
+# end of function load_pyramid
+###########################################################################
+
+# here is the function to get the pyramid of one channel of a data file,
+# with the samples memory mapped from runCache (parser as for
+# runCache.cached_load). It is saved next to the run's cached copy, and
+# only made (or extended, if the file has grown) when it has to be.
+
+def cached_pyramid(filename, channel, parser = None, cache_dir = None, \
+first_level = 3):
+
+    filename = os.path.abspath(filename)
+    values = rc.cached_load(filename, parser, cache_dir)[channel]
+
+    saved = rc._cache_entry(filename, cache_dir) + "_pyramids"
+    path = os.path.join(saved, "%s_%d.npz" % (channel, first_level))
+
+    levels = load_pyramid(path, values)
+
+    if levels is None:
+        levels = pyramid(values, first_level)
+    elif levels.size == len(values):
+        return levels
+    else:
+        levels._update(len(values))
+
+    save_pyramid(levels, path)
+
+    return levels
+
+###########################################################################
+# end of function cached_pyramid
+###########################################################################
+
+# here is a function to plot a pyramid so that it is looked at again
+# every time the x range changes (zooming or panning in the plot window):
+# the min/max envelope shaded, the mean as a line, at about one point per
+# pixel of the axes. x is what to plot against (millis, say), one value per
+# sample; sample numbers if it isn't given.
+
+def zoom_plot(levels, x = None, title = "", xlabel = "", ylabel = "", print_now = True):
+
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots()
+    ax.set_title(title)
+    ax.set_xlabel(xlabel if xlabel or x is not None else "sample")
+    ax.set_ylabel(ylabel)
+
+    drawn = {"band": None, "line": None}
+
+    def redraw(start, stop):
+
+        pixels = max(100, int(ax.get_window_extent().width))
+        view = levels.query(start, stop, pixels)
+
+        if view.size == 0:
+            return
+
+        where = (view["start"] + view["stop"] - 1) // 2
+        where = where if x is None else np.asarray(x[where], dtype = float)
+
+        if drawn["band"] is not None:
+            drawn["band"].remove()
+        drawn["band"] = ax.fill_between(where, view["min"], view["max"], \
+        color = "tab:blue", alpha = 0.3, linewidth = 0)
+
+        if drawn["line"] is None:
+            drawn["line"], = ax.plot(where, view["mean"], color = "tab:blue", linewidth = 0.8)
+        else:
+            drawn["line"].set_data(where, view["mean"])
+
+    def on_xlim(axes):
+
+        low, high = axes.get_xlim()
+        if x is not None:
+            low, high = np.searchsorted(x, [low, high])
+        redraw(int(low) - 1, int(high) + 2)
+        axes.figure.canvas.draw_idle()
+
+    redraw(0, len(levels))
+    ax.autoscale_view()
+    ax.set_autoscale_on(False)
+    ax.callbacks.connect("xlim_changed", on_xlim)
+
+    if print_now:
+        plt.show()
+
+    return fig, ax
+
+###########################################################################
+# end of function zoom_plot
+###########################################################################
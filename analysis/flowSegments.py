@@ -0,0 +1,212 @@
+###################################################################
+
+# This file is flowSegments.py. It finds the steady stretches in a pressure
+# recording: the pump-off baseline and the plateaus where the pump runs at
+# a fixed flow rate, with the transitions in between. This replaces picking
+# index windows by eye from scatter plots (p0[180:260] and so on).
+
+# It works on rolling means and standard deviations built from cumulative
+# sums, so the cost grows linearly with the length of the recording.
+
+# use this way:
+#   import flowmeterLoader as fl
+#   import flowSegments as fs
+#
+#   run = fl.load_dps310e("Data/Short Tube Data 4-25.csv")
+#   segments = fs.find_segments(100. * (run["p0"] - run["p3"]))
+#   for segment in segments:
+#       print(segment["label"], segment["start"], segment["stop"], segment["mean"])
+#
+#   inlet = run["p0"][segments[1]["start"]:segments[1]["stop"]]
+
+import numpy as np
+
+# one row per segment. start and stop are python-slice style sample indices.
+# number counts baselines and plateaus separately, starting from 1 (0 for
+# transitions).
+segment_dtype = np.dtype([
+    ("label", "U16"),
+    ("kind", "U10"),
+    ("number", np.int32),
+    ("start", np.int64),
+    ("stop", np.int64),
+    ("mean", np.float64),
+    ("std", np.float64),
+])
+
+###########################################################################
+
+# here is a function to calculate the mean and standard deviation of the
+# "window" samples centred on each sample (fewer at the two ends), using
+# running sums rather than a loop over windows.
+
+def rolling_mean_std(values, window):
+
+    values = np.asarray(values, dtype = float)
+    n = values.size
+
+    # subtract off a typical value first: pressures are ~1000 hPa and we
+    # care about hundredths of a Pascal, so the squares would lose digits.
+    offset = np.median(values) if n > 0 else 0.
+    shifted = values - offset
+
+    running = np.concatenate(([0.], np.cumsum(shifted)))
+    running_sq = np.concatenate(([0.], np.cumsum(shifted * shifted)))
+
+    index = np.arange(n)
+    left = np.clip(index - window // 2, 0, n)
+    right = np.clip(index - window // 2 + window, 0, n)
+    count = right - left
+
+    mean = (running[right] - running[left]) / count
+    mean_square = (running_sq[right] - running_sq[left]) / count
+    std = np.sqrt(np.abs(mean_square - mean * mean))
+
+    return mean + offset, std
+
+###########################################################################
+# end of function rolling_mean_std
+###########################################################################
+
+# here is a function to estimate the sample-to-sample noise in a recording,
+# from the spread of the differences between neighbouring samples. Using
+# the median keeps the steps between plateaus from inflating it.
+
+def noise_level(values):
+
+    steps = np.abs(np.diff(np.asarray(values, dtype = float)))
+
+    if steps.size == 0:
+        return 0.
+
+    return 1.4826 * np.median(steps) / np.sqrt(2.)
+
+###########################################################################
+# end of function noise_level
+###########################################################################
+
+# here is the function to find the segments. values is one pressure
+# channel (or a difference of channels) sampled at a steady rate.
+#   window       number of samples in the rolling mean/std
+#   threshold    rolling std, in the units of values, below which the signal
+#                counts as steady. The flow is noisier at high flow rates
+#                than with the pump off, so by default this is four times
+#                the typical (median) rolling std, and at least a few times
+#                the sample-to-sample noise.
+#   min_length   shortest steady stretch that counts as a segment
+#   tolerance    how close (in the units of values) a steady stretch has to
+#                be to the first one, which is the pump-off baseline, to be
+#                called baseline too. By default a fifth of the distance to
+#                the plateau furthest from the baseline (the baseline drifts
+#                a little over a run), and at least a few times the noise.
+# Everything that isn't baseline or a plateau is a transition.
+
+def find_segments(values, window = 15, threshold = None, min_length = 30, \
+tolerance = None):
+
+    values = np.asarray(values, dtype = float)
+    n = values.size
+
+    if n == 0:
+        return np.zeros(0, dtype = segment_dtype)
+
+    noise = noise_level(values)
+
+    mean, std = rolling_mean_std(values, window)
+
+    if threshold is None:
+        threshold = max(4. * np.median(std), 2.5 * noise)
+
+    # steady samples, and the start/stop of each run of them.
+    steady = np.concatenate(([0], (std <= threshold).astype(np.int8), [0]))
+    edges = np.flatnonzero(np.diff(steady))
+    starts = edges[0::2]
+    stops = edges[1::2]
+
+    long_enough = stops - starts >= min_length
+    starts = starts[long_enough]
+    stops = stops[long_enough]
+
+    # mean and std of each steady run, again from running sums.
+    running = np.concatenate(([0.], np.cumsum(values - mean[0])))
+    running_sq = np.concatenate(([0.], np.cumsum((values - mean[0]) ** 2)))
+    count = stops - starts
+    level = (running[stops] - running[starts]) / np.maximum(count, 1)
+    spread = np.sqrt(np.abs((running_sq[stops] - running_sq[starts]) / \
+    np.maximum(count, 1) - level * level))
+    level = level + mean[0]
+
+    # the recording starts with the pump off, so the first steady run is
+    # the baseline level.
+    if level.size == 0:
+        return np.array([_transition(values, 0, n)], dtype = segment_dtype)
+
+    distance = np.abs(level - level[0])
+
+    if tolerance is None:
+        tolerance = max(0.2 * distance.max(), 4. * noise)
+
+    is_baseline = distance <= tolerance
+
+    # now lay the runs out, with transitions filling the gaps.
+    segments = []
+    previous_stop = 0
+    nbaseline = 0
+    nplateau = 0
+
+    for irun in range(starts.size):
+
+        if starts[irun] > previous_stop:
+            segments.append(_transition(values, previous_stop, starts[irun]))
+
+        if is_baseline[irun]:
+            nbaseline = nbaseline + 1
+            segments.append(("baseline %d" % nbaseline, "baseline", nbaseline, \
+            starts[irun], stops[irun], level[irun], spread[irun]))
+        else:
+            nplateau = nplateau + 1
+            segments.append(("plateau %d" % nplateau, "plateau", nplateau, \
+            starts[irun], stops[irun], level[irun], spread[irun]))
+
+        previous_stop = stops[irun]
+
+    if previous_stop < n:
+        segments.append(_transition(values, previous_stop, n))
+
+    return np.array(segments, dtype = segment_dtype)
+
+###########################################################################
+# end of function find_segments
+###########################################################################
+
+# here is a function to make a transition segment's row.
+
+def _transition(values, start, stop):
+
+    piece = values[start:stop]
+
+    return ("transition", "transition", 0, start, stop, piece.mean(), piece.std())
+
+###########################################################################
+# end of function _transition
+###########################################################################
+
+# here is a function to give every sample the index of the segment it is
+# in, so a whole channel can be split up (or averaged per segment with
+# np.bincount) in one go.
+
+def segment_index(segments, n = None):
+
+    if n is None:
+        n = int(segments["stop"].max()) if segments.size else 0
+
+    which = np.full(n, -1, dtype = np.int64)
+
+    for isegment, segment in enumerate(segments):
+        which[segment["start"]:segment["stop"]] = isegment
+
+    return which
+
+###########################################################################
+# end of function segment_index
+###########################################################################
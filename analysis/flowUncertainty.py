@@ -0,0 +1,422 @@
+###################################################################
+
+# This file is flowUncertainty.py. It puts error bars on flow rates and
+# breath volumes that carry the noise of the pressure sensors all the way
+# through the baseline subtraction and Bernoulli's square root, rather than
+# just taking np.std of the answer.
+
+# There are two ways of making the replicates:
+#   bootstrap    each segment's samples are drawn again, with replacement,
+#                from the ones it has, and so are the pump-off samples the
+#                baseline is the mean of;
+#   montecarlo   every pressure drop gets extra noise of the size the
+#                sensors have (sigma, hPa per channel; worked out from the
+#                run itself if not given), and so does the baseline (that
+#                noise over the root of the number of samples it is an
+#                average of).
+# Each replicate goes through the same arithmetic as venturiFlow
+# (segment_intervals) or breathSegments (breath_intervals), and the
+# confidence interval is the spread of the replicates' answers
+# (percentiles). Breaths only have the montecarlo way: their samples come
+# in order, and they are kept where find_breaths put them, so each
+# replicate gives the same breaths with different volumes.
+
+# The replicates aren't done one at a time: a whole chunk of them is one
+# numpy computation, with the replicates along the first axis of every
+# array. chunk_values caps how many numbers a chunk works on at once (so
+# it caps the memory, about 30 bytes a number); with nproc above 1 the
+# chunks are shared out over a pool of processes. Each chunk gets its own
+# random numbers from seed, so the same seed and chunk_values give the same
+# answer whatever nproc is.
+
+# use this way:
+#   import flowmeterLoader as fl
+#   import flowUncertainty as fu
+#
+#   run = fl.load_dps310e("Data/DPS310E_22_04_21_a.CSV")
+#   table = fu.segment_intervals(run, replicates = 1000, seed = 1)
+#   fu.print_segment_intervals(table)
+#
+#   volumes = fu.breath_intervals(run, replicates = 1000, nproc = 4)
+#   fu.print_breath_intervals(volumes)
+
+import os
+
+import numpy as np
+
+import breathSegments as br
+import flowmeterLoader as fl
+import flowSegments as fs
+import runningStats as rs
+import venturiFlow as vf
+
+# the firmware's baseline is the average of this many pump-off samples.
+baseline_samples = 10
+
+# one row per segment of the run. flow_mean is the run's own answer (the
+# same as venturiFlow.summarize_runs gives); flow_std is the standard
+# deviation of the replicates and flow_low, flow_high the confidence
+# interval.
+segment_interval_dtype = np.dtype([
+    ("label", "U16"),
+    ("kind", "U10"),
+    ("start", np.int64),
+    ("stop", np.int64),
+    ("n", np.int64),
+    ("dp_mean", np.float64),       # Pa, baseline corrected
+    ("flow_mean", np.float64),     # L/s
+    ("flow_std", np.float64),
+    ("flow_low", np.float64),
+    ("flow_high", np.float64),
+])
+
+# one row per breath, the same way (volumes in L).
+breath_interval_dtype = np.dtype([
+    ("number", np.int64),
+    ("start_ms", np.int64),
+    ("inspired_volume", np.float64),
+    ("inspired_std", np.float64),
+    ("inspired_low", np.float64),
+    ("inspired_high", np.float64),
+    ("expired_volume", np.float64),
+    ("expired_std", np.float64),
+    ("expired_low", np.float64),
+    ("expired_high", np.float64),
+])
+
+###########################################################################
+
+# here is a function to estimate the noise of a sensor (in its own units)
+# from the changes between one sample and the next, which the flow hardly
+# moves: the spread of the changes (from their median absolute deviation,
+# so steps don't count) over root 2.
+
+def noise_sigma(values):
+
+    values = np.asarray(values, dtype = float)
+    values = values[np.isfinite(values) & (values > 0)]
+
+    if values.size < 3:
+        return 0.
+
+    steps = np.diff(values)
+
+    return 1.4826 * np.median(np.abs(steps - np.median(steps))) / np.sqrt(2.)
+
+###########################################################################
+# end of function noise_sigma
+###########################################################################
+
+# here is the function to work out confidence intervals on the flow of
+# every segment of a run (a structured array from flowmeterLoader, or
+# anything indexed by channel name). The segments and the baseline are
+# found the way venturiFlow.summarize_runs finds them, unless segments is
+# given. method is "bootstrap" or "montecarlo"; sigma (hPa) is only used by
+# "montecarlo".
+
+def segment_intervals(run, high = "p0", low = "p1", ambient = None, segments = None, \
+method = "bootstrap", replicates = 1000, confidence = 0.95, sigma = None, \
+rho = vf.RHO_AIR, a1 = vf.A1, a2 = vf.A2, chunk_values = 1 << 22, nproc = 1, \
+seed = None):
+
+    if method not in ("bootstrap", "montecarlo"):
+        raise ValueError("method has to be \"bootstrap\" or \"montecarlo\"")
+
+    high_values = np.asarray(run[high], dtype = float)
+    low_values = np.asarray(run[low], dtype = float)
+    good = fl.good_samples(run, [high, low])
+
+    if segments is None:
+        if ambient is None:
+            ambient = fl.ambient_channel(run)
+        signal = 100. * (high_values - np.asarray(run[ambient], dtype = float))
+        segments = fs.find_segments(vf._bridge_dropouts(signal, \
+        good & fl.good_samples(run, [ambient])))
+
+    raw = vf.corrected_differential(high_values, low_values)
+
+    # the good samples of every segment, one segment after the other.
+    group = fs.segment_index(segments, raw.size)
+    keep = good & (group >= 0)
+    order = np.argsort(group[keep], kind = "stable")
+    values = raw[keep][order]
+    counts = np.bincount(group[keep], minlength = segments.size)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    baselines = segments[segments["kind"] == "baseline"]
+    if baselines.size > 0:
+        base = raw[baselines[0]["start"]:baselines[0]["stop"]]
+        base = base[good[baselines[0]["start"]:baselines[0]["stop"]]]
+    else:
+        base = np.zeros(0)
+    if base.size == 0:
+        base = np.zeros(1)
+
+    table = np.zeros(segments.size, dtype = segment_interval_dtype)
+    for name in ("label", "kind", "start", "stop"):
+        table[name] = segments[name]
+    table["n"] = counts
+
+    filled = counts > 0
+    for name in ("dp_mean", "flow_mean", "flow_std", "flow_low", "flow_high"):
+        table[name][~filled] = np.nan
+
+    if not filled.any():
+        return table
+
+    baseline = base.mean()
+    table["dp_mean"][filled] = np.add.reduceat(values, starts[filled]) / counts[filled] - \
+    baseline
+    table["flow_mean"][filled] = np.add.reduceat(vf.volumetric_flow(values - baseline, \
+    rho, a1, a2), starts[filled]) / counts[filled]
+
+    if sigma is None:
+        sigma = np.hypot(noise_sigma(high_values[good]), noise_sigma(low_values[good]))
+    else:
+        sigma = np.sqrt(2.) * sigma
+
+    data = {"method": method, "values": values, "base": base, \
+    "starts": starts[filled], "counts": counts[filled], \
+    "first": np.repeat(starts[filled], counts[filled]), \
+    "size": np.repeat(counts[filled], counts[filled]), \
+    "sigma": 100. * sigma, "rho": rho, "a1": a1, "a2": a2}
+
+    flows = _run_replicates(_segment_replicates, data, replicates, \
+    values.size + base.size, chunk_values, nproc, seed)
+
+    table["flow_std"][filled] = flows.std(axis = 0)
+    table["flow_low"][filled], table["flow_high"][filled] = _interval(flows, confidence)
+
+    return table
+
+###########################################################################
+# end of function segment_intervals
+###########################################################################
+
+# here is the function to do a chunk of segment replicates: it hands back
+# each segment's mean flow, one row per replicate.
+
+def _segment_replicates(data, nreplicates, rng):
+
+    values = data["values"]
+    base = data["base"]
+
+    if data["method"] == "bootstrap":
+        pick = data["first"] + rng.integers(0, data["size"], \
+        size = (nreplicates, values.size))
+        baseline = base[rng.integers(0, base.size, \
+        size = (nreplicates, base.size))].mean(axis = 1)
+        dp = values[pick]
+    else:
+        baseline = base.mean() + data["sigma"] / np.sqrt(base.size) * \
+        rng.standard_normal(nreplicates)
+        dp = rng.standard_normal((nreplicates, values.size))
+        dp *= data["sigma"]
+        dp += values
+
+    dp -= baseline[:, None]
+
+    flows = vf.volumetric_flow(dp, data["rho"], data["a1"], data["a2"])
+
+    return np.add.reduceat(flows, data["starts"], axis = 1) / data["counts"]
+
+###########################################################################
+# end of function _segment_replicates
+###########################################################################
+
+# here is the function to work out confidence intervals on the volumes of
+# every breath in a run. The flow is worked out the way
+# breathSegments.run_flow does it; breaths (from breathSegments.find_breaths
+# on that flow, if not given) say where each breath starts, switches and
+# stops, in samples of the run. Each replicate adds noise of sigma (hPa
+# per channel) to the pressure drops, and noise over the root of
+# baseline_samples to the baseline.
+
+def breath_intervals(run, breaths = None, high = "p0", low = "p1", replicates = 1000, \
+confidence = 0.95, sigma = None, threshold = 0.05, rho = vf.RHO_AIR, a1 = vf.A1, \
+a2 = vf.A2, chunk_values = 1 << 22, nproc = 1, seed = None):
+
+    high_values = np.asarray(run[high], dtype = float)
+    low_values = np.asarray(run[low], dtype = float)
+    millis = np.asarray(run["millis"], dtype = np.int64)
+
+    dp = vf.corrected_differential(high_values, low_values) - \
+    rs.tracked_baseline(run, high, low)
+
+    # dropouts get the last good value before them, the way the breath
+    # detector does it.
+    good = np.isfinite(dp)
+    if not good.all():
+        last = np.maximum.accumulate(np.where(good, np.arange(dp.size), 0))
+        dp = np.where(good[last], dp[last], 0.)
+
+    if breaths is None:
+        breaths = br.find_breaths(millis, vf.volumetric_flow(dp, rho, a1, a2), threshold)
+
+    table = np.zeros(breaths.size, dtype = breath_interval_dtype)
+    table["number"] = breaths["number"]
+    table["start_ms"] = breaths["start_ms"]
+    table["inspired_volume"] = breaths["inspired_volume"]
+    table["expired_volume"] = breaths["expired_volume"]
+
+    if breaths.size == 0:
+        return table
+
+    # only the samples the breaths cover are needed.
+    first = int(breaths["start"].min())
+    stop = int(breaths["stop"].max()) + 1
+
+    if sigma is None:
+        good = fl.good_samples(run, [high, low])
+        sigma = np.hypot(noise_sigma(high_values[good]), noise_sigma(low_values[good]))
+    else:
+        sigma = np.sqrt(2.) * sigma
+
+    data = {"dp": dp[first:stop], \
+    "dt": np.maximum(np.diff(millis[first:stop]), 0) / 1000., \
+    "start": breaths["start"] - first, "switch": breaths["switch"] - first, \
+    "stop": breaths["stop"] - first, "sigma": 100. * sigma, \
+    "rho": rho, "a1": a1, "a2": a2}
+
+    volumes = _run_replicates(_breath_replicates, data, replicates, 3 * (stop - first), \
+    chunk_values, nproc, seed)
+
+    inspired = volumes[:, :breaths.size]
+    expired = volumes[:, breaths.size:]
+
+    table["inspired_std"] = inspired.std(axis = 0)
+    table["inspired_low"], table["inspired_high"] = _interval(inspired, confidence)
+    table["expired_std"] = expired.std(axis = 0)
+    table["expired_low"], table["expired_high"] = _interval(expired, confidence)
+
+    return table
+
+###########################################################################
+# end of function breath_intervals
+###########################################################################
+
+# here is the function to do a chunk of breath replicates: it hands back
+# the inspired volumes of every breath and then the expired ones, one row
+# per replicate.
+
+def _breath_replicates(data, nreplicates, rng):
+
+    dp = rng.standard_normal((nreplicates, data["dp"].size))
+    dp *= data["sigma"]
+    dp += data["dp"]
+    dp += data["sigma"] / np.sqrt(baseline_samples) * \
+    rng.standard_normal((nreplicates, 1))
+
+    flows = vf.volumetric_flow(dp, data["rho"], data["a1"], data["a2"])
+
+    # the running integral (trapezoidal rule), from 0 at the first sample.
+    volume = np.zeros(flows.shape)
+    steps = flows[:, 1:] + flows[:, :-1]
+    steps *= 0.5 * data["dt"]
+    np.cumsum(steps, axis = 1, out = volume[:, 1:])
+
+    inspired = volume[:, data["switch"]] - volume[:, data["start"]]
+    expired = volume[:, data["switch"]] - volume[:, data["stop"]]
+
+    return np.concatenate((inspired, expired), axis = 1)
+
+###########################################################################
+# end of function _breath_replicates
+###########################################################################
+
+# here is the function to do the replicates in chunks of at most
+# chunk_values numbers (values_per_replicate for each replicate), on
+# nproc processes (None for every processor), and stack up what
+# function(data, nreplicates, rng) hands back for each chunk.
+
+def _run_replicates(function, data, replicates, values_per_replicate, chunk_values, \
+nproc, seed):
+
+    if replicates < 1:
+        raise ValueError("need at least one replicate")
+
+    per_chunk = max(1, int(chunk_values // max(1, values_per_replicate)))
+    sizes = [per_chunk] * (replicates // per_chunk)
+    if replicates % per_chunk:
+        sizes.append(replicates % per_chunk)
+
+    # a stream of random numbers for each chunk, all from the one seed.
+    streams = np.random.SeedSequence(seed).spawn(len(sizes))
+    jobs = [(function, data, size, stream) for size, stream in zip(sizes, streams)]
+
+    if nproc is None:
+        nproc = os.cpu_count() or 1
+    nproc = max(1, min(nproc, len(jobs)))
+
+    if nproc == 1:
+        pieces = list(map(_replicate_chunk, jobs))
+    else:
+        import multiprocessing
+        with multiprocessing.Pool(nproc) as pool:
+            pieces = pool.map(_replicate_chunk, jobs)
+
+    return np.concatenate(pieces)
+
+###########################################################################
+# end of function _run_replicates
+###########################################################################
+
+# here is the function each chunk runs, here or on a worker process.
+
+def _replicate_chunk(job):
+
+    function, data, nreplicates, stream = job
+
+    return function(data, nreplicates, np.random.default_rng(stream))
+
+###########################################################################
+# end of function _replicate_chunk
+###########################################################################
+
+# here is a function to work out the central confidence interval of the
+# replicates (rows) of each column: the percentiles either side.
+
+def _interval(samples, confidence):
+
+    if not 0. < confidence < 1.:
+        raise ValueError("confidence has to be between 0 and 1")
+
+    tail = 50. * (1. - confidence)
+    low, high = np.percentile(samples, [tail, 100. - tail], axis = 0)
+
+    return low, high
+
+###########################################################################
+# end of function _interval
+###########################################################################
+
+# here are functions to print the tables, one line per segment or breath.
+
+def print_segment_intervals(table, kind = "plateau"):
+
+    print("%-12s %7s %7s %6s %10s %9s %8s %20s" % ("segment", "start", "stop", \
+    "n", "dp (Pa)", "Q (L/s)", "+/-", "interval"))
+
+    for row in table:
+
+        if kind is not None and row["kind"] != kind:
+            continue
+
+        print("%-12s %7d %7d %6d %10.3f %9.4f %8.4f   %8.4f - %8.4f" % (row["label"], \
+        row["start"], row["stop"], row["n"], row["dp_mean"], row["flow_mean"], \
+        row["flow_std"], row["flow_low"], row["flow_high"]))
+
+def print_breath_intervals(table):
+
+    print("%6s %12s %9s %8s %19s %9s %8s %19s" % ("breath", "start (ms)", \
+    "in (L)", "+/-", "interval", "out (L)", "+/-", "interval"))
+
+    for row in table:
+        print("%6d %12d %9.4f %8.4f %9.4f - %7.4f %9.4f %8.4f %9.4f - %7.4f" % \
+        (row["number"], row["start_ms"], row["inspired_volume"], row["inspired_std"], \
+        row["inspired_low"], row["inspired_high"], row["expired_volume"], \
+        row["expired_std"], row["expired_low"], row["expired_high"]))
+
+###########################################################################
+# end of functions print_segment_intervals and print_breath_intervals
+###########################################################################
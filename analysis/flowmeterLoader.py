@@ -0,0 +1,309 @@
+###################################################################
+
+# This file is flowmeterLoader.py. It reads the CSV files the Bernoulli
+# flowmeter writes to its SD card (Data/DPS310E*.CSV and friends) into numpy
+# structured arrays, a chunk of lines at a time, in a single pass through
+# the file.
+
+# A DPS310E line looks like this (22 comma separated fields):
+#   millis, "T and P:",
+#   temperature0, pressure0 (hPa), ... temperature4, pressure4 (hPa),
+#   "corrected P0 - P1 in Pa:", value,
+#   "corrected P1 - P2 in Pa:", value,
+#   "Current time (UTC):", hh:mm:ss,
+#   "Date (dd/mm/yyyy):", dd/mm/yyyy,
+#   "patient ID", ID
+# The older files like "Short Tube Data 4-25.csv" have no labels and only
+# four sensors (11 fields):
+#   millis, temperature0, pressure0, ... temperature3, pressure3,
+#   hh:mm:ss, dd/mm/yyyy
+# Sensors are named by their position in the line; fields a format doesn't
+# have come back as NaN (or -1 for the patient ID).
+
+# use this way:
+#   import flowmeterLoader as fl
+#
+#   run = fl.load_dps310e("Data/DPS310E_22_04_21_a.CSV")
+#   plt.scatter(run["millis"], run["p0"])
+#
+# or, to get through a long log without holding all of it in memory:
+#   for chunk in fl.iter_dps310e_chunks("Data/DPS310E_22_04_21_a.CSV", 10000):
+#       histo1.hfill_array(chunk["dp01"])
+
+import itertools
+
+import numpy as np
+
+# one row of flowmeter data. utc_ms is the real time clock's date and time
+# as milliseconds since 1970-01-01 (UTC).
+dps310e_dtype = np.dtype([
+    ("millis", np.int64),
+    ("t0", np.float64), ("p0", np.float64),
+    ("t1", np.float64), ("p1", np.float64),
+    ("t2", np.float64), ("p2", np.float64),
+    ("t3", np.float64), ("p3", np.float64),
+    ("t4", np.float64), ("p4", np.float64),
+    ("dp01", np.float64),
+    ("dp12", np.float64),
+    ("utc_ms", np.int64),
+    ("patient_id", np.int32),
+])
+
+# where each field lives in a line, for each of the formats, keyed by the
+# number of comma separated fields on a line.
+_layouts = {
+
+    # labelled DPS310E lines
+    22: {
+        "numbers": {"millis": 0, "t0": 2, "p0": 3, "t1": 4, "p1": 5, \
+        "t2": 6, "p2": 7, "t3": 8, "p3": 9, "t4": 10, "p4": 11, \
+        "dp01": 13, "dp12": 15, "patient_id": 21},
+        "time": 17,
+        "date": 19,
+    },
+
+    # unlabelled lines from the short tube runs
+    11: {
+        "numbers": {"millis": 0, "t0": 1, "p0": 2, "t1": 3, "p1": 4, \
+        "t2": 5, "p2": 6, "t3": 7, "p3": 8},
+        "time": 9,
+        "date": 10,
+    },
+}
+
+###########################################################################
+
+# here is a function to tell which channel is the ambient (atmosphere)
+# pressure sensor in a run. In the DPS310E files it is the fifth sensor
+# (p4) and the fourth slot is empty (all zeros); in the short tube files it
+# is p3.
+
+def ambient_channel(run):
+
+    if hasattr(run, "dtype"):
+        has_p4 = "p4" in run.dtype.names
+    else:
+        has_p4 = "p4" in run
+
+    if has_p4:
+        p4 = np.asarray(run["p4"])
+        if p4.size > 0 and np.any(p4 > 0):
+            return "p4"
+
+    return "p3"
+
+###########################################################################
+# end of function ambient_channel
+###########################################################################
+
+# here is a function to mark the samples where a sensor dropped out: the
+# DPS310s occasionally report a pressure of exactly zero.
+
+def good_samples(run, channels):
+
+    good = np.ones(len(run[channels[0]]), dtype = bool)
+
+    for channel in channels:
+        values = np.asarray(run[channel], dtype = float)
+        good &= np.isfinite(values) & (values > 0)
+
+    return good
+
+###########################################################################
+# end of function good_samples
+###########################################################################
+
+# here is a function to read a flowmeter file a chunk at a time. It hands
+# back one structured array (dtype dps310e_dtype) per chunk_rows lines, so
+# no more than that many lines are ever held in memory. Lines that don't
+# look like data (blank, cut off when the SD card was pulled, ...) are
+# skipped. The format is worked out from the first data line.
+
+def iter_dps310e_chunks(filename, chunk_rows = 65536):
+
+    with open(filename, "r", errors = "replace") as f:
+
+        nfields = None
+
+        while True:
+
+            lines = list(itertools.islice(f, chunk_rows))
+
+            if not lines:
+                break
+
+            if nfields is None:
+                nfields = _data_line_fields(lines)
+                if nfields is None:
+                    continue
+
+            chunk = parse_lines(lines, nfields)
+
+            if chunk.size > 0:
+                yield chunk
+
+###########################################################################
+# end of function iter_dps310e_chunks
+###########################################################################
+
+# here is a function to read a whole flowmeter file into one structured
+# array. It still reads the file in chunks, but keeps them all.
+
+def load_dps310e(filename, chunk_rows = 65536):
+
+    chunks = list(iter_dps310e_chunks(filename, chunk_rows))
+
+    if not chunks:
+        return np.zeros(0, dtype = dps310e_dtype)
+
+    return np.concatenate(chunks)
+
+###########################################################################
+# end of function load_dps310e
+###########################################################################
+
+# here is a function to turn a list of lines (from a file, a serial port,
+# the radio...) into a structured array. Only lines with nfields fields are
+# kept; if nfields isn't given, it comes from the first line that looks like
+# data. Anything else (blank lines, chatter from the base station, lines
+# with garbage in them) is skipped.
+
+def parse_lines(lines, nfields = None):
+
+    if nfields is None:
+        nfields = _data_line_fields(lines)
+        if nfields is None:
+            return np.zeros(0, dtype = dps310e_dtype)
+
+    layout = _layouts[nfields]
+
+    # keep only complete lines of the right format and hand them to
+    # numpy's (compiled) text parser.
+    good = [line for line in lines if line.count(",") == nfields - 1]
+
+    if not good:
+        return np.zeros(0, dtype = dps310e_dtype)
+
+    try:
+        return _parse_lines(good, layout)
+    except ValueError:
+        # somewhere in here is a line with the right number of commas but
+        # garbage in it; go looking for it.
+        return _parse_lines_carefully(good, layout)
+
+###########################################################################
+# end of function parse_lines
+###########################################################################
+
+# here is a function to find the number of fields on the first line that
+# looks like one of our formats, or None if there isn't one.
+
+def _data_line_fields(lines):
+
+    for line in lines:
+        nfields = line.count(",") + 1
+        if nfields in _layouts:
+            return nfields
+
+    return None
+
+###########################################################################
+# end of function _data_line_fields
+###########################################################################
+
+# here is a function to turn a list of lines into a structured array.
+# np.loadtxt pulls out just the columns we want, numbers and all, in
+# compiled code; the time and date come out as short byte strings and get
+# converted afterwards.
+
+def _parse_lines(lines, layout):
+
+    names = list(layout["numbers"])
+    columns = [layout["numbers"][name] for name in names]
+
+    raw_dtype = [(name, dps310e_dtype[name]) for name in names]
+    raw_dtype += [("time", "S8"), ("date", "S10")]
+
+    raw = np.loadtxt(lines, delimiter = ",", dtype = raw_dtype, ndmin = 1, \
+    usecols = columns + [layout["time"], layout["date"]], comments = None)
+
+    chunk = np.zeros(raw.size, dtype = dps310e_dtype)
+
+    for name in dps310e_dtype.names:
+        if name in layout["numbers"]:
+            chunk[name] = raw[name]
+        elif name == "patient_id":
+            chunk[name] = -1
+        elif name != "utc_ms":
+            chunk[name] = np.nan
+
+    chunk["utc_ms"] = utc_milliseconds(raw["time"], raw["date"])
+
+    return chunk
+
+###########################################################################
+# end of function _parse_lines
+###########################################################################
+
+# here is a function to do the same as _parse_lines while dropping the
+# lines that won't parse. It splits the list in half and tries each half,
+# over and over, so a few bad lines in a big chunk don't mean parsing every
+# line on its own.
+
+def _parse_lines_carefully(lines, layout):
+
+    try:
+        return _parse_lines(lines, layout)
+    except ValueError:
+        if len(lines) == 1:
+            return np.zeros(0, dtype = dps310e_dtype)
+
+    half = len(lines) // 2
+
+    return np.concatenate((_parse_lines_carefully(lines[:half], layout), \
+    _parse_lines_carefully(lines[half:], layout)))
+
+###########################################################################
+# end of function _parse_lines_carefully
+###########################################################################
+
+# here is a function to turn arrays of "hh:mm:ss" and "dd/mm/yyyy" strings
+# into milliseconds since 1970-01-01. The firmware doesn't pad the hour
+# ("9:32:41"), so times get a leading zero put back first; then the strings
+# are fixed width, and we pick the digits out of them as bytes rather than
+# parsing each one.
+
+def utc_milliseconds(times, dates):
+
+    times = np.char.zfill(np.char.strip(np.asarray(times)), 8).astype("S8")
+    dates = np.char.strip(np.asarray(dates)).astype("S10")
+
+    if np.any(np.char.str_len(times) != 8) or np.any(np.char.str_len(dates) != 10):
+        raise ValueError("expected times like hh:mm:ss and dates like dd/mm/yyyy")
+
+    t = times.view(np.uint8).reshape(-1, 8).astype(np.int64) - ord("0")
+    d = dates.view(np.uint8).reshape(-1, 10).astype(np.int64) - ord("0")
+
+    hour = 10 * t[:, 0] + t[:, 1]
+    minute = 10 * t[:, 3] + t[:, 4]
+    second = 10 * t[:, 6] + t[:, 7]
+
+    day = 10 * d[:, 0] + d[:, 1]
+    month = 10 * d[:, 3] + d[:, 4]
+    year = 1000 * d[:, 6] + 100 * d[:, 7] + 10 * d[:, 8] + d[:, 9]
+
+    digits = np.concatenate((t[:, [0, 1, 3, 4, 6, 7]], d[:, [0, 1, 3, 4, 6, 7, 8, 9]]), axis = 1)
+    if np.any((digits < 0) | (digits > 9)):
+        raise ValueError("expected times like hh:mm:ss and dates like dd/mm/yyyy")
+
+    # days since 1970 from year, month and day using numpy's calendar.
+    days = (year - 1970).astype("datetime64[Y]") + (month - 1).astype("timedelta64[M]")
+    days = days.astype("datetime64[D]") + (day - 1).astype("timedelta64[D]")
+
+    seconds = days.astype(np.int64) * 86400 + hour * 3600 + minute * 60 + second
+
+    return seconds * 1000
+
+###########################################################################
+# end of function utc_milliseconds
+###########################################################################
@@ -0,0 +1,543 @@
+###################################################################
+
+# This file is formatRegistry.py. It knows every kind of data file in
+# Data/, works out which kind a file is from its first few lines, and reads
+# it with the right parser:
+#   dps310e      DPS310E_*.CSV (flowmeterLoader)
+#   short_tube   Short Tube Data 4-25.csv (flowmeterLoader)
+#   long_tube    DATA.TXT, DATA1.TXT, Long Tube Data.txt: a line holding
+#                the pump setting ("0.50"), then rows of
+#                n, nine pressures (hPa)
+#   insert       Initial/Extended Insert Data.csv: a line like
+#                "Oct 22 2021 14:35:00,flow rate=0.66,N=30,..." (or
+#                "...,Pump Off Samples,..."), a line of column names, then
+#                rows of n, In, Mid, Out, Ambient, t (ms)[, differences].
+#                Lines like "diffuser on input" say how the insert was set
+#                up for the blocks after them.
+#   elevation    DPS310 Elevation Data.csv: a line like "0.040 m," then
+#                rows of n, pressure (hPa)
+
+# The last three (the "block" formats) come back as a structured array of
+# block_dtype, one row per data row, with the block (run) it's in, what
+# the block's header says (flow rate, pump setting or elevation, time) and
+# the section (the last set-up note) filled in on every row. The DPS310E
+# formats come back the way flowmeterLoader reads them (dps310e_dtype).
+
+# A block file is read in one pass, a big chunk of bytes at a time. The
+# data rows are picked out of a chunk with numpy (a line that starts with a
+# whole number followed by a comma, with the right number of commas) and
+# all their numbers are converted at once; only the few lines that aren't
+# data rows (headers, notes, column names, mu/sd lines) are looked at one
+# by one. The time taken grows linearly with the size of the file.
+
+# More formats can be added with register_format.
+
+# use this way:
+#   import formatRegistry as fr
+#
+#   rows = fr.load("Data/Long Tube Data.txt")
+#   plt.scatter(rows["flow_rate"], rows["c1"] - rows["c2"])
+#
+#   print(fr.sniff_format("Data/Initial Insert Data.csv"))   # "insert"
+#   for chunk in fr.iter_blocks("Data/Initial Insert Data.csv"):
+#       inlet = chunk["c0"]
+
+import datetime
+import functools
+import io
+import re
+
+import numpy as np
+
+import flowmeterLoader as fl
+
+# one row of a block format file. run counts the blocks in the file from 0
+# (-1 for rows before the first header). header_value is the number in the
+# block's header line: the pump setting, the flow rate (L/s) or the
+# elevation (m). flow_rate is in L/s, NaN if the block doesn't have one
+# (elevation runs). utc_ms is the header's date and time (ms since 1970,
+# taken as UTC), -1 if there isn't one. n is the row number in the block.
+# c0 ... c8 are the channels, in hPa, NaN for channels the format doesn't
+# have (see the "channels" of each format). t_ms is the time column of the
+# insert files, NaN for the others.
+block_dtype = np.dtype([
+    ("run", np.int32),
+    ("label", "U24"),
+    ("section", "U32"),
+    ("header_value", np.float64),
+    ("flow_rate", np.float64),
+    ("utc_ms", np.int64),
+    ("n", np.int32),
+    ("c0", np.float64), ("c1", np.float64), ("c2", np.float64),
+    ("c3", np.float64), ("c4", np.float64), ("c5", np.float64),
+    ("c6", np.float64), ("c7", np.float64), ("c8", np.float64),
+    ("t_ms", np.float64),
+])
+
+# the long tube runs' pump settings are in units of 0.47 L/s (see Long Tube
+# Analysis.ipynb).
+long_tube_litres_per_setting = 0.47
+
+# bytes read at a time.
+_chunk_bytes = 1 << 24
+
+# name -> the format's entry, in the order they are tried when sniffing:
+#   "sniff"        function of a list of the file's first lines, True if
+#                  the file is in this format
+#   "load"         function of a file name, handing back its rows
+#   "description"  a few words about it
+# block formats also have
+#   "marker"       function of a line that isn't a data row (see
+#                  _long_tube_marker)
+#   "fields"       function of the number of fields on a data row, handing
+#                  back how to read it (see _insert_fields), or None if
+#                  rows with that many fields aren't data
+#   "channels"     what c0, c1, ... are
+formats = {}
+
+_setting_line = re.compile(r"^\s*(-?[0-9]*\.?[0-9]+)\s*,?\s*$")
+_elevation_line = re.compile(r"^\s*(-?[0-9]*\.?[0-9]+)\s*m\s*,?\s*$")
+_data_row = re.compile(r"^\s*[0-9]+\s*,")
+
+###########################################################################
+
+# here is a function to add a format to the registry (or replace one). See
+# formats, above, for what sniff and load have to do; anything else given
+# as a keyword goes into the format's entry.
+
+def register_format(name, sniff, load, description = "", **extra):
+
+    entry = {"sniff": sniff, "load": load, "description": description}
+    entry.update(extra)
+
+    formats[name] = entry
+
+    return entry
+
+###########################################################################
+# end of function register_format
+###########################################################################
+
+# here is a function to work out which format a file is in, from its first
+# 64 kB: the name of the first format whose sniff says yes, or None (for
+# PDFs, spreadsheets and anything else we can't read).
+
+def sniff_format(filename):
+
+    with open(filename, "rb") as f:
+        head = f.read(65536)
+
+    if b"\0" in head:
+        return None
+
+    lines = head.decode("utf-8", "replace").splitlines()[:100]
+
+    for name, entry in formats.items():
+        if entry["sniff"](lines):
+            return name
+
+    return None
+
+###########################################################################
+# end of function sniff_format
+###########################################################################
+
+# here is the function to read a file with the right parser. Leave
+# file_format out to have it sniffed.
+
+def load(filename, file_format = None):
+
+    if file_format is None:
+        file_format = sniff_format(filename)
+        if file_format is None:
+            raise ValueError("can't tell what format " + repr(filename) + " is in")
+
+    if file_format not in formats:
+        raise ValueError("unknown format " + repr(file_format))
+
+    return formats[file_format]["load"](filename)
+
+###########################################################################
+# end of function load
+###########################################################################
+
+# here is a function to read a block format file a chunk at a time: it
+# hands back one array of block_dtype for each chunk_bytes of the file, so
+# a huge log never has to be held in memory all at once.
+
+def iter_blocks(filename, file_format = None, chunk_bytes = _chunk_bytes):
+
+    if file_format is None:
+        file_format = sniff_format(filename)
+
+    if file_format not in formats or "marker" not in formats[file_format]:
+        raise ValueError(repr(filename) + " isn't in one of the block formats")
+
+    state = _new_state()
+
+    with open(filename, "rb") as f:
+
+        leftover = b""
+
+        while True:
+
+            block = f.read(chunk_bytes)
+
+            # the last line of a file doesn't always end in a newline.
+            if not block:
+                if leftover.strip():
+                    chunk = parse_block_bytes(leftover + b"\n", file_format, state)
+                    if chunk.size > 0:
+                        yield chunk
+                break
+
+            data = leftover + block
+            cut = data.rfind(b"\n") + 1
+            leftover = data[cut:]
+
+            if cut == 0:
+                continue
+
+            chunk = parse_block_bytes(data[:cut], file_format, state)
+            if chunk.size > 0:
+                yield chunk
+
+###########################################################################
+# end of function iter_blocks
+###########################################################################
+
+# here is a function to read a whole block format file into one array.
+
+def load_blocks(filename, file_format = None, chunk_bytes = _chunk_bytes):
+
+    chunks = list(iter_blocks(filename, file_format, chunk_bytes))
+
+    if not chunks:
+        return np.zeros(0, dtype = block_dtype)
+
+    return np.concatenate(chunks)
+
+###########################################################################
+# end of function load_blocks
+###########################################################################
+
+# here is a function to make the state a block file is read with: what the
+# last header and set-up note said, carried from one chunk to the next.
+
+def _new_state():
+
+    return {"run": -1, "label": "", "section": "", "header_section": "", \
+    "header_value": np.nan, "flow_rate": np.nan, "utc_ms": -1, "fields": None}
+
+###########################################################################
+# end of function _new_state
+###########################################################################
+
+# here is the function to turn some whole lines (bytes, ending in a newline)
+# of a block format file into rows of block_dtype. state carries the
+# current header from one call to the next; leave it out for a piece of a
+# file on its own (runIndex reads single blocks this way).
+
+def parse_block_bytes(data, file_format, state = None):
+
+    if state is None:
+        state = _new_state()
+
+    entry = formats[file_format]
+
+    text = np.frombuffer(data, dtype = np.uint8)
+    if text.size == 0:
+        return np.zeros(0, dtype = block_dtype)
+
+    # where each line starts and stops (at its newline).
+    stops = np.flatnonzero(text == ord("\n"))
+    starts = np.concatenate(([0], stops[:-1] + 1))
+
+    # commas on each line, and the first comma on it.
+    commas = np.flatnonzero(text == ord(","))
+    first_comma = np.append(commas, text.size)[np.searchsorted(commas, starts)]
+    ncommas = np.searchsorted(commas, stops) - np.searchsorted(commas, starts)
+
+    # a data row starts with a digit and its first field, the row number,
+    # ends with one ("0.50" has no comma, "0.040 m," ends with a letter).
+    digit = (text >= ord("0")) & (text <= ord("9"))
+    is_row = digit[np.minimum(starts, text.size - 1)] & (first_comma < stops) & \
+    digit[np.maximum(first_comma - 1, 0)]
+
+    # the few other lines: headers, notes, column names, blank lines...
+    marker_lines = np.flatnonzero(~is_row)
+
+    # the header each row comes after: 0 is the one carried over from the
+    # last chunk, 1 on, the ones found in this chunk. Each header gets the
+    # last note before it.
+    labels = [state["label"]]
+    header_sections = [state["header_section"]]
+    values = [(state["run"], state["header_value"], state["flow_rate"], state["utc_ms"])]
+    header_lines = []
+
+    for iline in marker_lines:
+
+        line = data[starts[iline]:stops[iline]].decode("utf-8", "replace")
+
+        # lines with nothing but commas and white space in them are nothing.
+        if not line.strip(", \t\r"):
+            continue
+
+        marker = entry["marker"](line)
+
+        if marker is None:
+            continue
+
+        if marker[0] == "section":
+            state["section"] = marker[1]
+        else:
+            kind, label, header_value, flow_rate, utc_ms = marker
+            header_lines.append(iline)
+            values.append((values[-1][0] + 1, header_value, flow_rate, utc_ms))
+            labels.append(label)
+            header_sections.append(state["section"])
+
+    state["run"], state["header_value"], state["flow_rate"], state["utc_ms"] = values[-1]
+    state["label"] = labels[-1]
+    state["header_section"] = header_sections[-1]
+
+    rows = np.flatnonzero(is_row)
+
+    # how to read the rows comes from the first one that looks right.
+    if state["fields"] is None:
+        for nfields in np.unique(ncommas[rows] + 1):
+            if entry["fields"](int(nfields)) is not None:
+                state["fields"] = int(nfields)
+                break
+
+    if state["fields"] is None:
+        return np.zeros(0, dtype = block_dtype)
+
+    rows = rows[ncommas[rows] + 1 == state["fields"]]
+    columns, scale = entry["fields"](state["fields"])
+
+    numbers = _parse_rows(data, text, starts[rows], stops[rows], state["fields"], \
+    [0] + list(columns.values()))
+
+    # some rows may have had garbage in them.
+    keep = np.isfinite(numbers).all(axis = 1)
+    numbers = numbers[keep]
+    rows = rows[keep]
+
+    which = np.searchsorted(header_lines, rows)
+    header_values = np.array(values)
+
+    chunk = np.zeros(rows.size, dtype = block_dtype)
+
+    chunk["run"] = header_values[which, 0]
+    chunk["header_value"] = header_values[which, 1]
+    chunk["flow_rate"] = header_values[which, 2]
+    chunk["utc_ms"] = header_values[which, 3]
+    chunk["label"] = np.array(labels)[which]
+    chunk["section"] = np.array(header_sections)[which]
+
+    for name in block_dtype.names[7:]:
+        chunk[name] = np.nan
+
+    chunk["n"] = numbers[:, 0]
+    for i, name in enumerate(columns):
+        chunk[name] = numbers[:, i + 1] * (scale if name != "t_ms" else 1.)
+
+    return chunk
+
+###########################################################################
+# end of function parse_block_bytes
+###########################################################################
+
+# here is a function to convert the numbers in fields (a list) of some data
+# rows, all with nfields fields, into a (rows, fields) array in one go: the
+# rows are cut out of the chunk and the lot handed to numpy's (compiled)
+# text reader. If one of them won't convert (an empty field, garbage...)
+# the rows are done one at a time, and the ones that don't convert come
+# back as NaN.
+
+def _parse_rows(data, text, starts, stops, nfields, fields):
+
+    if starts.size == 0:
+        return np.zeros((0, len(fields)))
+
+    # +1 where each row starts and -1 after its newline; the running sum is
+    # 1 on the bytes of the rows.
+    edges = np.zeros(text.size + 1, dtype = np.int8)
+    edges[starts] = 1
+    edges[stops + 1] -= 1
+    picked = text[np.cumsum(edges[:-1], dtype = np.int8).view(bool)]
+
+    try:
+        return np.loadtxt(io.BytesIO(picked.tobytes()), delimiter = ",", \
+        usecols = fields, ndmin = 2, comments = None)
+    except ValueError:
+        pass
+
+    numbers = np.full((starts.size, len(fields)), np.nan)
+
+    for i, (start, stop) in enumerate(zip(starts, stops)):
+        try:
+            row = np.array(data[start:stop].split(b","), dtype = float)
+        except ValueError:
+            continue
+        if row.size == nfields:
+            numbers[i] = row[fields]
+
+    return numbers
+
+###########################################################################
+# end of function _parse_rows
+###########################################################################
+
+# here are the functions that say what a line that isn't a data row means,
+# for each block format: ("header", label, header value, flow rate, utc_ms)
+# for a line that starts a block, ("section", note) for a set-up note, or
+# None for anything else (column names, mu/sd lines...).
+
+def _long_tube_marker(line):
+
+    match = _setting_line.match(line)
+    if match is None:
+        return None
+
+    setting = float(match.group(1))
+
+    return ("header", "setting " + match.group(1), setting, \
+    setting * long_tube_litres_per_setting, -1)
+
+def _elevation_marker(line):
+
+    match = _elevation_line.match(line)
+    if match is None:
+        return None
+
+    return ("header", match.group(1) + " m", float(match.group(1)), np.nan, -1)
+
+def _insert_marker(line):
+
+    fields = line.split(",", 2)
+    first = fields[0].strip()
+
+    # the lines of column names, and the per-block summaries.
+    if first in ("n", "mu", "sd", "std", "Q"):
+        return None
+
+    what = fields[1].strip() if len(fields) > 1 else ""
+
+    if what == "Pump Off Samples" or what.startswith("flow rate="):
+        flow_rate = 0. if what == "Pump Off Samples" else float(what.split("=")[1])
+        return ("header", what, flow_rate, flow_rate, _insert_time(first))
+
+    return ("section", first)
+
+# the pump off and flow rate blocks are mostly taken in pairs with the same
+# time, so the times are remembered rather than parsed over and over.
+
+@functools.lru_cache(maxsize = 1024)
+def _insert_time(text):
+
+    try:
+        stamp = datetime.datetime.strptime(" ".join(text.split()), "%b %d %Y %H:%M:%S")
+    except ValueError:
+        return -1
+
+    return int(stamp.replace(tzinfo = datetime.timezone.utc).timestamp() * 1000)
+
+###########################################################################
+# end of the marker functions
+###########################################################################
+
+# here are the functions that say how to read a data row with nfields
+# fields in each block format: a dictionary of column name (in
+# block_dtype) -> field, and what to multiply the pressures by to get hPa.
+# None means rows with that many fields aren't data rows.
+
+def _long_tube_fields(nfields):
+
+    if nfields != 10:
+        return None
+
+    return {"c%d" % i: i + 1 for i in range(9)}, 1.
+
+def _elevation_fields(nfields):
+
+    if nfields != 2:
+        return None
+
+    return {"c0": 1}, 1.
+
+def _insert_fields(nfields):
+
+    columns = {"c0": 1, "c1": 2, "c2": 3, "c3": 4, "t_ms": 5}
+
+    # the Extended Insert file is in hPa; the Initial Insert file (which
+    # has the differences too) is in Pa.
+    if nfields == 6:
+        return columns, 1.
+    if nfields == 12:
+        return columns, 0.01
+
+    return None
+
+###########################################################################
+# end of the fields functions
+###########################################################################
+
+# here are the sniff functions for each format.
+
+def _sniff_dps310e(lines):
+
+    return fl._data_line_fields(lines) == 22
+
+def _sniff_short_tube(lines):
+
+    return fl._data_line_fields(lines) == 11
+
+def _sniff_insert(lines):
+
+    return any(_insert_marker(line) is not None and _insert_marker(line)[0] == "header" \
+    for line in lines if "," in line)
+
+def _sniff_elevation(lines):
+
+    return any(_elevation_line.match(line) for line in lines) and \
+    any(_data_row.match(line) and line.count(",") == 1 for line in lines)
+
+def _sniff_long_tube(lines):
+
+    return any(_setting_line.match(line) for line in lines) and \
+    any(_data_row.match(line) and line.count(",") == 9 for line in lines)
+
+###########################################################################
+# end of the sniff functions
+###########################################################################
+
+# here are the block formats' load functions.
+
+def _load_long_tube(filename):
+    return load_blocks(filename, "long_tube")
+
+def _load_insert(filename):
+    return load_blocks(filename, "insert")
+
+def _load_elevation(filename):
+    return load_blocks(filename, "elevation")
+
+###########################################################################
+
+register_format("dps310e", _sniff_dps310e, fl.load_dps310e, \
+"labelled DPS310E flowmeter lines (22 fields)")
+register_format("short_tube", _sniff_short_tube, fl.load_dps310e, \
+"unlabelled short tube flowmeter lines (11 fields)")
+register_format("insert", _sniff_insert, _load_insert, \
+"Initial/Extended Insert blocks of In, Mid, Out, Ambient, t (ms)", \
+marker = _insert_marker, fields = _insert_fields, \
+channels = ("In", "Mid", "Out", "Ambient"))
+register_format("elevation", _sniff_elevation, _load_elevation, \
+"DPS310 elevation blocks of one pressure", \
+marker = _elevation_marker, fields = _elevation_fields, channels = ("p0",))
+register_format("long_tube", _sniff_long_tube, _load_long_tube, \
+"long tube blocks of nine pressures, one block per pump setting", \
+marker = _long_tube_marker, fields = _long_tube_fields, \
+channels = tuple("p%d" % i for i in range(9)))
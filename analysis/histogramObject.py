@@ -10,8 +10,250 @@
 # George Gollin, University of Illinois, March 26, 2017
 # nad also November 14, 2021
 
+import math
+
 import numpy as np
 
+# The running sums used for the mean and RMS are kept exactly, as python
+# integers counting units of 2**-1074 (every finite double is a whole number
+# of those). Exact sums don't care about the order things were added in, so
+# a histogram filled one value at a time, filled from arrays, or merged
+# together from pieces filled on different processors ends up with
+# bit-for-bit the same sums, means and RMS widths.
+_EXACT_UNIT_BITS = 1074
+_EXACT_UNITS_PER_ONE = 1 << _EXACT_UNIT_BITS
+
+# number of values summed per pass in _exact_column_sums: small enough that
+# the per-exponent partial sums (26-bit pieces) stay exact in float64, and
+# that the scratch arrays for a pass stay in the processor's cache.
+_EXACT_CHUNK = 1 << 16
+
+# adding and taking away this rounds a mantissa (0.5 <= |m| < 1) to a
+# multiple of 2**-25, leaving a remainder no bigger than 2**-26.
+_EXACT_SPLIT = 1.5 * 2.**27
+
+# one float as an exact integer number of units. A value that isn't finite
+# (the square of a big value overflows to inf) can't be held exactly, so it
+# is left out of the sum (counted as 0) rather than breaking the fill.
+def _exact(value):
+
+    value = float(value)
+    if not math.isfinite(value):
+        return 0
+
+    numerator, denominator = value.as_integer_ratio()
+    return numerator * (_EXACT_UNITS_PER_ONE // denominator)
+
+# a value somebody sets one of the running sums to, as exact units.
+def _exact_setting(name, value):
+
+    if not math.isfinite(float(value)):
+        raise ValueError(name + " has to be finite")
+
+    return _exact(value)
+
+# exact integer sum of a whole array of floats, without a python loop over
+# the values. Values that aren't finite are left out, as in _exact.
+def _exact_sum_of_array(values):
+
+    return _exact_column_sums(np.reshape(values, (-1, 1)))[0]
+
+# exact integer sums of each column of a (rows, columns) array of floats
+# (leaving out the ones that aren't finite), as a list with one sum per
+# column. Each value is split into a mantissa and a power of two; the
+# mantissa is split again into a rounded high part and a small remainder,
+# and the pieces sharing a column and a power of two are added up, exactly,
+# with one np.bincount for all the columns.
+def _exact_column_sums(values):
+
+    ncolumns = values.shape[1]
+    totals = [0] * ncolumns
+    rows_per_pass = max(1, _EXACT_CHUNK // ncolumns)
+
+    for start in range(0, values.shape[0], rows_per_pass):
+
+        mantissa, exponent = np.frexp(values[start:start + rows_per_pass])
+
+        # values that aren't finite count as 0 (see _exact).
+        infinite = ~np.isfinite(mantissa)
+        if infinite.any():
+            mantissa[infinite] = 0.
+
+        # value = mantissa * 2**53 units of 2**-1074, times 2**shift.
+        # Subnormal numbers have enough trailing zero bits in their
+        # mantissas to be scaled down to shift 0 without losing anything.
+        tiny = exponent < 53 - _EXACT_UNIT_BITS
+        if tiny.any():
+            mantissa[tiny] = np.ldexp(mantissa[tiny], exponent[tiny] + (_EXACT_UNIT_BITS - 53))
+            exponent[tiny] = 53 - _EXACT_UNIT_BITS
+
+        key = exponent + (_EXACT_UNIT_BITS - 53)
+        key *= ncolumns
+        key += np.arange(ncolumns, dtype = key.dtype)
+
+        high = mantissa + _EXACT_SPLIT
+        high -= _EXACT_SPLIT
+        mantissa -= high
+
+        high_sums = np.bincount(key.ravel(), weights = high.ravel())
+        low_sums = np.bincount(key.ravel(), weights = mantissa.ravel())
+
+        for where in np.flatnonzero((high_sums != 0) | (low_sums != 0)):
+            shift, column = divmod(int(where), ncolumns)
+            totals[column] += (int(high_sums[where] * 2.**53) + \
+            int(low_sums[where] * 2.**53)) << shift
+
+    return totals
+
+# bin population types that histo knows how to widen when a bin fills up.
+_wider_bin_dtype = {
+    np.dtype(np.uint8): np.dtype(np.uint16),
+    np.dtype(np.uint16): np.dtype(np.uint32),
+    np.dtype(np.uint32): np.dtype(np.uint64),
+    np.dtype(np.int8): np.dtype(np.int16),
+    np.dtype(np.int16): np.dtype(np.int32),
+    np.dtype(np.int32): np.dtype(np.int64),
+}
+
+# random number generator hrandom uses when it isn't handed one.
+_default_rng = np.random.default_rng()
+
+# here is a function to make nbins log-spaced bins from low to high (both
+# bigger than zero), e.g. for pressure drops from a tenth of a Pa to tens
+# of Pa, with the same resolution in percent everywhere.
+def log_edges(low, high, nbins):
+
+    if not 0. < low < high:
+        raise ValueError("log-spaced bins need 0 < low < high")
+
+    return np.geomspace(low, high, int(nbins) + 1)
+
+# check a list of bin edges handed to histo, and return it as an array.
+def _check_edges(edges, axis):
+
+    edges = np.array(edges, dtype = float)
+
+    if edges.ndim != 1 or edges.size < 2:
+        raise ValueError(axis + " bin edges need to be a list of at least two numbers")
+
+    if not np.all(np.isfinite(edges)) or np.any(np.diff(edges) <= 0.):
+        raise ValueError(axis + " bin edges need to be finite and increasing")
+
+    return edges
+
+# bin edges for one axis and whether they are evenly spaced: edges handed
+# in count as evenly spaced if they are exactly the ones np.linspace makes.
+def _bin_edges(low, high, nbins, edges):
+
+    uniform_edges = np.linspace(low, high, nbins + 1)
+
+    if edges is None:
+        return uniform_edges, True
+
+    return edges, bool(np.array_equal(edges, uniform_edges))
+
+# the sparse 2-D backend counts bins one band of 2**_SPARSE_BAND_BITS bin
+# numbers at a time, so the scratch space doesn't grow with the number of
+# bins. Fills are held back until _SPARSE_PENDING of them have piled up,
+# then counted together.
+_SPARSE_BAND_BITS = 20
+_SPARSE_PENDING = 1 << 16
+
+# hfill puts the terms of the running sums aside (three numbers a fill and
+# axis) and adds them into the exact sums this many at a time, so each fill
+# only costs a list append.
+_SUMS_PENDING = 3 << 12
+
+# here is a function to count how many times each bin number (key) shows
+# up, and add up the weights (and weights squared) that go with them. It
+# hands back the bins that got something, in order, with their counts and
+# sums (None for the sums if there are no weights). The keys are grouped
+# into bands with a stable sort on the band number (a 16 bit sort when it
+# can be), then each band is counted with np.bincount.
+def _sparse_sums(keys, weights = None):
+
+    keys = np.asarray(keys, dtype = np.int64)
+    band = keys >> _SPARSE_BAND_BITS
+
+    if keys.size > 0 and np.any(band != band[0]):
+        band_type = np.uint16 if int(band.max()) < (1 << 16) else np.int64
+        order = np.argsort(band.astype(band_type), kind = "stable")
+        keys = keys[order]
+        band = band[order]
+        if weights is not None:
+            weights = weights[order]
+
+    # where each band starts and stops in the sorted keys
+    edges = np.concatenate(([0], np.flatnonzero(np.diff(band)) + 1, [keys.size]))
+    if keys.size == 0:
+        edges = edges[:1]
+
+    occupied = []
+    counts = []
+    sumw = []
+    sumw2 = []
+
+    for start, stop in zip(edges[:-1], edges[1:]):
+
+        base = int(band[start]) << _SPARSE_BAND_BITS
+        local = keys[start:stop] - base
+
+        band_counts = np.bincount(local)
+        filled = np.flatnonzero(band_counts)
+
+        occupied.append(filled + base)
+        counts.append(band_counts[filled])
+
+        if weights is not None:
+            band_weights = weights[start:stop]
+            sumw.append(np.bincount(local, weights = band_weights)[filled])
+            sumw2.append(np.bincount(local, weights = band_weights * band_weights)[filled])
+
+    if not occupied:
+        empty = np.zeros(0)
+        return np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64), \
+        None if weights is None else empty, None if weights is None else empty
+
+    occupied = np.concatenate(occupied).astype(np.int64)
+    counts = np.concatenate(counts).astype(np.int64)
+
+    if weights is None:
+        return occupied, counts, None, None
+
+    return occupied, counts, np.concatenate(sumw), np.concatenate(sumw2)
+
+# here is a function to add two sets of sparse bins together. values_a and
+# values_b are tuples of arrays (counts, sums of weights, ...) that go with
+# keys_a and keys_b; an array that is None on both sides stays None.
+def _sparse_add(keys_a, values_a, keys_b, values_b):
+
+    # both lists of keys are already in order with no repeats.
+    keys = np.concatenate((keys_a, keys_b))
+    keys.sort(kind = "stable")
+    if keys.size > 1:
+        keys = keys[np.concatenate(([True], keys[1:] != keys[:-1]))]
+
+    where_a = np.searchsorted(keys, keys_a)
+    where_b = np.searchsorted(keys, keys_b)
+
+    totals = []
+
+    for a, b in zip(values_a, values_b):
+
+        if a is None and b is None:
+            totals.append(None)
+            continue
+
+        total = np.zeros(keys.size, dtype = np.result_type( \
+        np.int64 if a is None else a.dtype, np.int64 if b is None else b.dtype))
+        if a is not None:
+            total[where_a] += a
+        if b is not None:
+            total[where_b] += b
+        totals.append(total)
+
+    return keys, tuple(totals)
+
 class histo:
 
     # hbookObject contains tools for creating an hbook-style
@@ -28,23 +270,88 @@ class histo:
     #   histo1.hfill(the_xvalue);
     #   histo2.hfill(an_xvalue, a_yvalue);
     #
+    # or, to fill from whole numpy arrays at once:
+    #   histo1.hfill_array(array_of_xvalues);
+    #   histo2.hfill_array(array_of_xvalues, array_of_yvalues);
+    #
     #   histo1.hprint();
     #   histo2.hprint();
     #
+    # to watch a histogram fill up while data streams in:
+    #   histo1.hlive();
+    #   while taking_data:
+    #       histo1.hfill_array(new_xvalues);
+    #       histo1.hrefresh();
+    #
     # for a logarithmic y scale use hprintlog instead of hprint:
     #   histo1.hprintlog();
     #   histo2.hprintlog();
+    #
+    # to keep lots of histograms in memory, pick a compact type for the bin
+    # populations. it is promoted to a wider type if a bin would overflow:
+    #   histo3 = hb.histo('compact', 1000, 0., 10., bin_dtype = np.uint16)
+    #
+    # bins don't have to be the same width: hand in the bin edges instead of
+    # the number of bins and the limits (log_edges, below, makes log-spaced
+    # ones):
+    #   histo4 = hb.histo('pressure drop', xedges = hb.log_edges(0.1, 50., 60))
+    #   histo5 = hb.histo('a scatterplot', xedges = [0., 1., 2., 5., 10.],
+    #                     yedges = hb.log_edges(0.1, 50., 30))
+    #
+    # entries can carry weights; the sums of the weights squared are kept
+    # too, for the errors on the bin contents (herrors):
+    #   histo1.hfill(the_xvalue, weight = the_weight);
+    #   histo1.hfill_array(array_of_xvalues, weights = array_of_weights);
+    #
+    # a fine-grained scatterplot that is mostly empty can keep just the bins
+    # that have something in them. hcontents (or hdense) makes the full
+    # array when you want it:
+    #   histo6 = hb.histo('dp vs. T', 2000, 0., 50., 2000, 15., 35., sparse = True)
     
     # Note that we want to modify the object in place, rather
     # than working with a copy: this is the ol' call-by-value vs.
     # call-by-reference issue.
+
+    # fixed list of attributes: no per-object __dict__, which keeps
+    # thousands of histograms cheap to hold in memory.
+    __slots__ = ("htitle", "nx", "ny", "xmin", "xmax", "ymin", "ymax", \
+    "htype", "dx", "dy", "xlabel_hist", "ylabel_hist", "ntot", \
+    "ntot_including_overflows", "binpop", "integrated_binpop", \
+    "bin_left_edge", "bin_bottom_edge", "x_edges", "y_edges", \
+    "x_uniform", "y_uniform", \
+    "number_of_probability_bins_uniform_flat", \
+    "probability_bin_width_uniform_flat", \
+    "integrated_probability_to_here_uniform_flat", \
+    "corresponding_integrated_binpop_array_index", \
+    "_xsum_exact", "_xsumsq_exact", "_ysum_exact", "_ysumsq_exact", \
+    "already_called_hintegrate", \
+    "handle", "_statistics", "_bin_count_max", "_sampling_probability", \
+    "_sampling_x", "_live", "weighted", "sumw", "sumw2", \
+    "_xweight_exact", "_yweight_exact", "sparse", "_sparse_keys", \
+    "_sparse_counts", "_sparse_sumw", "_sparse_sumw2", "_sparse_pending", \
+    "_sparse_pending_size", "_xsums_pending", "_ysums_pending")
     
     def __init__(self, title = "histogram title", nxbins = 10, xleft = 0., \
-    xright = 100., nybins = 0, ybottom = 0., ytop = 0.):
+    xright = 100., nybins = 0, ybottom = 0., ytop = 0., bin_dtype = np.int64, \
+    xedges = None, yedges = None, sparse = False):
         
         # import library
         import numpy as np
 
+        # bin edges handed in take the place of the number of bins and the
+        # limits.
+        if xedges is not None:
+            xedges = _check_edges(xedges, "x")
+            nxbins = xedges.size - 1
+            xleft = float(xedges[0])
+            xright = float(xedges[-1])
+
+        if yedges is not None:
+            yedges = _check_edges(yedges, "y")
+            nybins = yedges.size - 1
+            ybottom = float(yedges[0])
+            ytop = float(yedges[-1])
+
         # histogram title: assign the class to have the same value as the 
         # argument when instantiating an object of class histo.
         self.htitle = title
@@ -70,10 +377,26 @@ class histo:
             self.htype = 1
         else:
             self.htype = 2
-            self.dy = (self.ymax - self.ymin) / self.ny
 
-        # set the x bin width too
-        self.dx = (self.xmax - self.xmin) / self.nx
+        if sparse and self.htype == 1:
+            raise ValueError("only 2-D histograms can be sparse")
+
+        # bin edges (nx + 1 of them, from xmin to xmax) and whether they are
+        # evenly spaced. Evenly spaced bins are found with a little
+        # arithmetic; otherwise with a binary search through the edges.
+        self.x_edges, self.x_uniform = _bin_edges(self.xmin, self.xmax, self.nx, xedges)
+        self.y_edges = None
+        self.y_uniform = True
+
+        # bin widths: one number for evenly spaced bins, otherwise an array
+        # with one width per bin.
+        self.dx = (self.xmax - self.xmin) / self.nx if self.x_uniform \
+        else np.diff(self.x_edges)
+
+        if self.htype == 2:
+            self.y_edges, self.y_uniform = _bin_edges(self.ymin, self.ymax, self.ny, yedges)
+            self.dy = (self.ymax - self.ymin) / self.ny if self.y_uniform \
+            else np.diff(self.y_edges)
 
         # x and y axis labels
         self.xlabel_hist = "x axis label"
@@ -88,62 +411,87 @@ class histo:
         self.ntot_including_overflows = 0
 
         # make bin population arrays. integrated_binpop is the cumulative value
-        # (running integral) for bin contents; I will normalize it so that it 
-        # runs from near zero to 1.000.
+        # (running integral) for bin contents; hintegrate fills it in and
+        # normalizes it so that it runs from near zero to 1.000.
+        self.integrated_binpop = None
+
         if self.htype == 1:
             
             # nx elements
-            self.binpop = np.array([0] * self.nx)
-            self.integrated_binpop = self.binpop
+            self.binpop = np.zeros(self.nx, dtype = bin_dtype)
             
-            # left edges of each of the bins. Setting the last argument to 
-            # False means we do not include the right edge of the last bin in 
-            # our list of values.
-            self.bin_left_edge = np.linspace(self.xmin, self.xmax, self.nx, False )
+            # left edges of each of the bins (all the edges but the right
+            # edge of the last bin).
+            self.bin_left_edge = self.x_edges[:-1]
             
         else:
 
-            # ny rows and nx columns
-            self.binpop = np.array([np.array([0] * self.nx)] * self.ny)
-            self.integrated_binpop = self.binpop
+            # ny rows and nx columns, or nothing at all for a sparse
+            # histogram (see below).
+            if sparse:
+                self.binpop = None
+            else:
+                self.binpop = np.zeros((self.ny, self.nx), dtype = bin_dtype)
             
             # left edges and bottom edges of each of the bins.
-            self.bin_left_edge = np.linspace(self.xmin, self.xmax, self.nx, False )
-            self.bin_bottom_edge = np.linspace(self.ymin, self.ymax, self.ny, False )
+            self.bin_left_edge = self.x_edges[:-1]
+            self.bin_bottom_edge = self.y_edges[:-1]
             
         # stuff relating to the integrated array so we can throw random numbers
         # flat between zero and one, and decide what value of the integrated
-        # histogram's x axis corresponds to that random number.
-        self.number_of_probability_bins_uniform_flat = 100
+        # histogram's x axis corresponds to that random number. hintegrate
+        # builds the arrays, with this many probability bins by default:
+        # ten per histogram bin (but at least 100) so the lookup table is
+        # finer than the histogram itself.
+        self.number_of_probability_bins_uniform_flat = max(100, 10 * self.nx)
         self.probability_bin_width_uniform_flat = \
         1. / self.number_of_probability_bins_uniform_flat
-        
-        # integrated probability from zero to the right side of each bin.
-        # if, for example, we have a 100 bin array, the bin width will
-        # be 0.01 and the first bin will correspond to the 1% point in
-        # the histogram. The 50th bin will be the histogram median; the
-        # 100th bin will be the right side of the last histogram bin
-        # holding anything. I am going to assume that distribution of
-        # events inside a single histogram bin is smooth: perhaps flat,
-        # or else linear.
-        self.integrated_probability_to_here_uniform_flat = \
-        np.linspace(self.probability_bin_width_uniform_flat, 1.000, \
-        self.number_of_probability_bins_uniform_flat)
-        
-        self.corresponding_integrated_binpop_array_index = self.integrated_binpop
+        self.integrated_probability_to_here_uniform_flat = None
+        self.corresponding_integrated_binpop_array_index = None
+        self._sampling_probability = None
+        self._sampling_x = None
+
+        # largest count a bin can hold before binpop needs a wider type.
+        self._bin_count_max = int(np.iinfo(bin_dtype).max)
+
+        # weights: once anything is filled with a weight, sumw and sumw2
+        # (same shape as binpop) hold the sums of the weights and of the
+        # weights squared in each bin, and the means divide by the exact
+        # sums of the weights instead of the number of entries.
+        self.weighted = False
+        self.sumw = None
+        self.sumw2 = None
+        self._xweight_exact = 0
+        self._yweight_exact = 0
 
-        # mean and RMS width in x and y
-        self.xmean = 0.
-        self.xrms = 0.
-        self.ymean = 0.
-        self.yrms = 0.
+        # the sparse backend: bin numbers (iy * nx + ix, in order) of the bins
+        # with something in them, their populations and sums of weights.
+        # Fills are put aside in _sparse_pending and counted in batches.
+        self.sparse = bool(sparse)
+        self._sparse_keys = np.zeros(0, dtype = np.int64)
+        self._sparse_counts = np.zeros(0, dtype = np.int64)
+        self._sparse_sumw = None
+        self._sparse_sumw2 = None
+        self._sparse_pending = []
+        self._sparse_pending_size = 0
+
+        # mean and RMS width in x and y are calculated from the running sums
+        # only when somebody asks for them (see hstatistics). This holds the
+        # cached (xmean, xrms, ymean, yrms); every fill throws it away.
+        self._statistics = None
 
         # quantities used to calculate mean and RMS width for points inside
-        # the plot boundaries
-        self.xsum = 0.
-        self.xsumsq = 0.
-        self.ysum = 0.
-        self.ysumsq = 0.
+        # the plot boundaries, kept as exact integers (see _exact above).
+        # read them as floats through xsum, xsumsq, ysum and ysumsq.
+        self._xsum_exact = 0
+        self._xsumsq_exact = 0
+        self._ysum_exact = 0
+        self._ysumsq_exact = 0
+
+        # terms hfill has put aside for the sums, (value, value squared,
+        # weight) after one another, until _sums_flush adds them in.
+        self._xsums_pending = []
+        self._ysums_pending = []
         
         # flag that ios sete when we have already called hintegrate for this 
         # histogram
@@ -151,6 +499,9 @@ class histo:
 
         # graphics window handle, set by hplot, and zero before then.
         self.handle = 0
+
+        # artists and such for the live display, set by hlive.
+        self._live = None
    
     ###########################################################################
     # end of class constructor __init__
@@ -159,7 +510,7 @@ class histo:
     # here is the function to fill the histogram: call it every time we have another 
     # piece of data to accumulate in our histogram.
 
-    def hfill(self, xvalue, yvalue = np.nan):
+    def hfill(self, xvalue, yvalue = np.nan, weight = None):
     
         # use this way:
         #   histo1 = hbookObject('a 1-D histogram', 10, 0., 100.);
@@ -168,6 +519,12 @@ class histo:
         #
         #   histo1.hfill(the_xvalue);
         #   histo2.hfill(an_xvalue, a_yvalue);
+        #   histo2.hfill(an_xvalue, a_yvalue, weight = a_weight);
+
+        if weight is not None and not self.weighted:
+            self._start_weights()
+
+        weight = 1. if weight is None else float(weight)
     
         # increment a counter
         self.ntot_including_overflows = self.ntot_including_overflows + 1
@@ -178,16 +535,19 @@ class histo:
         # converting (a positive real) to an integer, kinda like Fortran
         if xvalue >= self.xmin and xvalue <= self.xmax:
             
-            ixbin = np.floor((xvalue - self.xmin) / self.dx)
+            if self.x_uniform:
+                ixbin = np.floor((xvalue - self.xmin) / self.dx)
+            else:
+                ixbin = np.searchsorted(self.x_edges, xvalue, side = "right") - 1
     
             # protect against landing exactly on the right edge
             if ixbin > self.nx - 1:
                 ixbin = self.nx - 1
     
             # also calculate stuff used in eventual mean/RMS
-            # determination
-            self.xsum = self.xsum + xvalue
-            self.xsumsq = self.xsumsq + xvalue * xvalue
+            # determination (put aside; see _sums_flush)
+            weighted_x = weight * float(xvalue)
+            self._xsums_pending.extend((weighted_x, weighted_x * float(xvalue), weight))
     
         else:
             
@@ -196,7 +556,10 @@ class histo:
         # now do the y bin.
         if self.htype == 2 and yvalue >= self.ymin and yvalue <= self.ymax \
         and yvalue != np.nan:
-            iybin = np.floor((yvalue - self.ymin) / self.dy)
+            if self.y_uniform:
+                iybin = np.floor((yvalue - self.ymin) / self.dy)
+            else:
+                iybin = np.searchsorted(self.y_edges, yvalue, side = "right") - 1
     
             # protect against landing exactly on the right edge
             if iybin > self.ny - 1:
@@ -204,299 +567,1013 @@ class histo:
     
             # also calculate stuff used in eventual mean/RMS
             # determination
-            self.ysum = self.ysum + yvalue
-            self.ysumsq = self.ysumsq + yvalue * yvalue
+            weighted_y = weight * float(yvalue)
+            self._ysums_pending.extend((weighted_y, weighted_y * float(yvalue), weight))
     
         else:
             iybin = -1
+
+        if len(self._xsums_pending) >= _SUMS_PENDING or \
+        len(self._ysums_pending) >= _SUMS_PENDING:
+            self._sums_flush()
     
         # now increment the bin population.
         ixbin_WTF = int(ixbin)
         iybin_WTF = int(iybin)
         
         if self.htype == 1 and ixbin_WTF >= 0:
+            if self.binpop[ixbin_WTF] >= self._bin_count_max:
+                self.hpromote()
             self.binpop[ixbin_WTF] = self.binpop[ixbin_WTF] + 1
+            if self.weighted:
+                self.sumw[ixbin_WTF] += weight
+                self.sumw2[ixbin_WTF] += weight * weight
             self.ntot = self.ntot + 1
     
+        # binpop has ny rows and nx columns, so the y bin goes first.
         if self.htype == 2 and ixbin_WTF >= 0 and iybin_WTF >= 0:
-            self.binpop[ixbin_WTF, iybin_WTF] = self.binpop[ixbin_WTF, iybin_WTF] + 1
+            if self.sparse:
+                self._sparse_fill(np.array([iybin_WTF * self.nx + ixbin_WTF]), \
+                np.array([weight]) if self.weighted else None)
+            else:
+                if self.binpop[iybin_WTF, ixbin_WTF] >= self._bin_count_max:
+                    self.hpromote()
+                self.binpop[iybin_WTF, ixbin_WTF] = self.binpop[iybin_WTF, ixbin_WTF] + 1
+                if self.weighted:
+                    self.sumw[iybin_WTF, ixbin_WTF] += weight
+                    self.sumw2[iybin_WTF, ixbin_WTF] += weight * weight
             self.ntot = self.ntot + 1
     
-        # keep a running value of means and rms widths, so calculate
-        # them now.
-    
-        if self.ntot > 0:
-    
-            self.xmean = self.xsum / self.ntot
-            mean_square = self.xsumsq / self.ntot
-            self.xrms = np.sqrt(np.abs(mean_square - self.xmean * self.xmean))
-    
-            if self.htype == 2:
-    
-                self.ymean = self.ysum / self.ntot
-                mean_square = self.ysumsq / self.ntot
-                self.yrms = np.sqrt(np.abs(mean_square - self.ymean * self.ymean))
+        # means and rms widths (and the hintegrate lookup tables) are out of
+        # date now; they get recalculated the next time somebody asks.
+        self._statistics = None
+        self.already_called_hintegrate = False
            
     ###########################################################################
     # end of class function hfill
     ###########################################################################
-    
-    # here is a function to calculate a running integral of the bin
-    # population in the histogram. This function also sets up arrays
-    # which allow me to generate random numbers distributed
-    # (approximately) according to this histogram.
-    
-    # this routine can only be called for a 1-D histogram.
-    
-    def hintegrate(self):
-    
-        if self.htype != 1:
-            print("do not call hintegrate for a 2-D histogram.")
-            return
 
-        # now calculate a running integration of the histogram
-        self.already_called_hintegrate = True
-        running_sum = 0
-    
-        # note that the range function makes a semi-closed interval: it will 
-        # include 0, but not self.nx. And since arrays are indexed starting
-        # at zero, this is just what we want: the indices should go from 0 to
-        # array_length - 1.
-        for ixbin in range(0, self.nx):
-            running_sum = running_sum + self.binpop[ixbin]
-            self.integrated_binpop[ixbin] = running_sum
-    
-        # now normalize the integrated bin contents so we can use this
-        # as a probability distribution. with python we can do all the array
-        # elements in one shotm, so comment-out the matlab version.
-        # for ixbin in range(0, self.nx):
-        #     self.integrated_binpop[ixbin] = self.integrated_binpop[ixbin] / running_sum
-        self.integrated_binpop = self.integrated_binpop / running_sum
-      
-        # now set up arrays I can use to generate random numbers
-        # thrown according to the shape of this histogram. We'll be
-        # working with two different arrays. One is a uniform, flat
-        # distribution of probabilities that range from 0 to 1. The
-        # other is the integrated probability distribution for the
-        # histogram, namely the fraction of the events in the histogram
-        # that occur from the left-most edge of the full histogram up
-        # to the right edge of each bin.
-    
-        # in general, these arrays will have different numbers of
-        # bins: the uniform/flat array will typically have 100 bins,
-        # while the other will have the same number of bins as the
-        # histogram under consideration. we want to associate a bin
-        # in the uniform/flat array with a point along the histogram's
-        # horizontal axis corresponding to that uniform/flat bin's value.
-        # what I mean is this: say bin 50 in the uniform/flat array
-        # corresponds to an integrated probability of 0.500. In that
-        # case, it should point to the spot in the histogram that is
-        # the median in the distribution.
-    
-        # now loop over bins in the uniform/flat array. Here's what
-        # we're doing. Imagine that the uniform/flat array is 100
-        # elements long. The first array element, which correspoinds to
-        # 1% of the histogram population, will hold the value of the
-        # histogram's x axis that corresponds to 1% of the integrated
-        # histogram population.
-    
-        # we want to see which integrated probability bin first exceeds
-        # the value of integrated_probability_to_here.
-    
-        previous_histo_bin = 0
-    
-        for ibin_uniform_flat in range(0, self.number_of_probability_bins_uniform_flat):
-    
-            probability_right_edge_uniform_flat = \
-            self.integrated_probability_to_here_uniform_flat[ibin_uniform_flat]
-    
-            # look for the first bin in my histogram that has the
-            # integral, up to the right edge of that bin, exceeding the
-            # value of probability_right_edge_uniform_flat.
-    
-            for histo_bin in range(previous_histo_bin, self.nx):
-    
-                probability_right_edge_histo = self.integrated_binpop[histo_bin]
-    
-                if probability_right_edge_histo >= probability_right_edge_uniform_flat:
-    
-                    # found it! see how far from the left edge of this
-                    # bin we need to go to get the approximate point on
-                    # the histogram x axis.
-    
-                    if histo_bin > 0:
-                        probability_left_edge_histo = self.integrated_binpop[histo_bin - 1]
-                    else:
-                        probability_left_edge_histo = 0
-    
-                    fraction_of_histo_bin = \
-                    (probability_right_edge_uniform_flat - probability_left_edge_histo) / \
-                    (probability_right_edge_histo - probability_left_edge_histo)
-    
-                    # get histogram x axis value now
-    
-                    histo_x_value = self.xmin + self.dx * (histo_bin - 1 + fraction_of_histo_bin)
-    
-                    self.corresponding_integrated_binpop_array_index[ibin_uniform_flat] = \
-                    histo_x_value
+    # here is a function to fill the histogram from whole arrays of data in
+    # one shot. It does exactly what calling hfill once per value would do
+    # (same bin populations, counters, sums, mean and RMS), but the binning
+    # is done by numpy rather than by a python loop, so it is a great deal
+    # faster for long data files.
+
+    def hfill_array(self, xvalues, yvalues = None, weights = None):
+
+        # use this way:
+        #   histo1.hfill_array(array_of_xvalues);
+        #   histo2.hfill_array(array_of_xvalues, array_of_yvalues);
+        #   histo2.hfill_array(array_of_xvalues, array_of_yvalues, array_of_weights);
+
+        xvalues = np.asarray(xvalues, dtype = float).ravel()
+
+        if self.htype == 2:
+            if yvalues is None:
+                yvalues = np.full(xvalues.size, np.nan)
+            yvalues = np.asarray(yvalues, dtype = float).ravel()
+            if yvalues.size != xvalues.size:
+                raise ValueError("hfill_array needs as many y values as x values.")
+
+        if weights is not None:
+            weights = np.asarray(weights, dtype = float)
+            if weights.ndim == 0:
+                weights = np.full(xvalues.size, float(weights))
+            weights = weights.ravel()
+            if weights.size != xvalues.size:
+                raise ValueError("hfill_array needs as many weights as x values.")
+            if not self.weighted:
+                self._start_weights()
+        elif self.weighted:
+            weights = np.ones(xvalues.size)
+
+        # every value counts toward the total including over/underflows.
+        self.ntot_including_overflows = self.ntot_including_overflows + xvalues.size
+
+        # x bins, hbook style, for the values inside the plot boundaries. NaNs
+        # fail both comparisons, just as they do in hfill.
+        x_ok = (xvalues >= self.xmin) & (xvalues <= self.xmax)
+        self._add_sums("x", xvalues[x_ok], None if weights is None else weights[x_ok])
+
+        if self.htype == 1:
+
+            ixbin = self._bin_index(xvalues[x_ok], "x")
+            self._add_counts(np.bincount(ixbin, minlength = self.nx))
+            if self.weighted:
+                self._add_weights(ixbin, weights[x_ok])
+            self.ntot = self.ntot + int(ixbin.size)
+
+        else:
+
+            y_ok = (yvalues >= self.ymin) & (yvalues <= self.ymax)
+            self._add_sums("y", yvalues[y_ok], None if weights is None else weights[y_ok])
+
+            # only points inside in both x and y make it into a bin.
+            both_ok = x_ok & y_ok
+            ixbin = self._bin_index(xvalues[both_ok], "x")
+            iybin = self._bin_index(yvalues[both_ok], "y")
+            both_weights = None if weights is None else weights[both_ok]
+
+            # binpop has ny rows and nx columns, so bin (iy, ix) is number
+            # iy * nx + ix in the flattened array.
+            flat_bin = iybin.astype(np.int64) * self.nx + ixbin
+
+            if self.sparse:
+                self._sparse_fill(flat_bin, both_weights)
+            else:
+                counts = np.bincount(flat_bin, minlength = self.nx * self.ny)
+                self._add_counts(counts.reshape(self.ny, self.nx))
+                if self.weighted:
+                    self._add_weights(flat_bin, both_weights)
+
+            self.ntot = self.ntot + int(flat_bin.size)
+
+        self._statistics = None
+        self.already_called_hintegrate = False
 
-                    # update a few things then jump out of this inner loop.
-                    previous_histo_bin = histo_bin
-    
-                    # now break out of this loop.
-                    break
-    
     ###########################################################################
-    # end of class function hintegrate
+    # end of class function hfill_array
     ###########################################################################
-    
-    # here is a function to return a random number according to a 
-    # distribution given approximately by the histogram.
-    
-    def hrandom(self):
-    
-        import random as ran
 
-        # this routine can only be called for a 1-D histogram. 
-        if self.htype != 1:
-            print("do not call hrandom for a 2-D histogram.")
-            return np.nan
-    
-        # check that we've already called hintegrate by checking the 
-        # length of one of the arrays it fills. if not yet called, call 
-        # it here.
-    
-        if not self.already_called_hintegrate:
-            self.hintegrate()
-    
-        # get a random number, chosen flat from [0,1), then turn this
-        # into a bin.
-        flat_random = ran.random() / self.probability_bin_width_uniform_flat
-    
-        # now see where in my flat randoms array this falls. the matlab
-        # floor function truncates to an integer.
-    
-        flat_random_bin = np.floor(flat_random)
-        flat_random_bin_fraction = flat_random - flat_random_bin
-        
-        # we need to see where inside this particular bin the random number
-        # falls so we can extrapolate across the bin.
-    
-        if flat_random_bin >= self.number_of_probability_bins_uniform_flat:
-    
-            # here if we've overshot things, going past the right end of the array
-            TheRandom = self.xmax
-    
-        elif flat_random_bin == 0:
-    
-            # here if we are in the very first bin
-            TheRandom = self.xmin + (self.corresponding_integrated_binpop_array_index[0] - self.xmin) * \
-            flat_random_bin_fraction
-    
+    # here is a function to find the x (or y) bins for an array of values
+    # that are all inside the plot boundaries. Evenly spaced bins take a
+    # subtraction and a division, hbook style; uneven ones a binary search
+    # through the bin edges (np.searchsorted). A value on an edge goes in
+    # the bin to its right, except on the right edge of the last bin.
+
+    def _bin_index(self, values, axis):
+
+        if axis == "x":
+            low, width, edges, uniform, nbins = \
+            self.xmin, self.dx, self.x_edges, self.x_uniform, self.nx
         else:
-    
-            # here to extrapolate where inside this bin to assign the value.
-            TheRandom = self.corresponding_integrated_binpop_array_index[flat_random_bin] + \
-            (self.corresponding_integrated_binpop_array_index[flat_random_bin + 1] - \
-            self.corresponding_integrated_binpop_array_index[flat_random_bin]) * \
-            flat_random_bin_fraction
-    
-        return TheRandom
-    
+            low, width, edges, uniform, nbins = \
+            self.ymin, self.dy, self.y_edges, self.y_uniform, self.ny
+
+        if uniform:
+            index = np.floor((values - low) / width).astype(np.intp)
+        else:
+            index = np.searchsorted(edges, values, side = "right").astype(np.intp) - 1
+
+        # protect against landing exactly on the right edge
+        np.minimum(index, nbins - 1, out = index)
+
+        return index
+
     ###########################################################################
-    # end of class function hrandom
+    # end of class function _bin_index
     ###########################################################################
 
-    # here is a function to set the histogram's axis labels.
-    
-    def hsetlabels(self, xstring = "x axis label", ystring = ""):
-    
-        self.xlabel_hist = xstring
-        self.ylabel_hist = ystring
-    
+    # here is a function to add an array of counts to the bin populations,
+    # widening binpop's type first if any bin would overflow.
+
+    def _add_counts(self, counts):
+
+        if counts.size == 0:
+            return
+
+        while int(self.binpop.max()) + int(counts.max()) > self._bin_count_max:
+            if not self.hpromote():
+                break
+
+        self.binpop += counts.astype(self.binpop.dtype)
+
     ###########################################################################
-    # end of class function hsetlabels
+    # end of class function _add_counts
     ###########################################################################
-    
-    # here is a function to display the histogram to the screen in a
-    # new window, and load the "handle" to that window into the object.
-    # we will either display the histogram all by itself in the window (when
-    # the arguments are 0 or 1 or unspecified) or else as a sublot in a window
-    # with the specified number of rowas and columns of independent histograms.
-    # histyograms are numbered from left to right, from top row to bottom row.
-    
-    def hprint(self, rows = 0, columns = 0, which_pane = 0, print_now = True):
-        
-        # import library
-        import matplotlib.pyplot as plt
-        
-        # tell whether plot goes by itself or not depending on the
-        # number of arguments to this function. If solo, or the first
-        # plot to be put in this window, open a new graphics window.
-    
-        if rows == 0 or columns == 0 or which_pane == 0:
-            number_args = 1
+
+    # here is a function to add the values inside the plot boundaries (and
+    # their weights, if there are any) into the exact running sums for the
+    # x or y axis. The weighted products are rounded the same way hfill
+    # rounds them, so the sums still come out bit-for-bit the same.
+
+    def _add_sums(self, axis, values, weights):
+
+        if weights is None:
+            total = _exact_sum_of_array(values)
+            total_squares = _exact_sum_of_array(values * values)
+            total_weights = 0
         else:
-            number_args = 5
+            weighted_values = weights * values
+            total = _exact_sum_of_array(weighted_values)
+            total_squares = _exact_sum_of_array(weighted_values * values)
+            total_weights = _exact_sum_of_array(weights)
+
+        if axis == "x":
+            self._xsum_exact = self._xsum_exact + total
+            self._xsumsq_exact = self._xsumsq_exact + total_squares
+            self._xweight_exact = self._xweight_exact + total_weights
+        else:
+            self._ysum_exact = self._ysum_exact + total
+            self._ysumsq_exact = self._ysumsq_exact + total_squares
+            self._yweight_exact = self._yweight_exact + total_weights
 
-        if number_args <= 1 or which_pane == 1:
-    
-            # open a new window and title it. Also get the handle for
-            # the newly opened window. 
-            self.handle = plt.figure(self.htitle)
-    
-        if number_args >= 4:
-            
-            # set the subplot. 321 indicates three rows, two columns of plots
-            # with histogram to be placed in the first row, first column
-            subplot_argument = 100 * rows + 10 * columns + which_pane
-            plt.subplot(subplot_argument)
-            
-            if(print_now):
-                self.handle = plt.figure(self.htitle)
-    
-        # now draw it.
-        self.hdraw(rows, columns, which_pane, self.handle)
-        
     ###########################################################################
-    # end of class function hprint
+    # end of class function _add_sums
     ###########################################################################
-    
-    # here is a function to display the histogram to the screen in a
-    # new window, and load the "handle" to that window into the object.
-    # routine works by calling hprint, then changing the y axis to a
-    # log scale.
-    
-    def hprintlog(self,  rows = 0, columns = 0, which_pane = 0):
-        
-        self.hprint(rows, columns, which_pane)
 
-        # get the axes        
-        ax = self.handle.gca()
+    # here is a function to add the terms hfill put aside into the exact
+    # sums, all at once. The weights only count for a weighted histogram;
+    # the means of the others divide by ntot.
 
-        # make a logarithmic y scale
-        ax.set_yscale("log")
+    def _sums_flush(self):
 
-    ###########################################################################
-    # end of class function hprintlog
-    ###########################################################################
-        
-    # here is a function to display the histogram to the screen in the currently
-    # open plot window. It is called by hprint.
+        for axis in ("x", "y"):
+
+            pending = self._xsums_pending if axis == "x" else self._ysums_pending
+            if not pending:
+                continue
+
+            terms = np.reshape(np.array(pending, dtype = float), (-1, 3))
+            pending.clear()
+
+            if not self.weighted:
+                terms = terms[:, :2]
+
+            totals = _exact_column_sums(terms) + [0]
+
+            if axis == "x":
+                self._xsum_exact = self._xsum_exact + totals[0]
+                self._xsumsq_exact = self._xsumsq_exact + totals[1]
+                self._xweight_exact = self._xweight_exact + totals[2]
+            else:
+                self._ysum_exact = self._ysum_exact + totals[0]
+                self._ysumsq_exact = self._ysumsq_exact + totals[1]
+                self._yweight_exact = self._yweight_exact + totals[2]
+
+    ###########################################################################
+    # end of class function _sums_flush
+    ###########################################################################
+
+    # here is a function to add weights into sumw and sumw2, given the
+    # (flattened) bin number each weight goes in.
+
+    def _add_weights(self, flat_bin, weights):
+
+        nbins = self.sumw.size
+
+        self.sumw += np.bincount(flat_bin, weights = weights, \
+        minlength = nbins).reshape(self.sumw.shape)
+        self.sumw2 += np.bincount(flat_bin, weights = weights * weights, \
+        minlength = nbins).reshape(self.sumw.shape)
+
+    ###########################################################################
+    # end of class function _add_weights
+    ###########################################################################
+
+    # here is a function to turn on weights for a histogram that so far has
+    # only had plain entries, each of which counts as a weight of one.
+
+    def _start_weights(self):
+
+        if self.weighted:
+            return
+
+        # the sums put aside so far are for weight-one entries.
+        self._sums_flush()
+
+        if self.sparse:
+            self._sparse_flush()
+            self._sparse_sumw = self._sparse_counts.astype(float)
+            self._sparse_sumw2 = self._sparse_counts.astype(float)
+        else:
+            self.sumw = self.binpop.astype(float)
+            self.sumw2 = self.binpop.astype(float)
+
+        # the means so far were taken over ntot entries.
+        self._xweight_exact = self.ntot * _EXACT_UNITS_PER_ONE
+        self._yweight_exact = self.ntot * _EXACT_UNITS_PER_ONE
+
+        self.weighted = True
+
+    ###########################################################################
+    # end of class function _start_weights
+    ###########################################################################
+
+    # here is a function to put bin numbers (and weights) aside for a sparse
+    # histogram. They are counted once enough of them have piled up, or when
+    # somebody looks at the bins.
+
+    def _sparse_fill(self, flat_bin, weights):
+
+        if flat_bin.size == 0:
+            return
+
+        if self.weighted and weights is None:
+            weights = np.ones(flat_bin.size)
+
+        self._sparse_pending.append((flat_bin, weights))
+        self._sparse_pending_size = self._sparse_pending_size + flat_bin.size
+
+        if self._sparse_pending_size >= _SPARSE_PENDING:
+            self._sparse_flush()
+
+    ###########################################################################
+    # end of class function _sparse_fill
+    ###########################################################################
+
+    # here is a function to count up the fills put aside by _sparse_fill and
+    # add them into the sparse bins.
+
+    def _sparse_flush(self):
+
+        if not self._sparse_pending:
+            return
+
+        keys = np.concatenate([pending[0] for pending in self._sparse_pending])
+        weights = None
+        if self.weighted:
+            weights = np.concatenate([pending[1] for pending in self._sparse_pending])
+
+        self._sparse_pending = []
+        self._sparse_pending_size = 0
+
+        new_keys, counts, sumw, sumw2 = _sparse_sums(keys, weights)
+
+        self._sparse_keys, totals = _sparse_add( \
+        self._sparse_keys, (self._sparse_counts, self._sparse_sumw, self._sparse_sumw2), \
+        new_keys, (counts, sumw, sumw2))
+        self._sparse_counts, self._sparse_sumw, self._sparse_sumw2 = totals
+
+    ###########################################################################
+    # end of class function _sparse_flush
+    ###########################################################################
+
+    # here is a function to list the bins of a 2-D histogram that have
+    # something in them: it returns arrays of their y and x bin numbers,
+    # populations, sums of weights and sums of weights squared (None for
+    # both if the histogram has no weights). It works for dense histograms
+    # too.
+
+    def hsparse_bins(self):
+
+        if self.htype != 2:
+            raise ValueError("hsparse_bins is for 2-D histograms")
+
+        if self.sparse:
+            self._sparse_flush()
+            keys = self._sparse_keys
+            counts = self._sparse_counts
+            sumw = self._sparse_sumw
+            sumw2 = self._sparse_sumw2
+        else:
+            keys = np.flatnonzero(self.binpop).astype(np.int64)
+            counts = self.binpop.ravel()[keys].astype(np.int64)
+            sumw = self.sumw.ravel()[keys] if self.weighted else None
+            sumw2 = self.sumw2.ravel()[keys] if self.weighted else None
+
+        return keys // self.nx, keys % self.nx, counts, sumw, sumw2
+
+    ###########################################################################
+    # end of class function hsparse_bins
+    ###########################################################################
+
+    # here is a function to get the bin contents as a full array (ny rows and
+    # nx columns for a 2-D histogram): the populations, or the sums of the
+    # weights for a weighted histogram. For a sparse histogram this builds
+    # the array, and doesn't keep it.
+
+    def hcontents(self):
+
+        if not self.sparse:
+            return self.sumw if self.weighted else self.binpop
+
+        self._sparse_flush()
+
+        if self.weighted:
+            contents = np.zeros((self.ny, self.nx))
+            contents.ravel()[self._sparse_keys] = self._sparse_sumw
+        else:
+            contents = np.zeros((self.ny, self.nx), dtype = np.int64)
+            contents.ravel()[self._sparse_keys] = self._sparse_counts
+
+        return contents
+
+    ###########################################################################
+    # end of class function hcontents
+    ###########################################################################
+
+    # here is a function to get the error on each bin's contents: the square
+    # root of the sum of the weights squared, which for plain entries is the
+    # square root of the population.
+
+    def herrors(self):
+
+        if self.sparse:
+            self._sparse_flush()
+            errors = np.zeros((self.ny, self.nx))
+            errors.ravel()[self._sparse_keys] = np.sqrt(self._sparse_sumw2 \
+            if self.weighted else self._sparse_counts)
+            return errors
+
+        return np.sqrt(self.sumw2 if self.weighted else self.binpop)
+
+    ###########################################################################
+    # end of class function herrors
+    ###########################################################################
+
+    # here is a function to switch a sparse histogram over to ordinary full
+    # arrays, e.g. once it has filled up enough that the sparse bins cost
+    # more than they save. It hands back the histogram.
+
+    def hdense(self):
+
+        if not self.sparse:
+            return self
+
+        self._sparse_flush()
+
+        self.binpop = np.zeros((self.ny, self.nx), dtype = np.int64)
+        self.binpop.ravel()[self._sparse_keys] = self._sparse_counts
+        self._bin_count_max = int(np.iinfo(self.binpop.dtype).max)
+
+        if self.weighted:
+            self.sumw = np.zeros((self.ny, self.nx))
+            self.sumw.ravel()[self._sparse_keys] = self._sparse_sumw
+            self.sumw2 = np.zeros((self.ny, self.nx))
+            self.sumw2.ravel()[self._sparse_keys] = self._sparse_sumw2
+
+        self.sparse = False
+        self._sparse_keys = np.zeros(0, dtype = np.int64)
+        self._sparse_counts = np.zeros(0, dtype = np.int64)
+        self._sparse_sumw = None
+        self._sparse_sumw2 = None
+
+        return self
+
+    ###########################################################################
+    # end of class function hdense
+    ###########################################################################
+
+    # here is a function to widen the type of the bin population array, e.g.
+    # from uint16 to uint32, when a bin is about to overflow. It returns False
+    # if there is nothing wider to go to.
+
+    def hpromote(self):
+
+        wider = _wider_bin_dtype.get(self.binpop.dtype)
+
+        if wider is None:
+            return False
+
+        self.binpop = self.binpop.astype(wider)
+        self._bin_count_max = int(np.iinfo(wider).max)
+
+        return True
+
+    ###########################################################################
+    # end of class function hpromote
+    ###########################################################################
+
+    # here is a function to calculate the means and RMS widths from the
+    # running sums. It only does the arithmetic when a fill has happened
+    # since the last time; otherwise it hands back the cached values.
+    # It returns (xmean, xrms, ymean, yrms).
+
+    def hstatistics(self):
+
+        if self._statistics is not None:
+            return self._statistics
+
+        self._sums_flush()
+
+        xmean = 0.
+        xrms = 0.
+        ymean = 0.
+        yrms = 0.
+
+        # weighted histograms average over the sums of the weights rather
+        # than the number of entries.
+        if self.weighted:
+            xweight = self._xweight_exact / _EXACT_UNITS_PER_ONE
+            yweight = self._yweight_exact / _EXACT_UNITS_PER_ONE
+        else:
+            xweight = self.ntot
+            yweight = self.ntot
+
+        if self.ntot > 0 and xweight != 0:
     
-    def hdraw(self,  rows, columns, which_pane, figure_handle):
+            xmean = self.xsum / xweight
+            mean_square = self.xsumsq / xweight
+            xrms = np.sqrt(np.abs(mean_square - xmean * xmean))
+    
+            if self.htype == 2 and yweight != 0:
+    
+                ymean = self.ysum / yweight
+                mean_square = self.ysumsq / yweight
+                yrms = np.sqrt(np.abs(mean_square - ymean * ymean))
+
+        self._statistics = (xmean, xrms, ymean, yrms)
+
+        return self._statistics
+
+    ###########################################################################
+    # end of class function hstatistics
+    ###########################################################################
+
+    # mean and RMS width in x and y, read-only, computed on demand.
+
+    @property
+    def xmean(self):
+        return self.hstatistics()[0]
+
+    @property
+    def xrms(self):
+        return self.hstatistics()[1]
+
+    @property
+    def ymean(self):
+        return self.hstatistics()[2]
+
+    @property
+    def yrms(self):
+        return self.hstatistics()[3]
+
+    # running sums for points inside the plot boundaries, as floats. Python
+    # rounds the exact integer division correctly. Setting one (to reset or
+    # adjust it) stores the new value exactly.
+
+    @property
+    def xsum(self):
+        self._sums_flush()
+        return self._xsum_exact / _EXACT_UNITS_PER_ONE
+
+    @xsum.setter
+    def xsum(self, value):
+        self._sums_flush()
+        self._xsum_exact = _exact_setting("xsum", value)
+        self._statistics = None
+
+    @property
+    def xsumsq(self):
+        self._sums_flush()
+        return self._xsumsq_exact / _EXACT_UNITS_PER_ONE
+
+    @xsumsq.setter
+    def xsumsq(self, value):
+        self._sums_flush()
+        self._xsumsq_exact = _exact_setting("xsumsq", value)
+        self._statistics = None
+
+    @property
+    def ysum(self):
+        self._sums_flush()
+        return self._ysum_exact / _EXACT_UNITS_PER_ONE
+
+    @ysum.setter
+    def ysum(self, value):
+        self._sums_flush()
+        self._ysum_exact = _exact_setting("ysum", value)
+        self._statistics = None
+
+    @property
+    def ysumsq(self):
+        self._sums_flush()
+        return self._ysumsq_exact / _EXACT_UNITS_PER_ONE
+
+    @ysumsq.setter
+    def ysumsq(self, value):
+        self._sums_flush()
+        self._ysumsq_exact = _exact_setting("ysumsq", value)
+        self._statistics = None
+    
+    # here is a function to calculate a running integral of the bin
+    # population in the histogram. This function also sets up arrays
+    # which allow me to generate random numbers distributed
+    # (approximately) according to this histogram.
+    
+    # this routine can only be called for a 1-D histogram. nprob, if given,
+    # sets how many points the integrated probability lookup table has
+    # (otherwise the constructor's default is used).
+    
+    def hintegrate(self, nprob = None):
+    
+        if self.htype != 1:
+            print("do not call hintegrate for a 2-D histogram.")
+            return
+
+        # bin contents: entries, or sums of weights for a weighted histogram
+        contents = self.hcontents()
+
+        if self.weighted:
+            running_sum = float(contents.sum())
+        else:
+            running_sum = int(contents.sum())
+
+        if running_sum <= 0:
+            print("do not call hintegrate for an empty histogram.")
+            return
+
+        if nprob is not None:
+            self.number_of_probability_bins_uniform_flat = int(nprob)
+            self.probability_bin_width_uniform_flat = \
+            1. / self.number_of_probability_bins_uniform_flat
+
+        # now calculate a running integration of the histogram, normalized so
+        # we can use it as a probability distribution: element i is the
+        # fraction of the entries from the left edge of the histogram up to
+        # the right edge of bin i, so the last element is exactly 1. This is
+        # its own floating point array, not a view of binpop.
+        self.integrated_binpop = np.cumsum(contents, dtype = float) / running_sum
+      
+        # now set up arrays I can use to generate random numbers thrown
+        # according to the shape of this histogram. One is a uniform, flat
+        # set of probabilities running from 0 to 1; the other holds the point
+        # along the histogram's horizontal axis where the integrated
+        # probability reaches each of those values. For example, if the
+        # uniform/flat array has 100 bins, its 50th element is 0.500 and the
+        # corresponding x value is the median of the distribution.
+
+        # integrated probability from zero to the right side of each bin.
+        # if, for example, we have a 100 bin array, the bin width will
+        # be 0.01 and the first bin will correspond to the 1% point in
+        # the histogram. The 100th bin will be the right side of the last
+        # histogram bin holding anything. I am going to assume that the
+        # distribution of events inside a single histogram bin is flat.
+        self.integrated_probability_to_here_uniform_flat = \
+        np.linspace(self.probability_bin_width_uniform_flat, 1.000, \
+        self.number_of_probability_bins_uniform_flat)
+
+        self.corresponding_integrated_binpop_array_index = \
+        self._quantile(self.integrated_probability_to_here_uniform_flat)
+
+        # the lookup table hrandom interpolates in: the same two arrays with
+        # the zero-probability point (left edge of the first bin holding
+        # anything) stuck on the front.
+        first_filled_bin = int(np.argmax(contents > 0))
+
+        self._sampling_probability = \
+        np.concatenate(([0.], self.integrated_probability_to_here_uniform_flat))
+        self._sampling_x = np.concatenate(([self.bin_left_edge[first_filled_bin]], \
+        self.corresponding_integrated_binpop_array_index))
+
+        self.already_called_hintegrate = True
+    
+    ###########################################################################
+    # end of class function hintegrate
+    ###########################################################################
+
+    # here is a function to find the point(s) on the histogram's x axis below
+    # which a given fraction of the entries lie: hquantile(0.5) is the median.
+    # It works on a single probability or on a whole array of them, doing a
+    # binary search (np.searchsorted) through the integrated histogram.
+
+    def hquantile(self, probability):
+
+        if self.htype != 1:
+            print("do not call hquantile for a 2-D histogram.")
+            return np.nan
+
+        # integrate again if there have been fills since the last time.
+        if not self.already_called_hintegrate:
+            self.hintegrate()
+            if not self.already_called_hintegrate:
+                return np.nan
+
+        return self._quantile(probability)
+
+    ###########################################################################
+    # end of class function hquantile
+    ###########################################################################
+
+    # here is the function that does hquantile's search, in the integrated
+    # histogram as it is (hintegrate uses it while it is still setting up).
+
+    def _quantile(self, probability):
+
+        probability = np.asarray(probability, dtype = float)
+
+        # look for the first bin in my histogram that has the integral, up to
+        # the right edge of that bin, reaching the requested probability.
+        histo_bin = np.searchsorted(self.integrated_binpop, probability, side = "left")
+        histo_bin = np.clip(histo_bin, 0, self.nx - 1)
+
+        # see how far from the left edge of this bin we need to go to get the
+        # approximate point on the histogram x axis.
+        probability_right_edge_histo = self.integrated_binpop[histo_bin]
+        probability_left_edge_histo = \
+        np.where(histo_bin > 0, self.integrated_binpop[histo_bin - 1], 0.)
+
+        fraction_of_histo_bin = (probability - probability_left_edge_histo) / \
+        (probability_right_edge_histo - probability_left_edge_histo)
+        fraction_of_histo_bin = np.clip(fraction_of_histo_bin, 0., 1.)
+
+        bin_width = self.x_edges[histo_bin + 1] - self.x_edges[histo_bin]
+
+        return self.bin_left_edge[histo_bin] + bin_width * fraction_of_histo_bin
+
+    ###########################################################################
+    # end of class function _quantile
+    ###########################################################################
+    
+    # here is a function to return random numbers according to a 
+    # distribution given approximately by the histogram.
+
+    # use this way:
+    #   one_value = histo1.hrandom()
+    #   lots_of_values = histo1.hrandom(1000000)
+    #   seeded_values = histo1.hrandom(1000000, np.random.default_rng(12345))
+    
+    def hrandom(self, n = None, rng = None):
+    
+        # this routine can only be called for a 1-D histogram. 
+        if self.htype != 1:
+            print("do not call hrandom for a 2-D histogram.")
+            return np.nan
+    
+        # check that we've already called hintegrate (and that no fills have
+        # happened since). if not, call it here.
+    
+        if not self.already_called_hintegrate:
+            self.hintegrate()
+            if not self.already_called_hintegrate:
+                return np.nan
+
+        if rng is None:
+            rng = _default_rng
+    
+        # get random numbers, chosen flat from [0,1), then see where they
+        # fall in the integrated probability lookup table and interpolate
+        # across that table bin to get the x value. np.interp finds the
+        # table bin with a binary search, so this is fast for big n.
+        flat_random = rng.random(n)
+
+        TheRandom = np.interp(flat_random, self._sampling_probability, self._sampling_x)
+
+        if n is None:
+            return float(TheRandom)
+
+        return TheRandom
+    
+    ###########################################################################
+    # end of class function hrandom
+    ###########################################################################
+
+    # here is a function to make a new, empty histogram with the same title,
+    # binning, labels and bin population type as this one.
+
+    def hclone(self):
+
+        twin = histo(self.htitle, \
+        bin_dtype = np.int64 if self.sparse else self.binpop.dtype, \
+        xedges = self.x_edges, yedges = self.y_edges, sparse = self.sparse)
+
+        twin.hsetlabels(self.xlabel_hist, self.ylabel_hist)
+        twin.number_of_probability_bins_uniform_flat = \
+        self.number_of_probability_bins_uniform_flat
+        twin.probability_bin_width_uniform_flat = \
+        self.probability_bin_width_uniform_flat
+
+        return twin
+
+    ###########################################################################
+    # end of class function hclone
+    ###########################################################################
+
+    # here is a function to add another histogram's contents into this one:
+    # bin populations, entry counters (including over/underflows) and the
+    # running sums behind the mean and RMS. The two histograms must have the
+    # same binning. Because the sums are exact, merging pieces filled
+    # separately gives bit-for-bit what filling everything here would have.
+
+    # use this way:
+    #   histo1.hmerge(histo1_from_another_file)
+    # or
+    #   histo1 += histo1_from_another_file
+
+    def hmerge(self, other):
+
+        if not self.hsame_binning(other):
+            raise ValueError("cannot merge histograms with different binning: '" \
+            + str(self.htitle) + "' and '" + str(other.htitle) + "'")
+
+        if other.weighted and not self.weighted:
+            self._start_weights()
+
+        if self.sparse:
+
+            iy, ix, counts, sumw, sumw2 = other.hsparse_bins()
+            if self.weighted and sumw is None:
+                sumw = counts.astype(float)
+                sumw2 = counts.astype(float)
+
+            self._sparse_flush()
+            self._sparse_keys, totals = _sparse_add(self._sparse_keys, \
+            (self._sparse_counts, self._sparse_sumw, self._sparse_sumw2), \
+            (iy * self.nx + ix).astype(np.int64), (counts, sumw, sumw2))
+            self._sparse_counts, self._sparse_sumw, self._sparse_sumw2 = totals
+
+        else:
+
+            if other.sparse:
+                other = other.hclone().hmerge(other).hdense()
+
+            self._add_counts(other.binpop)
+
+            if self.weighted:
+                self.sumw += other.sumw if other.weighted else other.binpop
+                self.sumw2 += other.sumw2 if other.weighted else other.binpop
+
+        self.ntot = self.ntot + other.ntot
+        self.ntot_including_overflows = \
+        self.ntot_including_overflows + other.ntot_including_overflows
+
+        self._sums_flush()
+        other._sums_flush()
+
+        self._xsum_exact = self._xsum_exact + other._xsum_exact
+        self._xsumsq_exact = self._xsumsq_exact + other._xsumsq_exact
+        self._ysum_exact = self._ysum_exact + other._ysum_exact
+        self._ysumsq_exact = self._ysumsq_exact + other._ysumsq_exact
+        if self.weighted:
+            if other.weighted:
+                self._xweight_exact = self._xweight_exact + other._xweight_exact
+                self._yweight_exact = self._yweight_exact + other._yweight_exact
+            else:
+                self._xweight_exact = self._xweight_exact + other.ntot * _EXACT_UNITS_PER_ONE
+                self._yweight_exact = self._yweight_exact + other.ntot * _EXACT_UNITS_PER_ONE
+
+        self._statistics = None
+        self.already_called_hintegrate = False
+
+        return self
+
+    def __iadd__(self, other):
+        return self.hmerge(other)
+
+    ###########################################################################
+    # end of class function hmerge
+    ###########################################################################
+
+    # here is a function to tell whether another histogram has the same
+    # binning as this one, so that the two can be merged.
+
+    def hsame_binning(self, other):
+
+        if self.htype != other.htype or not np.array_equal(self.x_edges, other.x_edges):
+            return False
+
+        if self.htype == 2 and not np.array_equal(self.y_edges, other.y_edges):
+            return False
+
+        return True
+
+    ###########################################################################
+    # end of class function hsame_binning
+    ###########################################################################
+
+    # here is a function to write the histogram to a compact binary (numpy
+    # .npz) file. Read it back with hload (outside the class, below):
+    #   histo1.hsave("histo1.npz")
+    #   histo1_again = hb.hload("histo1.npz")
+
+    def hsave(self, filename):
+
+        if self.sparse:
+            self._sparse_flush()
+
+        self._sums_flush()
+
+        nothing = np.zeros(0)
+
+        np.savez_compressed(filename, \
+        binpop = nothing if self.sparse else self.binpop, \
+        weighted = self.weighted, \
+        sumw = self.sumw if self.weighted and not self.sparse else nothing, \
+        sumw2 = self.sumw2 if self.weighted and not self.sparse else nothing, \
+        sparse = self.sparse, \
+        sparse_keys = self._sparse_keys, \
+        sparse_counts = self._sparse_counts, \
+        sparse_sumw = self._sparse_sumw if self._sparse_sumw is not None else nothing, \
+        sparse_sumw2 = self._sparse_sumw2 if self._sparse_sumw2 is not None else nothing, \
+        htitle = np.array(str(self.htitle)), \
+        xlabel_hist = np.array(str(self.xlabel_hist)), \
+        ylabel_hist = np.array(str(self.ylabel_hist)), \
+        nx = self.nx, xmin = self.xmin, xmax = self.xmax, \
+        ny = self.ny, ymin = self.ymin, ymax = self.ymax, \
+        x_edges = self.x_edges, \
+        y_edges = self.y_edges if self.htype == 2 else np.zeros(0), \
+        ntot = self.ntot, \
+        ntot_including_overflows = self.ntot_including_overflows, \
+        number_of_probability_bins_uniform_flat = \
+        self.number_of_probability_bins_uniform_flat, \
+        exact_sums = np.array([str(self._xsum_exact), str(self._xsumsq_exact), \
+        str(self._ysum_exact), str(self._ysumsq_exact), \
+        str(self._xweight_exact), str(self._yweight_exact)]))
+
+    ###########################################################################
+    # end of class function hsave
+    ###########################################################################
+
+    # here is a function to fill this histogram from a list of data files
+    # using a pool of processes: each file is read and binned into its own
+    # copy of the histogram on one of the processors, and the pieces are then
+    # merged in here. loader(filename) has to return an array of x values
+    # (or a tuple of x and y arrays for a scatter plot), and must be an
+    # ordinary module-level function so it can be shipped to the workers.
+    # nproc = None uses every processor.
+
+    # use this way:
+    #   histo1.hfill_parallel(glob.glob("Data/DPS310E_*.CSV"), my_loader, 4)
+
+    def hfill_parallel(self, files, loader, nproc = None):
+
+        import multiprocessing
+
+        jobs = [(self.hclone(), filename, loader) for filename in files]
+
+        with multiprocessing.Pool(nproc) as pool:
+            pieces = pool.map(_fill_from_file, jobs)
+
+        for piece in pieces:
+            self.hmerge(piece)
+
+        return self
+
+    ###########################################################################
+    # end of class function hfill_parallel
+    ###########################################################################
+
+    # here is a function to set the histogram's axis labels.
+    
+    def hsetlabels(self, xstring = "x axis label", ystring = ""):
+    
+        self.xlabel_hist = xstring
+        self.ylabel_hist = ystring
+    
+    ###########################################################################
+    # end of class function hsetlabels
+    ###########################################################################
+    
+    # here is a function to display the histogram to the screen in a
+    # new window, and load the "handle" to that window into the object.
+    # we will either display the histogram all by itself in the window (when
+    # the arguments are 0 or 1 or unspecified) or else as a sublot in a window
+    # with the specified number of rowas and columns of independent histograms.
+    # histyograms are numbered from left to right, from top row to bottom row.
+    
+    def hprint(self, rows = 0, columns = 0, which_pane = 0, print_now = True):
         
+        # import library
         import matplotlib.pyplot as plt
-    
+        
         # tell whether plot goes by itself or not depending on the
         # number of arguments to this function. If solo, or the first
-        # plot to be put in this window, put the text box with means,
-        # etc. in the upper left corner of the plot.
+        # plot to be put in this window, open a new graphics window.
     
         if rows == 0 or columns == 0 or which_pane == 0:
-            number_dimensions = 1
+            number_args = 1
         else:
-            number_dimensions = 2
+            number_args = 5
+
+        if number_args <= 1 or which_pane == 1:
+    
+            # open a new window and title it. Also get the handle for
+            # the newly opened window. 
+            self.handle = plt.figure(self.htitle)
+    
+        if number_args >= 4:
+            
+            # set the subplot. 321 indicates three rows, two columns of plots
+            # with histogram to be placed in the first row, first column
+            subplot_argument = 100 * rows + 10 * columns + which_pane
+            plt.subplot(subplot_argument)
+            
+            if(print_now):
+                self.handle = plt.figure(self.htitle)
+    
+        # now draw it.
+        self.hdraw(rows, columns, which_pane, self.handle)
+        
+    ###########################################################################
+    # end of class function hprint
+    ###########################################################################
+    
+    # here is a function to display the histogram to the screen in a
+    # new window, and load the "handle" to that window into the object.
+    # routine works by calling hprint, then changing the y axis to a
+    # log scale.
+    
+    def hprintlog(self,  rows = 0, columns = 0, which_pane = 0):
+        
+        self.hprint(rows, columns, which_pane)
+
+        # get the axes        
+        ax = self.handle.gca()
+
+        # make a logarithmic y scale
+        ax.set_yscale("log")
+
+    ###########################################################################
+    # end of class function hprintlog
+    ###########################################################################
+        
+    # here is a function to display the histogram to the screen in the currently
+    # open plot window. It is called by hprint.
+    
+    def hdraw(self,  rows, columns, which_pane, figure_handle):
+        
+        import matplotlib.pyplot as plt
     
         # now get graphics pointer/handle information for a textbox that will go into
         # the currently open window. The "annotation" reference opens the (empty)
@@ -505,9 +1582,22 @@ class histo:
         # width and height of the graphics portion of the window. (Menus are not
         # included in the width/height calculation.)
     
+        # figure out which column and row of subplots we're in, so the
+        # statistics text goes in the upper left corner of our pane:
+        this_column = which_pane % max(columns, 1)
+        if(this_column == 0):
+            this_column = max(columns, 1)
+                        
+        this_row = max(int((which_pane - 1) / max(columns, 1)) + 1, 1)
+
+        # x_for_text = 0.02 + float((this_column - 1) / max(columns, 1)) 
+        # y_for_text = 0.98 - float((this_row - 1) / max(rows, 1)) 
+        x_for_text = 0.15 + 0.85 * float((this_column - 1) / max(columns, 1)) 
+        y_for_text = 0.8 - 0.85 * float((this_row - 1) / max(rows, 1)) 
+
         # 1-D histogram:
     
-        if self.htype == 1 or number_dimensions == 1:
+        if self.htype == 1:
     
             # get axis properties
             # fig, ax = plt.subplots(1, 1)
@@ -517,10 +1607,10 @@ class histo:
             # left edges of bins: self.bin_left_edge
             # bin populations: self.binpop
             # we need to monkey around a little to get the last bin to display.
-            bin_edges = \
-            np.append(self.bin_left_edge, self.bin_left_edge[self.nx - 1] + self.dx)
+            bin_edges = self.x_edges
 
-            bin_contents = np.append(self.binpop, self.binpop[self.nx - 1])
+            contents = self.hcontents()
+            bin_contents = np.append(contents, contents[self.nx - 1])
             
             plt.step(bin_edges, bin_contents, where = "post")
 
@@ -529,24 +1619,6 @@ class histo:
             plt.ylabel(self.ylabel_hist)
             plt.title(self.htitle)
             
-            # now create a string that includes 5 digits past the decimal point for the
-            # mean and 3 past the decimal for the RMS width. Note the exact placement of
-            # percent signs, and so forth. 
-            statistics_message = \
-            "mean: %.5f  \nRMS = %.3f  \nN = %d" % (self.xmean, self.xrms, self.ntot)
-            
-            # figure out which column and row of subplots we're in:
-            this_column = which_pane % max(columns, 1)
-            if(this_column == 0):
-                this_column = max(columns, 1)
-                            
-            this_row = max(int((which_pane - 1) / max(columns, 1)) + 1, 1)
-
-            # x_for_text = 0.02 + float((this_column - 1) / max(columns, 1)) 
-            # y_for_text = 0.98 - float((this_row - 1) / max(rows, 1)) 
-            x_for_text = 0.15 + 0.85 * float((this_column - 1) / max(columns, 1)) 
-            y_for_text = 0.8 - 0.85 * float((this_row - 1) / max(rows, 1)) 
-        
             # get axis properties
             # fig, ax = plt.subplots(this_column, this_row)
             # ax = figure_handle.gca()
@@ -559,14 +1631,638 @@ class histo:
             # add the statistics information string to the upper left corner of the plot.
             # plt.text(x_for_text, y_for_text, statistics_message, \
             # color="#550000", fontsize=10)  
-            plt.figtext(x_for_text, y_for_text, statistics_message)
+            plt.figtext(x_for_text, y_for_text, self._statistics_message())
             # plt.text(x_for_text, 400, statistics_message, \
             # color="#550000", fontsize=10)  
 
-        # 2-D histograms
-            
-        # I haven't implemented this yet.
+        # 2-D histograms: bin populations as a color map, binpop's rows
+        # going up the y axis.
+
+        else:
+
+            mesh = self._draw_mesh(plt.gca())
+            plt.colorbar(mesh, ax = plt.gca())
+
+            plt.xlabel(self.xlabel_hist)
+            plt.ylabel(self.ylabel_hist)
+            plt.title(self.htitle)
+
+            plt.figtext(x_for_text, y_for_text, self._statistics_message())
             
     ###########################################################################
     # end of class function hdraw
     ###########################################################################
+
+    # here is a function to put the bin populations of a 2-D histogram on
+    # a set of axes with pcolormesh, one colored rectangle per bin.
+
+    def _draw_mesh(self, ax, animated = False):
+
+        contents = self.hcontents()
+
+        return ax.pcolormesh(self.x_edges, self.y_edges, contents, shading = "flat", \
+        vmin = 0, vmax = max(1., float(contents.max())), animated = animated)
+
+    ###########################################################################
+    # end of class function _draw_mesh
+    ###########################################################################
+
+    # here is a function to make the string with the means, RMS widths and
+    # number of entries that goes on the plots. Note the exact placement of
+    # percent signs, and so forth: 5 digits past the decimal point for the
+    # mean and 3 past the decimal for the RMS width.
+
+    def _statistics_message(self):
+
+        if self.htype == 1:
+            return "mean: %.5f  \nRMS = %.3f  \nN = %d" % \
+            (self.xmean, self.xrms, self.ntot)
+
+        return "x mean: %.5f  \nx RMS = %.3f  \ny mean: %.5f  \ny RMS = %.3f  \nN = %d" \
+        % (self.xmean, self.xrms, self.ymean, self.yrms, self.ntot)
+
+    ###########################################################################
+    # end of class function _statistics_message
+    ###########################################################################
+
+    # here is a function to set up a live display of the histogram: a window
+    # (or pane of a window) whose plot is drawn once and then only has its
+    # bin contents and statistics text updated, by hrefresh, as more data
+    # come in. Only the histogram's own rectangle of the screen is redrawn
+    # ("blitting"), so it keeps up with tens of refreshes a second.
+    # rows, columns and which_pane work as for hprint; pass the handle of a
+    # window made by another histogram's hlive to share it. hrefresh
+    # ignores calls that come less than 1/max_rate seconds after the last
+    # redraw, so a fast stream of data can't pile up redraws.
+
+    # use this way:
+    #   histo1.hlive(2, 1, 1)
+    #   histo2.hlive(2, 1, 2, histo1.handle)
+    #   while taking_data:
+    #       histo1.hfill_array(...)
+    #       histo2.hfill_array(...)
+    #       histo1.hrefresh()
+    #       histo2.hrefresh()
+
+    def hlive(self, rows = 0, columns = 0, which_pane = 0, figure_handle = None, \
+    max_rate = 60.):
+
+        import matplotlib.pyplot as plt
+
+        if figure_handle is None:
+            figure_handle = plt.figure(self.htitle)
+
+        if rows == 0 or columns == 0 or which_pane == 0:
+            rows, columns, which_pane = 1, 1, 1
+
+        self.handle = figure_handle
+        ax = figure_handle.add_subplot(rows, columns, which_pane)
+
+        # animated artists are left out of ordinary redraws; we draw them
+        # ourselves on top of a saved copy of everything else.
+        if self.htype == 1:
+            artist = ax.stairs(self.hcontents(), self.x_edges, animated = True)
+            ax.set_xlim(self.xmin, self.xmax)
+            top = max(1., float(self.hcontents().max()))
+            ax.set_ylim(0, 1.2 * top)
+        else:
+            artist = self._draw_mesh(ax, animated = True)
+            figure_handle.colorbar(artist, ax = ax)
+            top = max(1., float(self.hcontents().max()))
+
+        ax.set_xlabel(self.xlabel_hist)
+        ax.set_ylabel(self.ylabel_hist)
+        ax.set_title(self.htitle)
+
+        text = ax.text(0.02, 0.98, self._statistics_message(), \
+        horizontalalignment = "left", verticalalignment = "top", \
+        transform = ax.transAxes, animated = True)
+
+        canvas = figure_handle.canvas
+
+        self._live = {"axes": ax, "artist": artist, "text": text, \
+        "background": None, "top": top, "interval": 1. / max_rate, \
+        "last_refresh": 0., "callback": None}
+
+        # every full redraw (first showing, resizing, a new scale) saves a
+        # new background and puts our artists back on top of it.
+        self._live["callback"] = canvas.mpl_connect("draw_event", self._live_draw)
+
+        plt.show(block = False)
+        canvas.draw()
+        canvas.flush_events()
+
+        return figure_handle
+
+    ###########################################################################
+    # end of class function hlive
+    ###########################################################################
+
+    # here is a function to update the live display made by hlive with the
+    # current bin populations. It returns True if it redrew, False if it was
+    # too soon since the last time (force = True redraws anyway).
+
+    def hrefresh(self, force = False):
+
+        import time
+
+        if self._live is None:
+            print("Call hlive for histogram ", self.htitle, \
+            "before calling hrefresh.")
+            return False
+
+        live = self._live
+
+        now = time.perf_counter()
+        if not force and now - live["last_refresh"] < live["interval"]:
+            return False
+        live["last_refresh"] = now
+
+        ax = live["axes"]
+        canvas = ax.figure.canvas
+        contents = self.hcontents()
+        top = float(contents.max())
+
+        if self.htype == 1:
+            live["artist"].set_data(contents)
+        else:
+            live["artist"].set_array(contents.ravel())
+
+        live["text"].set_text(self._statistics_message())
+
+        # if the biggest bin has outgrown the scale, the axes (or color bar)
+        # need redrawing, so do the whole window. Leave some headroom so
+        # this doesn't happen on every refresh.
+        if top > live["top"]:
+            live["top"] = 2 * top
+            if self.htype == 1:
+                ax.set_ylim(0, 1.2 * live["top"])
+            else:
+                live["artist"].set_clim(0, live["top"])
+            live["background"] = None
+
+        if live["background"] is None:
+            canvas.draw()
+        else:
+            canvas.restore_region(live["background"])
+            ax.draw_artist(live["artist"])
+            ax.draw_artist(live["text"])
+            canvas.blit(ax.bbox)
+
+        canvas.flush_events()
+
+        return True
+
+    ###########################################################################
+    # end of class function hrefresh
+    ###########################################################################
+
+    # here is the function matplotlib calls after every full redraw of a
+    # live display's window.
+
+    def _live_draw(self, event):
+
+        live = self._live
+
+        if live is None:
+            return
+
+        ax = live["axes"]
+
+        live["background"] = event.canvas.copy_from_bbox(ax.bbox)
+        ax.draw_artist(live["artist"])
+        ax.draw_artist(live["text"])
+
+    ###########################################################################
+    # end of class function _live_draw
+    ###########################################################################
+
+    # here is a function to stop the live display. The window stays up,
+    # showing the last refresh.
+
+    def hlive_stop(self):
+
+        if self._live is not None:
+            self.handle.canvas.mpl_disconnect(self._live["callback"])
+            self._live = None
+
+    ###########################################################################
+    # end of class function hlive_stop
+    ###########################################################################
+
+###########################################################################
+
+# here is a function to read back a histogram written by histo.hsave.
+
+def hload(filename):
+
+    with np.load(filename, allow_pickle = False) as saved:
+
+        binpop = saved["binpop"]
+        sparse = "sparse" in saved and bool(saved["sparse"])
+        bin_dtype = np.int64 if sparse else binpop.dtype
+
+        if int(saved["ny"]) == 0:
+            h = histo(str(saved["htitle"]), int(saved["nx"]), \
+            float(saved["xmin"]), float(saved["xmax"]), bin_dtype = bin_dtype, \
+            xedges = saved["x_edges"] if "x_edges" in saved else None)
+        else:
+            h = histo(str(saved["htitle"]), int(saved["nx"]), \
+            float(saved["xmin"]), float(saved["xmax"]), int(saved["ny"]), \
+            float(saved["ymin"]), float(saved["ymax"]), bin_dtype = bin_dtype, \
+            xedges = saved["x_edges"] if "x_edges" in saved else None, \
+            yedges = saved["y_edges"] if "y_edges" in saved else None, \
+            sparse = sparse)
+
+        h.hsetlabels(str(saved["xlabel_hist"]), str(saved["ylabel_hist"]))
+
+        weighted = "weighted" in saved and bool(saved["weighted"])
+
+        if sparse:
+            h._sparse_keys = saved["sparse_keys"]
+            h._sparse_counts = saved["sparse_counts"]
+            if weighted:
+                h._sparse_sumw = saved["sparse_sumw"]
+                h._sparse_sumw2 = saved["sparse_sumw2"]
+        else:
+            h.binpop[...] = binpop
+            if weighted:
+                h.sumw = saved["sumw"]
+                h.sumw2 = saved["sumw2"]
+
+        h.weighted = weighted
+        h.ntot = int(saved["ntot"])
+        h.ntot_including_overflows = int(saved["ntot_including_overflows"])
+
+        nprob = int(saved["number_of_probability_bins_uniform_flat"])
+        h.number_of_probability_bins_uniform_flat = nprob
+        h.probability_bin_width_uniform_flat = 1. / nprob
+
+        exact_sums = [int(value) for value in saved["exact_sums"]]
+        h._xsum_exact, h._xsumsq_exact, h._ysum_exact, h._ysumsq_exact = exact_sums[:4]
+
+        # files from before weights only ever had weight-1 entries.
+        if len(exact_sums) >= 6:
+            h._xweight_exact, h._yweight_exact = exact_sums[4:6]
+        else:
+            h._xweight_exact = h.ntot * _EXACT_UNITS_PER_ONE
+            h._yweight_exact = h.ntot * _EXACT_UNITS_PER_ONE
+
+    return h
+
+###########################################################################
+# end of function hload
+###########################################################################
+
+# here is the function each worker process runs for histo.hfill_parallel:
+# read one file and fill an empty copy of the histogram from it.
+
+def _fill_from_file(job):
+
+    h, filename, loader = job
+
+    values = loader(filename)
+
+    if isinstance(values, tuple):
+        h.hfill_array(*values)
+    else:
+        h.hfill_array(values)
+
+    return h
+
+###########################################################################
+# end of function _fill_from_file
+###########################################################################
+
+# here is a class to keep a whole bank of 1-D histograms with the same
+# binning, one per channel (the pressure sensors p0, p1, ..., the nine
+# positions along the long tube), as one (channels, nbins) array. One call
+# fills every channel from a matrix with a row per sample and a column per
+# channel: the binning, the counting (a single np.bincount) and the exact
+# running sums are each done once for the whole matrix instead of once per
+# channel. Indexing with a channel number or name hands back an ordinary
+# histo with a copy of that channel.
+
+class histo_bank:
+
+    # use this way:
+    #   import histogramObject as hb
+    #
+    #   bank = hb.histo_bank('pressures', ["p0", "p1", "p2", "p3"], 100, 990., 1010.)
+    #   bank.hsetlabels('pressure (hPa)', 'samples')
+    #
+    #   samples = np.column_stack([run[name] for name in bank.channels])
+    #   bank.hfill_array(samples)
+    #
+    #   print(bank.xmean, bank.xrms)
+    #   bank["p1"].hprint()
+    #   upstream = bank[0:2]
+    #   bank.hprint()
+
+    __slots__ = ("htitle", "channels", "nx", "xmin", "xmax", "dx", \
+    "x_edges", "xlabel_hist", "ylabel_hist", "ntot", \
+    "ntot_including_overflows", "binpop", "_template", "_xsum_exact", \
+    "_xsumsq_exact", "_statistics", "handle")
+
+    def __init__(self, title = "histogram bank title", channels = 1, nxbins = 10, \
+    xleft = 0., xright = 100., xedges = None):
+
+        # channels: how many, or a list of their names.
+        if np.ndim(channels) == 0:
+            channels = [str(channel) for channel in range(int(channels))]
+        else:
+            channels = [str(channel) for channel in channels]
+
+        if not channels:
+            raise ValueError("a histogram bank needs at least one channel")
+
+        if len(set(channels)) != len(channels):
+            raise ValueError("histogram bank channel names need to be different")
+
+        self.htitle = title
+        self.channels = channels
+
+        # one histo does the binning for every channel.
+        self._template = histo(title, nxbins, xleft, xright, xedges = xedges)
+
+        self.nx = self._template.nx
+        self.xmin = self._template.xmin
+        self.xmax = self._template.xmax
+        self.dx = self._template.dx
+        self.x_edges = self._template.x_edges
+
+        self.xlabel_hist = "x axis label"
+        self.ylabel_hist = "y axis label"
+
+        # one row of bins per channel, and one counter per channel.
+        self.binpop = np.zeros((len(channels), self.nx), dtype = np.int64)
+        self.ntot = np.zeros(len(channels), dtype = np.int64)
+        self.ntot_including_overflows = np.zeros(len(channels), dtype = np.int64)
+
+        # exact running sums, one per channel (see _exact).
+        self._xsum_exact = [0] * len(channels)
+        self._xsumsq_exact = [0] * len(channels)
+
+        self._statistics = None
+        self.handle = 0
+
+    ###########################################################################
+    # end of class constructor __init__
+    ###########################################################################
+
+    # here is a function to fill every channel from a matrix of samples, a
+    # row per sample and a column per channel. It does what calling
+    # hfill_array on each channel's histo would do.
+
+    def hfill_array(self, samples):
+
+        samples = np.asarray(samples, dtype = float)
+
+        if samples.ndim == 1 and len(self.channels) == 1:
+            samples = samples[:, np.newaxis]
+
+        if samples.ndim != 2 or samples.shape[1] != len(self.channels):
+            raise ValueError("hfill_array needs a row per sample and a column for each of the " \
+            + str(len(self.channels)) + " channels.")
+
+        self.ntot_including_overflows += samples.shape[0]
+
+        # a block of rows at a time, so the scratch arrays stay small.
+        rows_per_block = max(1, _EXACT_CHUNK // len(self.channels))
+
+        for start in range(0, samples.shape[0], rows_per_block):
+            self._fill_block(samples[start:start + rows_per_block])
+
+        self._statistics = None
+
+    ###########################################################################
+    # end of class function hfill_array
+    ###########################################################################
+
+    # here is a function to fill every channel from a block of rows.
+
+    def _fill_block(self, samples):
+
+        nchannels = len(self.channels)
+
+        # values outside the plot boundaries (NaNs too) are set to zero,
+        # which adds nothing to the sums, rather than picked out; that way
+        # everything stays a (samples, channels) array and the channel is
+        # just the column.
+        inside = (samples >= self.xmin) & (samples <= self.xmax)
+        values = np.where(inside, samples, 0.)
+
+        # channel c's bins are numbers c * nx to c * nx + nx - 1, and
+        # anything outside goes in one more bin on the end, thrown away.
+        flat_bin = self._template._bin_index(values, "x")
+        flat_bin += np.arange(nchannels) * self.nx
+        flat_bin[~inside] = nchannels * self.nx
+
+        counts = np.bincount(flat_bin.ravel(), minlength = nchannels * self.nx + 1)
+        self.binpop += counts[:-1].reshape(nchannels, self.nx)
+        self.ntot += inside.sum(axis = 0)
+
+        sums = _exact_column_sums(values)
+        values *= values
+        sums_of_squares = _exact_column_sums(values)
+
+        for which in range(nchannels):
+            self._xsum_exact[which] = self._xsum_exact[which] + sums[which]
+            self._xsumsq_exact[which] = self._xsumsq_exact[which] + sums_of_squares[which]
+
+    ###########################################################################
+    # end of class function _fill_block
+    ###########################################################################
+
+    # here is a function to fill every channel with one sample each.
+
+    def hfill(self, values):
+
+        self.hfill_array(np.asarray(values, dtype = float).reshape(1, -1))
+
+    ###########################################################################
+    # end of class function hfill
+    ###########################################################################
+
+    # here is a function to calculate every channel's mean and RMS width
+    # from the running sums, the same way histo.hstatistics does. It
+    # returns (xmean, xrms), each an array with one value per channel.
+
+    def hstatistics(self):
+
+        if self._statistics is not None:
+            return self._statistics
+
+        xmean = np.zeros(len(self.channels))
+        xrms = np.zeros(len(self.channels))
+
+        for which, entries in enumerate(self.ntot):
+
+            if entries > 0:
+                xmean[which] = (self._xsum_exact[which] / _EXACT_UNITS_PER_ONE) / int(entries)
+                mean_square = (self._xsumsq_exact[which] / _EXACT_UNITS_PER_ONE) / int(entries)
+                xrms[which] = np.sqrt(np.abs(mean_square - xmean[which] * xmean[which]))
+
+        self._statistics = (xmean, xrms)
+
+        return self._statistics
+
+    ###########################################################################
+    # end of class function hstatistics
+    ###########################################################################
+
+    # means and RMS widths of all the channels, read-only.
+
+    @property
+    def xmean(self):
+        return self.hstatistics()[0]
+
+    @property
+    def xrms(self):
+        return self.hstatistics()[1]
+
+    def __len__(self):
+        return len(self.channels)
+
+    # here is a function to find a channel's row from its number or name.
+
+    def _channel_index(self, channel):
+
+        if isinstance(channel, str):
+            if channel not in self.channels:
+                raise KeyError("no channel '" + channel + "' in histogram bank '" \
+                + str(self.htitle) + "'")
+            return self.channels.index(channel)
+
+        return range(len(self.channels))[channel]
+
+    ###########################################################################
+    # end of class function _channel_index
+    ###########################################################################
+
+    # here is a function to pull channels out of the bank: a channel number
+    # or name gives a histo, a slice or a list of them gives a smaller
+    # histo_bank. Either way the contents are copies.
+
+    def __getitem__(self, key):
+
+        if isinstance(key, (str, int, np.integer)):
+            return self.hchannel(key)
+
+        if isinstance(key, slice):
+            rows = list(range(len(self.channels)))[key]
+        else:
+            rows = [self._channel_index(channel) for channel in key]
+
+        bank = histo_bank(self.htitle, [self.channels[row] for row in rows], \
+        xedges = self.x_edges)
+        bank.hsetlabels(self.xlabel_hist, self.ylabel_hist)
+
+        bank.binpop[...] = self.binpop[rows]
+        bank.ntot[...] = self.ntot[rows]
+        bank.ntot_including_overflows[...] = self.ntot_including_overflows[rows]
+        bank._xsum_exact = [self._xsum_exact[row] for row in rows]
+        bank._xsumsq_exact = [self._xsumsq_exact[row] for row in rows]
+
+        return bank
+
+    ###########################################################################
+    # end of class function __getitem__
+    ###########################################################################
+
+    # here is a function to make an ordinary histo out of one channel.
+
+    def hchannel(self, channel):
+
+        row = self._channel_index(channel)
+
+        h = self._template.hclone()
+        h.htitle = str(self.htitle) + ": " + self.channels[row]
+        h.hsetlabels(self.xlabel_hist, self.ylabel_hist)
+
+        h.binpop[...] = self.binpop[row]
+        h.ntot = int(self.ntot[row])
+        h.ntot_including_overflows = int(self.ntot_including_overflows[row])
+        h._xsum_exact = self._xsum_exact[row]
+        h._xsumsq_exact = self._xsumsq_exact[row]
+
+        return h
+
+    ###########################################################################
+    # end of class function hchannel
+    ###########################################################################
+
+    # here is a function to make a new, empty bank with the same title,
+    # channels, binning and labels.
+
+    def hclone(self):
+
+        twin = histo_bank(self.htitle, self.channels, xedges = self.x_edges)
+        twin.hsetlabels(self.xlabel_hist, self.ylabel_hist)
+
+        return twin
+
+    ###########################################################################
+    # end of class function hclone
+    ###########################################################################
+
+    # here is a function to add another bank with the same channels and
+    # binning into this one.
+
+    def hmerge(self, other):
+
+        if self.channels != other.channels or not np.array_equal(self.x_edges, other.x_edges):
+            raise ValueError("cannot merge histogram banks with different channels or binning: '" \
+            + str(self.htitle) + "' and '" + str(other.htitle) + "'")
+
+        self.binpop += other.binpop
+        self.ntot += other.ntot
+        self.ntot_including_overflows += other.ntot_including_overflows
+
+        for which in range(len(self.channels)):
+            self._xsum_exact[which] = self._xsum_exact[which] + other._xsum_exact[which]
+            self._xsumsq_exact[which] = self._xsumsq_exact[which] + other._xsumsq_exact[which]
+
+        self._statistics = None
+
+        return self
+
+    ###########################################################################
+    # end of class function hmerge
+    ###########################################################################
+
+    # so bank1 += bank2 does a merge.
+
+    def __iadd__(self, other):
+        return self.hmerge(other)
+
+    # here is a function to set the axis labels for every channel.
+
+    def hsetlabels(self, xstring = "x axis label", ystring = ""):
+
+        self.xlabel_hist = xstring
+        self.ylabel_hist = ystring
+
+    ###########################################################################
+    # end of class function hsetlabels
+    ###########################################################################
+
+    # here is a function to draw every channel in its own pane of one
+    # window, columns panes across.
+
+    def hprint(self, columns = 3):
+
+        import matplotlib.pyplot as plt
+
+        columns = max(1, min(columns, len(self.channels)))
+        rows = (len(self.channels) + columns - 1) // columns
+
+        self.handle = plt.figure(self.htitle)
+
+        for row in range(len(self.channels)):
+            plt.subplot(rows, columns, row + 1)
+            self.hchannel(row).hdraw(rows, columns, row + 1, self.handle)
+
+    ###########################################################################
+    # end of class function hprint
+    ###########################################################################
@@ -0,0 +1,368 @@
+###################################################################
+
+# This file is instrumentation.py. It shows where the time goes in an
+# analysis run: parsing, binning, statistics, segment finding, flow rates,
+# plotting... It keeps a timer for each of these stages (how many calls,
+# how long they took, how many rows they got through) and a few counters
+# (entries filled into histograms, over/underflows, anything else you
+# count yourself).
+
+# It is off unless you turn it on. Turning it on swaps the functions listed
+# in _hooks (histo.hfill, flowmeterLoader.parse_lines, ...) for timed
+# copies; turning it off puts the originals back, so with it off nothing
+# in histo or the rest of the pipeline runs any extra code at all.
+
+# Stages can call one another (load_dps310e calls parse_lines), so each
+# stage's "self" time leaves out the time spent in the stages it called;
+# the self times add up to the time spent in instrumented code.
+
+# Only the calling process is watched: work done by worker processes (in
+# histo.hfill_parallel or plotReport.render_all) shows up as the time the
+# call spent waiting for them.
+
+# use this way:
+#   import instrumentation as ins
+#
+#   with ins.profiled() as report:
+#       run = fl.load_dps310e("Data/DPS310E_22_04_21_a.CSV")
+#       histo1.hfill_array(run["dp01"])
+#       with ins.stage("my fit"):
+#           do_the_fit(run)
+#
+# which prints a per-stage breakdown at the end (report holds the same
+# numbers). Or by hand:
+#   ins.enable()
+#   ...
+#   ins.count("bad lines", nbad)
+#   ins.print_report()
+#   ins.disable()
+
+import contextlib
+import functools
+import importlib
+import time
+
+# True while the timed copies are in place.
+enabled = False
+
+# stage name -> [calls, seconds, self seconds, rows]
+_timers = {}
+
+# counter name -> value
+_counters = {}
+
+# seconds spent in the stages called from each stage still running (the
+# innermost is last), so they can be taken off its self time.
+_children = []
+
+# when the current profile started, from time.perf_counter.
+_started = None
+
+# (module, class or None, function, stage, what counts as a row) for every
+# function that gets timed. Rows are:
+#   "histo"   values handed to a histogram (the change in
+#             ntot_including_overflows); also counts fills and overflows
+#   "result"  the length of what the function returns
+#   "values"  the length of its first argument (after self)
+#   "runs"    the total length of the runs in its first argument
+#   None      nothing
+_hooks = (
+    ("flowmeterLoader", None, "parse_lines", "parse", "result"),
+    ("flowmeterLoader", None, "load_dps310e", "read", "result"),
+    ("runCache", None, "cached_load", "cache", "result"),
+    ("histogramObject", "histo", "hfill", "binning", "histo"),
+    ("histogramObject", "histo", "hfill_array", "binning", "histo"),
+    ("histogramObject", "histo", "hfill_parallel", "binning", "histo"),
+    ("histogramObject", "histo_bank", "hfill_array", "binning", "histo"),
+    ("histogramObject", "histo", "hmerge", "binning", None),
+    ("histogramObject", "histo", "hstatistics", "statistics", None),
+    ("histogramObject", "histo", "hintegrate", "statistics", None),
+    ("histogramObject", "histo_bank", "hstatistics", "statistics", None),
+    ("histogramObject", "histo", "hrandom", "sampling", "result"),
+    ("histogramObject", "histo", "hprint", "plotting", None),
+    ("histogramObject", "histo", "hrefresh", "plotting", None),
+    ("histogramObject", "histo_bank", "hprint", "plotting", None),
+    ("runningStats", None, "tracked_baseline", "statistics", "result"),
+    ("flowSegments", None, "find_segments", "segments", "values"),
+    ("venturiFlow", None, "summarize_runs", "flow", "runs"),
+    ("venturiFlow", None, "volumetric_flow", "flow", "values"),
+    ("calibrationFit", None, "fit_curves", "fit", "values"),
+    ("calibrationFit", "calibration_curve", "flow", "flow", "values"),
+    ("flowUncertainty", None, "segment_intervals", "uncertainty", "result"),
+    ("flowUncertainty", None, "breath_intervals", "uncertainty", "result"),
+    ("plotReport", None, "render_all", "plotting", "values"),
+)
+
+# the original functions, while the timed copies are in place:
+# (owner, name, original)
+_originals = []
+
+###########################################################################
+
+# here is a function to turn the instrumentation on: every function in
+# _hooks is replaced by a timed copy. Counts carry on from where they were;
+# call reset to start again from zero.
+
+def enable():
+
+    global enabled, _started
+
+    if enabled:
+        return
+
+    if _started is None:
+        _started = time.perf_counter()
+
+    for module_name, class_name, function_name, stage_name, rows in _hooks:
+
+        owner = importlib.import_module(module_name)
+        if class_name is not None:
+            owner = getattr(owner, class_name)
+
+        original = owner.__dict__[function_name] if class_name is not None \
+        else getattr(owner, function_name)
+
+        setattr(owner, function_name, _timed(original, stage_name, rows, \
+        1 if class_name is not None else 0))
+        _originals.append((owner, function_name, original))
+
+    enabled = True
+
+###########################################################################
+# end of function enable
+###########################################################################
+
+# here is a function to turn it off again, putting the original functions
+# back. The counts are kept until reset.
+
+def disable():
+
+    global enabled
+
+    while _originals:
+        owner, function_name, original = _originals.pop()
+        setattr(owner, function_name, original)
+
+    enabled = False
+
+###########################################################################
+# end of function disable
+###########################################################################
+
+# here is a function to throw away all the timers and counters.
+
+def reset():
+
+    global _started
+
+    _timers.clear()
+    _counters.clear()
+    _started = time.perf_counter()
+
+###########################################################################
+# end of function reset
+###########################################################################
+
+# here is a function to add to a counter of your own (bad lines skipped,
+# files read, ...). It does nothing while the instrumentation is off.
+
+def count(name, n = 1):
+
+    if enabled:
+        _counters[name] = _counters.get(name, 0) + n
+
+###########################################################################
+# end of function count
+###########################################################################
+
+# here is a context manager to time a stage of your own code, e.g.
+#   with ins.stage("fit", rows = len(x)):
+#       coefficients = np.polyfit(x, y, 3)
+# It does nothing while the instrumentation is off.
+
+@contextlib.contextmanager
+def stage(name, rows = 0):
+
+    if not enabled:
+        yield
+        return
+
+    _enter()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _leave(name, time.perf_counter() - start, rows)
+
+###########################################################################
+# end of function stage
+###########################################################################
+
+# here is the context manager to profile a block of code: it turns the
+# instrumentation on (from zero), and at the end turns it back off and
+# prints the breakdown (unless print_now is False). The dictionary it
+# hands back is filled in with the same numbers as report() gives.
+
+@contextlib.contextmanager
+def profiled(print_now = True):
+
+    was_enabled = enabled
+
+    reset()
+    enable()
+
+    results = {}
+
+    try:
+        yield results
+    finally:
+        if not was_enabled:
+            disable()
+        results.update(report())
+        if print_now:
+            print_report(results)
+
+###########################################################################
+# end of function profiled
+###########################################################################
+
+# here is a function to collect the numbers so far: the wall time since
+# reset, and for each stage its calls, seconds, self seconds, rows and
+# rows per second, plus the counters.
+
+def report():
+
+    wall = time.perf_counter() - _started if _started is not None else 0.
+
+    stages = {}
+    for name, (calls, seconds, self_seconds, rows) in _timers.items():
+        stages[name] = {"calls": calls, "seconds": seconds, \
+        "self_seconds": self_seconds, "rows": rows, \
+        "rows_per_second": rows / seconds if seconds > 0. else 0.}
+
+    return {"wall_seconds": wall, "stages": stages, "counters": dict(_counters)}
+
+###########################################################################
+# end of function report
+###########################################################################
+
+# here is a function to print the breakdown, stages with the most self
+# time first, with the share of the wall time each one took.
+
+def print_report(results = None):
+
+    if results is None:
+        results = report()
+
+    wall = results["wall_seconds"]
+    stages = results["stages"]
+
+    print("%-12s %8s %10s %10s %7s %12s %12s" % ("stage", "calls", "seconds", \
+    "self (s)", "% wall", "rows", "rows/s"))
+
+    accounted = 0.
+
+    for name in sorted(stages, key = lambda name: -stages[name]["self_seconds"]):
+        row = stages[name]
+        accounted = accounted + row["self_seconds"]
+        print("%-12s %8d %10.4f %10.4f %7.1f %12d %12.4g" % (name, row["calls"], \
+        row["seconds"], row["self_seconds"], \
+        100. * row["self_seconds"] / wall if wall > 0. else 0., \
+        row["rows"], row["rows_per_second"]))
+
+    print("%-12s %8s %10s %10.4f %7.1f" % ("other", "", "", wall - accounted, \
+    100. * (wall - accounted) / wall if wall > 0. else 0.))
+    print("%-12s %8s %10.4f" % ("wall", "", wall))
+
+    for name in sorted(results["counters"]):
+        print("%-20s %d" % (name, results["counters"][name]))
+
+###########################################################################
+# end of function print_report
+###########################################################################
+
+# here is a function to make the timed copy of a function.
+
+def _timed(function, stage_name, rows, first = 0):
+
+    @functools.wraps(function)
+    def timed(*args, **kwargs):
+
+        if rows == "histo":
+            h = args[0]
+            entries = _total(h.ntot)
+            values = _total(h.ntot_including_overflows)
+
+        _enter()
+        start = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            _leave(stage_name, seconds, 0)
+
+        if rows == "histo":
+            filled = _total(h.ntot) - entries
+            handed_in = _total(h.ntot_including_overflows) - values
+            _counters["fills"] = _counters.get("fills", 0) + filled
+            _counters["overflows"] = _counters.get("overflows", 0) + handed_in - filled
+            _timers[stage_name][3] += handed_in
+        elif rows == "result":
+            _timers[stage_name][3] += _length(result)
+        elif rows == "values" and len(args) > first:
+            _timers[stage_name][3] += _length(args[first])
+        elif rows == "runs" and args:
+            _timers[stage_name][3] += sum(_length(run) for run in args[0])
+
+        return result
+
+    return timed
+
+###########################################################################
+# end of function _timed
+###########################################################################
+
+# here are functions to keep the self times straight: _enter when a stage
+# starts, and _leave when it is done, with how long it took.
+
+def _enter():
+
+    _children.append(0.)
+
+def _leave(name, seconds, rows):
+
+    children = _children.pop()
+
+    if _children:
+        _children[-1] += seconds
+
+    timer = _timers.get(name)
+    if timer is None:
+        timer = _timers[name] = [0, 0., 0., 0]
+
+    timer[0] += 1
+    timer[1] += seconds
+    timer[2] += seconds - children
+    timer[3] += rows
+
+###########################################################################
+# end of functions _enter and _leave
+###########################################################################
+
+# here are functions to count things that might be numbers or arrays
+# (histo_bank keeps one count per channel), or might have no length.
+
+def _total(value):
+
+    return int(value.sum()) if hasattr(value, "sum") else int(value)
+
+def _length(value):
+
+    try:
+        return len(value)
+    except TypeError:
+        return 1
+
+###########################################################################
+# end of functions _total and _length
+###########################################################################
@@ -0,0 +1,543 @@
+###################################################################
+
+# This file is liveIngest.py. It reads flowmeter lines as they arrive, from
+# the base station's serial port (LoRa_test_basestation_RX), straight from
+# the DAQ board's USB serial (LoRa_lcd_DAQ), from a TCP socket, or from a
+# file played back as if it were live, and keeps the most recent ones in a
+# fixed-size ring buffer along with a rolling flow rate.
+
+# Lines are the same DPS310E (or short tube) lines the loggers write to the
+# SD card, so they are parsed with flowmeterLoader.parse_lines; anything
+# else on the port (the base station's "RSSI" chatter and so on) is skipped.
+
+# The ring buffers are stored twice over, end to end, so the newest n rows
+# are always one contiguous slice: latest() hands back a numpy view, not a
+# copy. A view is only good until the next lines arrive and write over it,
+# so copy it if it has to be kept.
+
+# use this way, from the command line:
+#   python liveIngest.py /dev/ttyUSB0 --baud 115200
+#   python liveIngest.py "Data/DPS310E_22_04_21_a.CSV" --speed 1
+#   python liveIngest.py localhost:5000
+#
+# or from python:
+#   import asyncio
+#   import liveIngest as li
+#
+#   monitor = li.flow_monitor(capacity = 4096)
+#
+#   async def show():
+#       while True:
+#           await monitor.wait_for_update()
+#           print(monitor.latest_flow(1)["flow"])
+#
+#   async def main():
+#       asyncio.ensure_future(show())
+#       await monitor.run(li.serial_lines("/dev/ttyUSB0", 115200))
+#
+#   asyncio.run(main())
+
+import argparse
+import asyncio
+import itertools
+import os
+import time
+
+import numpy as np
+
+import breathSegments as br
+import flowmeterLoader as fl
+import runningStats as rs
+import venturiFlow as vf
+
+try:
+    import termios
+except ImportError:
+    termios = None
+
+# one row per sample of the rolling flow estimate. latency_ms is the time
+# from the line arriving to its flow estimate being ready.
+flow_dtype = np.dtype([
+    ("millis", np.int64),
+    ("dp", np.float64),          # Pa, baseline corrected
+    ("flow", np.float64),        # L/s, from the rolling mean of dp
+    ("latency_ms", np.float64),
+])
+
+# how many samples the firmware averages at startup to get its offsets
+number_to_average = 10
+
+###########################################################################
+
+# here is a fixed-size ring buffer of structured rows. The newest "capacity"
+# rows are kept; older ones are written over.
+
+class ring_buffer:
+
+    __slots__ = ("capacity", "data", "head", "count", "total")
+
+    def __init__(self, capacity, dtype = fl.dps310e_dtype):
+
+        if capacity < 1:
+            raise ValueError("ring buffer capacity has to be at least 1")
+
+        self.capacity = int(capacity)
+
+        # two copies: slot k lives at k and at k + capacity.
+        self.data = np.zeros(2 * self.capacity, dtype = dtype)
+
+        # where the next row goes, how many rows are in the buffer, and how
+        # many have ever been appended.
+        self.head = 0
+        self.count = 0
+        self.total = 0
+
+    def __len__(self):
+        return self.count
+
+    ###########################################################################
+
+    # here is a function to add rows to the buffer.
+
+    def append(self, rows):
+
+        rows = np.asarray(rows, dtype = self.data.dtype)
+        n = rows.size
+
+        self.total = self.total + n
+
+        # only the last "capacity" of them can survive anyway.
+        if n > self.capacity:
+            rows = rows[n - self.capacity:]
+            self.head = (self.head + n - self.capacity) % self.capacity
+            n = self.capacity
+
+        first = min(n, self.capacity - self.head)
+        rest = n - first
+
+        self.data[self.head:self.head + first] = rows[:first]
+        self.data[self.head + self.capacity:self.head + self.capacity + first] = rows[:first]
+
+        if rest > 0:
+            self.data[:rest] = rows[first:]
+            self.data[self.capacity:self.capacity + rest] = rows[first:]
+
+        self.head = (self.head + n) % self.capacity
+        self.count = min(self.count + n, self.capacity)
+
+    ###########################################################################
+    # end of function append
+    ###########################################################################
+
+    # here is a function to get the newest n rows (all of them if n is
+    # None), oldest first, as a view into the buffer.
+
+    def latest(self, n = None):
+
+        if n is None or n > self.count:
+            n = self.count
+
+        end = self.head + self.capacity
+
+        return self.data[end - n:end]
+
+    ###########################################################################
+    # end of function latest
+    ###########################################################################
+
+###########################################################################
+# end of class ring_buffer
+###########################################################################
+
+# here is the class that does the work: it takes batches of lines, keeps
+# the samples in one ring buffer and the flow estimates in another, and
+# lets anybody waiting know there is something new.
+#   capacity     number of samples to keep
+#   smoothing    number of samples in the rolling mean of dp behind each
+#                flow estimate
+#   high, low    channels for the pressure drop when a line doesn't come
+#                with the firmware's corrected P0 - P1 (the short tube
+#                format).
+# Either way the pressure drop is corrected by a runningStats
+# baseline_tracker: it starts from the average of the first
+# number_to_average samples, the same way the firmware does, and then keeps
+# following the baseline whenever the pump is off (the firmware's own
+# correction is only worked out once, so on long sessions its dp drifts).
+# The flow estimates are also split into breaths as they come in (a
+# breathSegments breath_detector, with breath_threshold in L/s); the last
+# breath_capacity breaths are kept in a third ring buffer.
+
+class flow_monitor:
+
+    def __init__(self, capacity = 4096, smoothing = 5, high = "p0", low = "p1", \
+    rho = vf.RHO_AIR, a1 = vf.A1, a2 = vf.A2, breath_threshold = 0.05, \
+    breath_capacity = 256):
+
+        self.samples = ring_buffer(capacity)
+        self.flows = ring_buffer(capacity, flow_dtype)
+        self.breaths = ring_buffer(breath_capacity, br.breath_dtype)
+        self.breath_detector = br.breath_detector(breath_threshold)
+
+        self.smoothing = max(1, int(smoothing))
+        self.high = high
+        self.low = low
+        self.rho = rho
+        self.a1 = a1
+        self.a2 = a2
+
+        self.baseline = rs.baseline_tracker(startup = number_to_average)
+
+        self.lines_seen = 0
+        self.latency_max_ms = 0.
+        self.latency_sum_ms = 0.
+
+        self._update = None
+
+    ###########################################################################
+
+    # here is a function to take a batch of lines that arrived at
+    # received_at (a time.perf_counter() time) and update everything. It
+    # hands back the new flow rows.
+
+    def feed_lines(self, lines, received_at = None):
+
+        if received_at is None:
+            received_at = time.perf_counter()
+
+        self.lines_seen = self.lines_seen + len(lines)
+
+        rows = fl.parse_lines(lines)
+
+        if rows.size == 0:
+            return np.zeros(0, dtype = flow_dtype)
+
+        dp = self._differential(rows)
+
+        # rolling mean over the last "smoothing" samples, carrying on from
+        # the ones already in the buffer.
+        history = self.flows.latest(self.smoothing - 1)["dp"]
+        window = np.concatenate((history, dp))
+        running = np.concatenate(([0.], np.cumsum(window)))
+        right = np.arange(history.size + 1, window.size + 1)
+        left = np.maximum(right - self.smoothing, 0)
+        smoothed = (running[right] - running[left]) / (right - left)
+
+        new = np.zeros(rows.size, dtype = flow_dtype)
+        new["millis"] = rows["millis"]
+        new["dp"] = dp
+        new["flow"] = vf.volumetric_flow(smoothed, self.rho, self.a1, self.a2)
+
+        latency_ms = 1000. * (time.perf_counter() - received_at)
+        new["latency_ms"] = latency_ms
+
+        self.samples.append(rows)
+        self.flows.append(new)
+
+        ended = self.breath_detector.update_array(new["millis"], new["flow"])
+        if ended.size > 0:
+            self.breaths.append(ended)
+
+        self.latency_max_ms = max(self.latency_max_ms, latency_ms)
+        self.latency_sum_ms = self.latency_sum_ms + latency_ms * rows.size
+
+        if self._update is not None:
+            self._update.set()
+            self._update = None
+
+        return new
+
+    ###########################################################################
+    # end of function feed_lines
+    ###########################################################################
+
+    # here is a function to work out the corrected pressure drop, in Pa, for
+    # newly parsed rows. The no-flow periods are picked out from the high
+    # channel against the atmosphere.
+
+    def _differential(self, rows):
+
+        dp = np.array(rows["dp01"], dtype = float)
+        missing = ~np.isfinite(dp)
+
+        if missing.any():
+            dp[missing] = vf.corrected_differential(rows[self.high][missing], \
+            rows[self.low][missing])
+
+        signal = vf.corrected_differential(rows[self.high], \
+        rows[fl.ambient_channel(rows)])
+
+        return dp - self.baseline.update_array(signal, dp)
+
+    ###########################################################################
+    # end of function _differential
+    ###########################################################################
+
+    # here are functions to look at the newest n samples, flow estimates and
+    # finished breaths.
+    # These are views into the ring buffers (no copying), good until the
+    # next batch of lines arrives.
+
+    def latest(self, n = None):
+        return self.samples.latest(n)
+
+    def latest_flow(self, n = None):
+        return self.flows.latest(n)
+
+    def latest_breaths(self, n = None):
+        return self.breaths.latest(n)
+
+    ###########################################################################
+
+    # here is a function for consumers to wait on: it returns once the next
+    # batch of lines has been dealt with.
+
+    async def wait_for_update(self):
+
+        if self._update is None:
+            self._update = asyncio.Event()
+
+        await self._update.wait()
+
+    ###########################################################################
+    # end of function wait_for_update
+    ###########################################################################
+
+    # here is a function to work out the mean packet-to-estimate latency, in
+    # ms.
+
+    def latency_mean_ms(self):
+
+        if self.flows.total == 0:
+            return 0.
+
+        return self.latency_sum_ms / self.flows.total
+
+    ###########################################################################
+    # end of function latency_mean_ms
+    ###########################################################################
+
+    # here is the function to keep reading batches of lines from a source
+    # (one of the *_lines functions below) until it runs dry.
+
+    async def run(self, source):
+
+        async for lines, received_at in source:
+            self.feed_lines(lines, received_at)
+
+    ###########################################################################
+    # end of function run
+    ###########################################################################
+
+###########################################################################
+# end of class flow_monitor
+###########################################################################
+
+# here is a function to read lines from an asyncio StreamReader, handing
+# each one over with the time it arrived.
+
+async def stream_lines(reader):
+
+    while True:
+
+        line = await reader.readline()
+
+        if not line:
+            return
+
+        yield [line.decode("ascii", "replace")], time.perf_counter()
+
+###########################################################################
+# end of function stream_lines
+###########################################################################
+
+# here is a function to read lines from a serial port (the base station or
+# the DAQ board plugged into USB), a pseudo-terminal or a named pipe. If it
+# is a terminal, it is set to the baud rate and to hand over bytes as they
+# arrive (raw mode).
+
+async def serial_lines(device, baud = 115200):
+
+    fd = os.open(device, os.O_RDONLY | os.O_NONBLOCK | os.O_NOCTTY)
+
+    if termios is not None and os.isatty(fd):
+        _configure_port(fd, baud)
+
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    transport, protocol = await loop.connect_read_pipe( \
+    lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(fd, "rb", 0))
+
+    try:
+        async for batch in stream_lines(reader):
+            yield batch
+    finally:
+        transport.close()
+
+###########################################################################
+# end of function serial_lines
+###########################################################################
+
+# here is a function to set a serial port to a baud rate, 8 data bits, no
+# parity, and raw input.
+
+def _configure_port(fd, baud):
+
+    speed = getattr(termios, "B%d" % baud, None)
+    if speed is None:
+        raise ValueError("baud rate %d isn't one the terminal driver knows" % baud)
+
+    iflag, oflag, cflag, lflag, ispeed, ospeed, cc = termios.tcgetattr(fd)
+
+    iflag &= ~(termios.IGNBRK | termios.BRKINT | termios.PARMRK | termios.ISTRIP | \
+    termios.INLCR | termios.IGNCR | termios.ICRNL | termios.IXON)
+    lflag &= ~(termios.ECHO | termios.ECHONL | termios.ICANON | termios.ISIG | \
+    termios.IEXTEN)
+    cflag &= ~(termios.CSIZE | termios.PARENB)
+    cflag |= termios.CS8 | termios.CREAD | termios.CLOCAL
+
+    cc[termios.VMIN] = 1
+    cc[termios.VTIME] = 0
+
+    termios.tcsetattr(fd, termios.TCSANOW, \
+    [iflag, oflag, cflag, lflag, speed, speed, cc])
+
+###########################################################################
+# end of function _configure_port
+###########################################################################
+
+# here is a function to read lines from a TCP socket (a serial-to-network
+# bridge, or another computer forwarding the base station).
+
+async def tcp_lines(host, port):
+
+    reader, writer = await asyncio.open_connection(host, port)
+
+    try:
+        async for batch in stream_lines(reader):
+            yield batch
+    finally:
+        writer.close()
+
+###########################################################################
+# end of function tcp_lines
+###########################################################################
+
+# here is a function to play back a data file as if it were arriving live,
+# for testing. The lines come one at a time, spaced by their millis values
+# divided by speed; speed = None sends them as fast as possible (in batches
+# of max_batch).
+
+async def replay_lines(filename, speed = 1., max_batch = 256):
+
+    with open(filename, "r", errors = "replace") as f:
+
+        if speed is None:
+            while True:
+                batch = list(itertools.islice(f, max_batch))
+                if not batch:
+                    return
+                yield batch, time.perf_counter()
+                await asyncio.sleep(0)
+
+        start_clock = None
+        start_millis = None
+
+        for line in f:
+
+            try:
+                millis = int(line.split(",", 1)[0])
+            except ValueError:
+                millis = None
+
+            if millis is not None:
+                if start_clock is None:
+                    start_clock = time.perf_counter()
+                    start_millis = millis
+                wait = start_clock + (millis - start_millis) / (1000. * speed) - \
+                time.perf_counter()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+
+            yield [line], time.perf_counter()
+
+###########################################################################
+# end of function replay_lines
+###########################################################################
+
+# here is a function to pick a source from a name: host:port, a device (or
+# pipe), or a regular file to play back.
+
+def open_source(name, baud = 115200, speed = 1.):
+
+    if os.path.isfile(name):
+        return replay_lines(name, speed)
+
+    if not os.path.exists(name) and ":" in name:
+        host, port = name.rsplit(":", 1)
+        return tcp_lines(host, int(port))
+
+    return serial_lines(name, baud)
+
+###########################################################################
+# end of function open_source
+###########################################################################
+
+# here is a function to print the flow rate every time new lines arrive,
+# for running this file from the command line.
+
+async def _print_flows(monitor, every):
+
+    last_print = 0.
+
+    while True:
+
+        await monitor.wait_for_update()
+
+        now = time.perf_counter()
+        if now - last_print < every:
+            continue
+        last_print = now
+
+        newest = monitor.latest_flow(1)[0]
+        print("%10d ms  dp %8.2f Pa  Q %8.4f L/s  latency %.2f ms (max %.2f)" % \
+        (newest["millis"], newest["dp"], newest["flow"], newest["latency_ms"], \
+        monitor.latency_max_ms))
+
+###########################################################################
+# end of function _print_flows
+###########################################################################
+
+async def _main(arguments):
+
+    monitor = flow_monitor(arguments.capacity, arguments.smoothing)
+    speed = None if arguments.speed <= 0 else arguments.speed
+
+    printer = asyncio.ensure_future(_print_flows(monitor, arguments.every))
+
+    try:
+        await monitor.run(open_source(arguments.source, arguments.baud, speed))
+    finally:
+        printer.cancel()
+
+    print("%d lines, %d samples, %d breaths, latency mean %.3f ms, max %.3f ms" % \
+    (monitor.lines_seen, monitor.flows.total, monitor.breaths.total, \
+    monitor.latency_mean_ms(), monitor.latency_max_ms))
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = \
+    "read flowmeter lines as they arrive and print the flow rate")
+    parser.add_argument("source", help = \
+    "serial device or pipe, host:port, or a data file to play back")
+    parser.add_argument("--baud", type = int, default = 115200)
+    parser.add_argument("--speed", type = float, default = 1., help = \
+    "playback speed for data files (0 for as fast as possible)")
+    parser.add_argument("--capacity", type = int, default = 4096)
+    parser.add_argument("--smoothing", type = int, default = 5)
+    parser.add_argument("--every", type = float, default = 0.5, help = \
+    "seconds between printed lines")
+
+    try:
+        asyncio.run(_main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
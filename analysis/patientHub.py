@@ -0,0 +1,702 @@
+###################################################################
+
+# This file is patientHub.py. It is liveIngest for a whole ward: it reads
+# from many devices at once (base stations, DAQ boards, TCP bridges, or
+# data files played back as stand-ins), and keeps the flow of every patient
+# on every device apart.
+
+# A patient is a (device, patient ID) pair: one base station can hear
+# several LoRa nodes, told apart by the "patient ID" on their lines, and
+# the same ID on two devices is two patients. Lines without a patient ID
+# (the short tube format) count as patient -1 of their device.
+
+# Each patient gets a slot: a row in a structured array (slot_dtype) of
+# everything kept about them (the baseline, the smoothing, the rolling
+# flow mean and spread, their calibration) and a row in a 2-d ring buffer
+# of their recent flows. Nothing is kept per patient as a python object.
+
+# The devices only queue up the lines they get. Every tick (or when
+# process is called) all the lines that came in from every device are
+# parsed together, sorted into slots, and pushed through the baseline,
+# smoothing and Bernoulli arithmetic as arrays. The only python loop is
+# over the samples each patient got in the tick (a handful), with every
+# patient done at once at each step, so the work per tick goes with the
+# number of lines, not the number of devices.
+
+# The baseline follows liveIngest: the first "startup" samples of a
+# patient give the pump-off offset of dp and the no-flow level of the high
+# channel against the atmosphere; after that every sample within tolerance
+# (Pa) of the no-flow level pulls both towards it with an exponential
+# average of the given halflife. (runningStats.baseline_tracker also asks
+# for the last "window" samples to be steady, which is left out here.)
+
+# use this way, from the command line:
+#   python patientHub.py /dev/ttyUSB0 /dev/ttyUSB1 localhost:5000
+#   python patientHub.py "Data/DPS310E_22_04_21_a.CSV" --copies 200
+#
+# or from python:
+#   import asyncio
+#   import liveIngest as li
+#   import patientHub as ph
+#
+#   hub = ph.patient_hub(tick = 0.05)
+#   hub.set_calibration("/dev/ttyUSB0", 3, a2 = 0.02 * 0.004)
+#
+#   async def main():
+#       await hub.run({"/dev/ttyUSB0": li.serial_lines("/dev/ttyUSB0"), \
+#       "bridge": li.tcp_lines("localhost", 5000)})
+#
+#   asyncio.run(main())
+#   ph.print_patients(hub.snapshot())
+
+import argparse
+import asyncio
+import time
+
+import numpy as np
+
+import flowmeterLoader as fl
+import liveIngest as li
+import venturiFlow as vf
+
+# one row per patient. samples counts every sample since the patient first
+# turned up; startup_dp and startup_level add up the first "startup" of
+# them. baseline is in Pa, level (the no-flow level of the high channel
+# against the atmosphere) too. smooth_sum is the sum of the dp values in
+# the smoothing ring. flow_mean and flow_variance are exponential averages
+# of the flow; flow and millis are the newest sample's. kept counts the
+# flows written to the history ring (bad samples too, as NaN).
+slot_dtype = np.dtype([
+    ("device", np.int32),
+    ("patient_id", np.int32),
+    ("samples", np.int64),
+    ("kept", np.int64),
+    ("startup_dp", np.float64),
+    ("startup_level", np.float64),
+    ("baseline", np.float64),
+    ("level", np.float64),
+    ("smooth_sum", np.float64),
+    ("smooth_count", np.int32),
+    ("flow", np.float64),
+    ("flow_mean", np.float64),
+    ("flow_variance", np.float64),
+    ("millis", np.int64),
+    ("rho", np.float64),
+    ("a1", np.float64),
+    ("a2", np.float64),
+])
+
+# one row per patient for looking at: snapshot() hands these back.
+patient_dtype = np.dtype([
+    ("device", "U40"),
+    ("patient_id", np.int32),
+    ("samples", np.int64),
+    ("millis", np.int64),
+    ("baseline", np.float64),      # Pa
+    ("flow", np.float64),          # L/s, newest
+    ("flow_mean", np.float64),
+    ("flow_std", np.float64),
+])
+
+###########################################################################
+
+# here is the class that does the work.
+#   history     number of flows kept for each patient
+#   smoothing   number of samples in the rolling mean of dp behind each flow
+#   startup, halflife, tolerance   the baseline (see above)
+#   stats_halflife   samples over which a sample's weight in flow_mean and
+#               flow_variance halves
+#   tick        seconds between goes at the queued lines, in run()
+
+class patient_hub:
+
+    def __init__(self, history = 1024, smoothing = 5, startup = li.number_to_average, \
+    halflife = 500, tolerance = 5., stats_halflife = 128, tick = 0.05):
+
+        self.history = int(history)
+        self.smoothing = max(1, int(smoothing))
+        self.startup = max(1, int(startup))
+        self.alpha = 1. - 0.5 ** (1. / halflife)
+        self.tolerance = tolerance
+        self.stats_alpha = 1. - 0.5 ** (1. / stats_halflife)
+        self.tick = tick
+
+        # device names, and their numbers.
+        self.devices = []
+        self._device_numbers = {}
+
+        # (device number, patient ID) -> slot, and the same as two arrays
+        # for looking up a batch at a time: the keys (device number << 32 |
+        # patient ID), sorted, and their slots.
+        self._slots = {}
+        self._keys = np.zeros(0, dtype = np.int64)
+        self._key_slots = np.zeros(0, dtype = np.intp)
+        self.nslots = 0
+        self.slots = np.zeros(0, dtype = slot_dtype)
+        self._ring = np.zeros((0, self.smoothing))
+        self.flows = np.zeros((0, self.history))
+        self.flow_millis = np.zeros((0, self.history), dtype = np.int64)
+
+        # lines waiting for the next tick: (device number, lines, time)
+        self._pending = []
+
+        self.lines_seen = 0
+        self.samples_seen = 0
+        self.ticks = 0
+        self.tick_seconds = 0.
+        self.latency_max_ms = 0.
+        self.latency_sum_ms = 0.
+
+    ###########################################################################
+
+    # here is a function to get a device's number, adding it if it's new.
+
+    def device_number(self, name):
+
+        number = self._device_numbers.get(name)
+
+        if number is None:
+            number = self._device_numbers[name] = len(self.devices)
+            self.devices.append(name)
+
+        return number
+
+    ###########################################################################
+    # end of class function device_number
+    ###########################################################################
+
+    # here is a function to get the slot of a patient, making one if they
+    # are new.
+
+    def slot(self, device, patient_id):
+
+        key = (self.device_number(device) if isinstance(device, str) else int(device), \
+        int(patient_id))
+
+        slot = self._slots.get(key)
+
+        if slot is None:
+            slot = self._new_slots([key])[0]
+
+        return slot
+
+    ###########################################################################
+    # end of class function slot
+    ###########################################################################
+
+    # here is a function to set the geometry and air density a patient's
+    # flow is worked out with (venturiFlow.volumetric_flow). Anything left
+    # as None stays as it is.
+
+    def set_calibration(self, device, patient_id, rho = None, a1 = None, a2 = None):
+
+        slot = self.slot(device, patient_id)
+
+        for name, value in (("rho", rho), ("a1", a1), ("a2", a2)):
+            if value is not None:
+                self.slots[name][slot] = value
+
+    ###########################################################################
+    # end of class function set_calibration
+    ###########################################################################
+
+    # here is a function to queue a batch of lines from a device, to be
+    # dealt with at the next tick. It costs next to nothing.
+
+    def feed_lines(self, device, lines, received_at = None):
+
+        if received_at is None:
+            received_at = time.perf_counter()
+
+        if isinstance(device, str):
+            device = self.device_number(device)
+
+        self._pending.append((device, lines, received_at))
+
+    ###########################################################################
+    # end of class function feed_lines
+    ###########################################################################
+
+    # here is the function to deal with every line queued since last time,
+    # from all the devices at once. It hands back the number of samples.
+
+    def process(self):
+
+        if not self._pending:
+            return 0
+
+        started = time.perf_counter()
+
+        pending = self._pending
+        self._pending = []
+
+        rows, device, received_at = self._parse(pending)
+
+        if rows.size > 0:
+            self._update(rows, device, received_at)
+
+        self.ticks = self.ticks + 1
+        self.tick_seconds = self.tick_seconds + time.perf_counter() - started
+
+        return rows.size
+
+    ###########################################################################
+    # end of class function process
+    ###########################################################################
+
+    # here is a function to parse the queued lines in one go (one call to
+    # flowmeterLoader.parse_lines for each line format), keeping track of
+    # which device and arrival time each row goes with.
+
+    def _parse(self, pending):
+
+        lines = []
+        for number, batch, at in pending:
+            lines.extend(batch)
+
+        self.lines_seen = self.lines_seen + len(lines)
+
+        numbers, batches, times = zip(*pending)
+        sizes = [len(batch) for batch in batches]
+        device = np.repeat(np.array(numbers, dtype = np.int32), sizes)
+        received_at = np.repeat(np.array(times), sizes)
+        fields = np.array([line.count(",") + 1 for line in lines])
+
+        pieces = []
+
+        for nfields in np.unique(fields):
+
+            if int(nfields) not in fl._layouts:
+                continue
+
+            which = np.flatnonzero(fields == nfields)
+            good = [lines[i] for i in which]
+            rows = fl.parse_lines(good, int(nfields))
+
+            if rows.size != which.size:
+                # a line with garbage in it got dropped, so the rows don't
+                # line up with the lines any more; parse device by device.
+                rows, which = self._parse_each(good, which, device, int(nfields))
+
+            pieces.append((rows, device[which], received_at[which]))
+
+        if not pieces:
+            return np.zeros(0, dtype = fl.dps310e_dtype), device[:0], received_at[:0]
+
+        return tuple(np.concatenate(column) for column in zip(*pieces))
+
+    ###########################################################################
+    # end of class function _parse
+    ###########################################################################
+
+    # here is a function to parse lines a line at a time, for the (rare)
+    # batches with a bad line in them.
+
+    def _parse_each(self, lines, which, device, nfields):
+
+        rows = []
+        kept = []
+
+        for line, i in zip(lines, which):
+            row = fl.parse_lines([line], nfields)
+            if row.size == 1:
+                rows.append(row)
+                kept.append(i)
+
+        if not rows:
+            return np.zeros(0, dtype = fl.dps310e_dtype), np.zeros(0, dtype = np.intp)
+
+        return np.concatenate(rows), np.array(kept, dtype = np.intp)
+
+    ###########################################################################
+    # end of class function _parse_each
+    ###########################################################################
+
+    # here is the function to push a batch of parsed rows (from any mix of
+    # patients) through the baseline, smoothing and flow arithmetic.
+
+    def _update(self, rows, device, received_at):
+
+        slot = self._slots_of(device, rows["patient_id"])
+
+        high = rows["p0"]
+        low = rows["p1"]
+        ambient = np.where(np.isfinite(rows["p4"]) & (rows["p4"] > 0), rows["p4"], rows["p3"])
+
+        # the firmware's corrected P0 - P1 where the line has it, worked out
+        # from the pressures where it doesn't.
+        dp = np.array(rows["dp01"], dtype = float)
+        missing = ~np.isfinite(dp)
+        if missing.any():
+            dp[missing] = vf.corrected_differential(high[missing], low[missing])
+
+        good = fl.good_samples(rows, ["p0", "p1"]) & np.isfinite(dp)
+        dp[~good] = np.nan
+        signal = vf.corrected_differential(high, ambient)
+
+        # put each patient's rows in the order they came, and number them
+        # within the patient: rank k is every patient's k-th row.
+        order = np.argsort(slot, kind = "stable")
+        sorted_slot = slot[order]
+        starts = np.flatnonzero(np.concatenate(([True], sorted_slot[1:] != sorted_slot[:-1])))
+        counts = np.diff(np.append(starts, sorted_slot.size))
+        rank = np.empty(slot.size, dtype = np.int64)
+        rank[order] = np.arange(slot.size) - np.repeat(starts, counts)
+
+        by_rank = np.argsort(rank, kind = "stable")
+        bounds = np.concatenate(([0], np.cumsum(np.bincount(rank))))
+
+        smoothed = np.full(slot.size, np.nan)
+
+        for k in range(bounds.size - 1):
+            mine = by_rank[bounds[k]:bounds[k + 1]]
+            smoothed[mine] = self._step(slot[mine], dp[mine], signal[mine])
+
+        states = self.slots[slot]
+        flow = vf.volumetric_flow(smoothed, states["rho"], states["a1"], states["a2"])
+
+        # the rolling flow statistics, and the history rings.
+        for k in range(bounds.size - 1):
+            mine = by_rank[bounds[k]:bounds[k + 1]]
+            self._count_flow(slot[mine], flow[mine], rows["millis"][mine])
+
+        position = (self.slots["kept"][slot] + rank) % self.history
+        self.flows[slot, position] = flow
+        self.flow_millis[slot, position] = rows["millis"]
+        self.slots["kept"][sorted_slot[starts]] += counts
+
+        self.samples_seen = self.samples_seen + slot.size
+
+        latency_ms = 1000. * (time.perf_counter() - received_at)
+        self.latency_max_ms = max(self.latency_max_ms, float(latency_ms.max()))
+        self.latency_sum_ms = self.latency_sum_ms + float(latency_ms.sum())
+
+    ###########################################################################
+    # end of class function _update
+    ###########################################################################
+
+    # here is the function to move one sample on for each of a set of
+    # (different) patients: the baseline, then the smoothing. It hands back
+    # the smoothed, corrected dp (NaN for bad samples).
+
+    def _step(self, slot, dp, signal):
+
+        states = self.slots
+        good = np.isfinite(dp)
+        slot = slot[good]
+        dp = dp[good]
+        signal = signal[good]
+
+        samples = states["samples"][slot]
+        starting = samples < self.startup
+
+        # the startup samples: the baseline is their mean so far.
+        first = slot[starting]
+        n = samples[starting] + 1.
+        states["startup_dp"][first] += dp[starting]
+        states["startup_level"][first] += signal[starting]
+        states["baseline"][first] = states["startup_dp"][first] / n
+        states["level"][first] = states["startup_level"][first] / n
+
+        # after that, the no-flow samples pull the baseline along.
+        later = slot[~starting]
+        level = states["level"][later]
+        off = np.abs(signal[~starting] - level) < self.tolerance
+        later = later[off]
+        states["baseline"][later] += self.alpha * (dp[~starting][off] - states["baseline"][later])
+        states["level"][later] += self.alpha * (signal[~starting][off] - states["level"][later])
+
+        states["samples"][slot] = samples + 1
+
+        corrected = dp - states["baseline"][slot]
+
+        # the rolling mean of the last "smoothing" corrected values.
+        position = samples % self.smoothing
+        states["smooth_sum"][slot] += corrected - self._ring[slot, position]
+        self._ring[slot, position] = corrected
+        count = np.minimum(states["smooth_count"][slot] + 1, self.smoothing)
+        states["smooth_count"][slot] = count
+
+        smoothed = np.full(good.size, np.nan)
+        smoothed[good] = states["smooth_sum"][slot] / count
+
+        return smoothed
+
+    ###########################################################################
+    # end of class function _step
+    ###########################################################################
+
+    # here is a function to add one flow for each of a set of (different)
+    # patients to their exponential mean and variance.
+
+    def _count_flow(self, slot, flow, millis):
+
+        states = self.slots
+        states["millis"][slot] = millis
+        states["flow"][slot] = flow
+
+        good = np.isfinite(flow)
+        slot = slot[good]
+        flow = flow[good]
+
+        # the first flow of a patient is where their mean starts.
+        new = np.isnan(states["flow_mean"][slot])
+        states["flow_mean"][slot[new]] = flow[new]
+
+        difference = flow - states["flow_mean"][slot]
+        states["flow_mean"][slot] += self.stats_alpha * difference
+        states["flow_variance"][slot] = (1. - self.stats_alpha) * \
+        (states["flow_variance"][slot] + self.stats_alpha * difference * difference)
+
+    ###########################################################################
+    # end of class function _count_flow
+    ###########################################################################
+
+    # here is a function to find the slots of a batch of rows, making slots
+    # for the patients that haven't been seen before. Only the new patients
+    # are gone through one by one.
+
+    def _slots_of(self, device, patient_id):
+
+        keys = _key(device, patient_id)
+
+        where = np.searchsorted(self._keys, keys)
+        known = where < self._keys.size
+        known[known] = self._keys[where[known]] == keys[known]
+
+        if not known.all():
+            new = np.unique(keys[~known])
+            self._new_slots([(int(key >> 32), int(np.int32(key & 0xffffffff))) \
+            for key in new])
+            where = np.searchsorted(self._keys, keys)
+
+        return self._key_slots[where]
+
+    ###########################################################################
+    # end of class function _slots_of
+    ###########################################################################
+
+    # here is a function to make slots for new patients, growing the arrays
+    # (to twice the size) when they are full.
+
+    def _new_slots(self, pairs):
+
+        needed = self.nslots + len(pairs)
+
+        if needed > self.slots.size:
+
+            size = max(needed, 2 * self.slots.size, 16)
+
+            slots = np.zeros(size, dtype = slot_dtype)
+            slots[:self.nslots] = self.slots[:self.nslots]
+            self.slots = slots
+
+            for name in ("_ring", "flows", "flow_millis"):
+                old = getattr(self, name)
+                grown = np.zeros((size,) + old.shape[1:], dtype = old.dtype)
+                grown[:self.nslots] = old[:self.nslots]
+                setattr(self, name, grown)
+
+        first = self.nslots
+        new = np.arange(first, needed)
+
+        fresh = self.slots[first:needed]
+        fresh[:] = 0
+        fresh["device"] = [device for device, patient_id in pairs]
+        fresh["patient_id"] = [patient_id for device, patient_id in pairs]
+        for name in ("baseline", "level", "flow", "flow_mean"):
+            fresh[name] = np.nan
+        fresh["millis"] = -1
+        fresh["rho"] = vf.RHO_AIR
+        fresh["a1"] = vf.A1
+        fresh["a2"] = vf.A2
+
+        self._ring[first:needed] = 0.
+        self.flows[first:needed] = np.nan
+        self.flow_millis[first:needed] = -1
+
+        for slot, pair in zip(new, pairs):
+            self._slots[pair] = int(slot)
+
+        keys = np.concatenate((self._keys, _key(fresh["device"], fresh["patient_id"])))
+        slots = np.concatenate((self._key_slots, new))
+        order = np.argsort(keys)
+        self._keys = keys[order]
+        self._key_slots = slots[order]
+
+        self.nslots = needed
+
+        return new
+
+    ###########################################################################
+    # end of class function _new_slots
+    ###########################################################################
+
+    # here is a function to get a patient's newest n flows (all that are
+    # kept if n is None), oldest first: a (millis, flow) pair of copies.
+
+    def latest_flow(self, device, patient_id, n = None):
+
+        slot = self.slot(device, patient_id)
+        end = int(self.slots["kept"][slot])
+        kept = min(end, self.history)
+
+        if n is None or n > kept:
+            n = kept
+
+        position = np.arange(end - n, end) % self.history
+
+        return self.flow_millis[slot, position], self.flows[slot, position]
+
+    ###########################################################################
+    # end of class function latest_flow
+    ###########################################################################
+
+    # here is a function to get a table of every patient (patient_dtype).
+
+    def snapshot(self):
+
+        states = self.slots[:self.nslots]
+
+        table = np.zeros(self.nslots, dtype = patient_dtype)
+        table["device"] = [self.devices[device] if device < len(self.devices) else "" \
+        for device in states["device"]]
+        for name in ("patient_id", "samples", "millis", "baseline", "flow", "flow_mean"):
+            table[name] = states[name]
+        table["flow_std"] = np.sqrt(states["flow_variance"])
+
+        return table
+
+    ###########################################################################
+    # end of class function snapshot
+    ###########################################################################
+
+    # here is a function to work out the mean line-to-flow latency, in ms.
+
+    def latency_mean_ms(self):
+
+        if self.samples_seen == 0:
+            return 0.
+
+        return self.latency_sum_ms / self.samples_seen
+
+    ###########################################################################
+    # end of class function latency_mean_ms
+    ###########################################################################
+
+    # here is the function to read from every device until they all run
+    # dry: sources maps device names to liveIngest line sources
+    # (li.serial_lines, li.tcp_lines, li.replay_lines ...). The queued lines
+    # are dealt with every tick seconds, and once more at the end.
+
+    async def run(self, sources):
+
+        readers = [asyncio.ensure_future(self._read(name, source)) \
+        for name, source in sources.items()]
+        ticker = asyncio.ensure_future(self._tick())
+
+        try:
+            await asyncio.gather(*readers)
+        finally:
+            ticker.cancel()
+            for reader in readers:
+                reader.cancel()
+
+        self.process()
+
+    async def _read(self, name, source):
+
+        device = self.device_number(name)
+
+        async for lines, received_at in source:
+            self._pending.append((device, lines, received_at))
+
+    async def _tick(self):
+
+        while True:
+            await asyncio.sleep(self.tick)
+            self.process()
+
+    ###########################################################################
+    # end of class functions run, _read and _tick
+    ###########################################################################
+
+###########################################################################
+# end of class patient_hub
+###########################################################################
+
+# here is a function to make the key a patient is looked up by: the device
+# number in the top 32 bits and the patient ID in the bottom 32.
+
+def _key(device, patient_id):
+
+    return (np.asarray(device).astype(np.int64) << 32) | \
+    (np.asarray(patient_id).astype(np.int64) & 0xffffffff)
+
+###########################################################################
+# end of function _key
+###########################################################################
+
+# here is a function to print the table of patients, one line each.
+
+def print_patients(table):
+
+    print("%-28s %8s %9s %12s %10s %9s %9s %8s" % ("device", "patient", "samples", \
+    "millis", "base (Pa)", "Q (L/s)", "mean", "+/-"))
+
+    for row in table:
+        print("%-28s %8d %9d %12d %10.3f %9.4f %9.4f %8.4f" % (row["device"][-28:], \
+        row["patient_id"], row["samples"], row["millis"], row["baseline"], \
+        row["flow"], row["flow_mean"], row["flow_std"]))
+
+###########################################################################
+# end of function print_patients
+###########################################################################
+
+async def _main(arguments):
+
+    hub = patient_hub(arguments.history, arguments.smoothing, tick = arguments.tick)
+    speed = None if arguments.speed <= 0 else arguments.speed
+
+    sources = {}
+    for name in arguments.sources:
+        for copy in range(arguments.copies):
+            label = name if arguments.copies == 1 else "%s #%d" % (name, copy)
+            sources[label] = li.open_source(name, arguments.baud, speed)
+
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+
+    await hub.run(sources)
+
+    wall = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+
+    print_patients(hub.snapshot()[:arguments.show])
+
+    print("%d devices, %d patients, %d lines, %d samples in %.2f s (cpu %.2f s, " \
+    "%.1f us a sample; ticks %.2f s)" % (len(hub.devices), hub.nslots, hub.lines_seen, \
+    hub.samples_seen, wall, cpu, 1e6 * cpu / max(hub.samples_seen, 1), hub.tick_seconds))
+    print("latency mean %.3f ms, max %.3f ms" % (hub.latency_mean_ms(), hub.latency_max_ms))
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = \
+    "read flowmeter lines from many devices at once and follow every patient's flow")
+    parser.add_argument("sources", nargs = "+", help = \
+    "serial devices or pipes, host:port, or data files to play back")
+    parser.add_argument("--baud", type = int, default = 115200)
+    parser.add_argument("--speed", type = float, default = 1., help = \
+    "playback speed for data files (0 for as fast as possible)")
+    parser.add_argument("--copies", type = int, default = 1, help = \
+    "read each source this many times over, as that many devices")
+    parser.add_argument("--history", type = int, default = 1024)
+    parser.add_argument("--smoothing", type = int, default = 5)
+    parser.add_argument("--tick", type = float, default = 0.05)
+    parser.add_argument("--show", type = int, default = 20, help = \
+    "number of patients to print at the end")
+
+    try:
+        asyncio.run(_main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,439 @@
+###################################################################
+
+# This file is plotReport.py. It draws lots of plots to PNG files at once,
+# without opening any windows: each plot is described by a small "spec"
+# (a dictionary holding the numbers to draw and the labels), and the specs
+# are handed out to a pool of worker processes that draw them with
+# matplotlib's Agg renderer.
+
+# Each worker keeps one figure per kind of plot and reuses it, only
+# swapping in the new data and labels, rather than building a new figure
+# (axes, ticks, fonts...) for every PNG.
+
+# Every spec gets a hash of its contents. The hashes of the PNGs already
+# drawn are kept in a ".plot_hashes.json" file in each output directory, so
+# plots whose data and labels haven't changed since the last time are
+# skipped.
+
+# use this way:
+#   import histogramObject as hb
+#   import plotReport as pr
+#
+#   specs = [pr.histogram_plot(histo1, "Plots/dp01.png"),
+#            pr.series_plot("Plots/p0.png", run["millis"], {"p0": run["p0"]},
+#                           title = "inlet pressure", xlabel = "ms",
+#                           ylabel = "hPa")]
+#   pr.render_all(specs)
+#
+# or, for every run taken on a day, from the command line:
+#   python plotReport.py Data/DPS310E_22_04_21_*.CSV --out Plots/22_04_21
+
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+# bump this when the way plots are drawn changes, so old PNGs get redrawn.
+_RENDER_VERSION = 2
+
+# name of the file holding the hashes of the plots in a directory
+_MANIFEST = ".plot_hashes.json"
+
+# figures each worker process has already built, by kind of plot.
+_templates = {}
+
+###########################################################################
+
+# here is a function to make the spec for a histogram (a histogramObject
+# histo, 1-D or 2-D). Its bins, labels and statistics are copied into the
+# spec, so the histogram can go on filling afterwards.
+
+def histogram_plot(h, filename, dpi = 300, log = False):
+
+    spec = {"filename": filename, "dpi": dpi, "title": str(h.htitle), \
+    "xlabel": str(h.xlabel_hist), "ylabel": str(h.ylabel_hist), \
+    "text": h._statistics_message(), "values": np.array(h.hcontents()), \
+    "x_edges": np.array(h.x_edges)}
+
+    if h.htype == 1:
+        spec["kind"] = "histogram"
+        spec["log"] = bool(log)
+    else:
+        spec["kind"] = "histogram2d"
+        spec["y_edges"] = np.array(h.y_edges)
+
+    return spec
+
+###########################################################################
+# end of function histogram_plot
+###########################################################################
+
+# here is a function to make the spec for one or more series against a
+# common x: series is a dictionary of label -> y array. style is "points"
+# (a scatter plot) or "line".
+
+def series_plot(filename, x, series, title = "", xlabel = "", ylabel = "", \
+style = "points", dpi = 300):
+
+    if style not in ("points", "line"):
+        raise ValueError("style has to be 'points' or 'line', not " + repr(style))
+
+    return {"kind": "series", "filename": filename, "dpi": dpi, \
+    "title": title, "xlabel": xlabel, "ylabel": ylabel, "style": style, \
+    "x": np.asarray(x, dtype = float), \
+    "labels": [str(label) for label in series], \
+    "ys": [np.asarray(y, dtype = float) for y in series.values()]}
+
+###########################################################################
+# end of function series_plot
+###########################################################################
+
+# here is a function to work out a spec's hash: everything that goes into
+# the picture (numbers and words), but not where it's saved.
+
+def spec_hash(spec):
+
+    digest = hashlib.sha1(str(_RENDER_VERSION).encode())
+
+    for key in sorted(spec):
+
+        if key == "filename":
+            continue
+
+        digest.update(key.encode())
+        _hash_value(digest, spec[key])
+
+    return digest.hexdigest()
+
+###########################################################################
+# end of function spec_hash
+###########################################################################
+
+def _hash_value(digest, value):
+
+    if isinstance(value, np.ndarray):
+        digest.update(str((value.dtype.str, value.shape)).encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (list, tuple)):
+        digest.update(b"[%d" % len(value))
+        for item in value:
+            _hash_value(digest, item)
+    else:
+        digest.update(repr(value).encode())
+
+###########################################################################
+
+# here is the function to draw a list of specs. Plots whose PNG is already
+# there and whose hash matches the last time are skipped unless force is
+# True. nproc = None uses every processor; nproc = 1 draws them all in this
+# process. It returns a list of (filename, "drawn" or "skipped", seconds).
+
+def render_all(specs, nproc = None, force = False):
+
+    import multiprocessing
+
+    manifests = {}
+    todo = []
+    report = []
+
+    for spec in specs:
+
+        filename = os.path.abspath(spec["filename"])
+        if not filename.lower().endswith(".png"):
+            filename = filename + ".png"
+
+        directory = os.path.dirname(filename)
+        if directory not in manifests:
+            manifests[directory] = _read_manifest(directory)
+
+        digest = spec_hash(spec)
+        name = os.path.basename(filename)
+
+        if not force and manifests[directory].get(name) == digest \
+        and os.path.exists(filename):
+            report.append((filename, "skipped", 0.))
+            continue
+
+        todo.append((spec, filename, digest))
+
+    if nproc is None:
+        nproc = os.cpu_count() or 1
+    nproc = max(1, min(nproc, len(todo)))
+
+    if nproc == 1:
+        results = map(_render_job, todo)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(nproc)
+        results = pool.imap_unordered(_render_job, todo, \
+        chunksize = max(1, len(todo) // (4 * nproc)))
+
+    try:
+        for filename, digest, seconds in results:
+            directory = os.path.dirname(filename)
+            manifests[directory][os.path.basename(filename)] = digest
+            report.append((filename, "drawn", seconds))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+        # save whatever got drawn, even if something went wrong part way.
+        for directory, manifest in manifests.items():
+            _write_manifest(directory, manifest)
+
+    return report
+
+###########################################################################
+# end of function render_all
+###########################################################################
+
+# here is a function to print what render_all did.
+
+def print_render_report(report):
+
+    drawn = [seconds for filename, how, seconds in report if how == "drawn"]
+
+    print("%d plots: %d drawn (%.2f s of drawing), %d unchanged" % \
+    (len(report), len(drawn), sum(drawn), len(report) - len(drawn)))
+
+###########################################################################
+# end of function print_render_report
+###########################################################################
+
+# here is the function each worker runs for one spec. The PNG is written to
+# a scratch file and renamed into place, so a half-written PNG never shows
+# up under the real name.
+
+def _render_job(job):
+
+    spec, filename, digest = job
+
+    start_time = time.perf_counter()
+
+    figure = _draw(spec)
+
+    os.makedirs(os.path.dirname(filename), exist_ok = True)
+    scratch = filename + ".%d.tmp" % os.getpid()
+    figure.savefig(scratch, dpi = spec["dpi"], format = "png")
+    os.replace(scratch, filename)
+
+    return filename, digest, time.perf_counter() - start_time
+
+###########################################################################
+# end of function _render_job
+###########################################################################
+
+# here is a function to get this process's figure for a kind of plot,
+# building it the first time. Figures are made with the Agg canvas
+# directly rather than through pyplot, so no window is ever opened,
+# whatever backend the calling program uses.
+
+def _template(key):
+
+    if key not in _templates:
+
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        figure = Figure()
+        FigureCanvasAgg(figure)
+        ax = figure.add_subplot(1, 1, 1)
+
+        text = ax.text(0.02, 0.98, "", horizontalalignment = "left", \
+        verticalalignment = "top", transform = ax.transAxes)
+
+        _templates[key] = {"figure": figure, "axes": ax, "text": text, \
+        "artists": []}
+
+    return _templates[key]
+
+###########################################################################
+# end of function _template
+###########################################################################
+
+# here is a function to put a spec's data into the right figure.
+
+def _draw(spec):
+
+    kind = spec["kind"]
+
+    if kind == "histogram":
+        template = _template(("histogram", spec["log"]))
+    elif kind == "histogram2d":
+        template = _template(("histogram2d",))
+    elif kind == "series":
+        template = _template(("series", spec["style"], len(spec["ys"])))
+    else:
+        raise ValueError("don't know how to draw a plot of kind " + repr(kind))
+
+    figure = template["figure"]
+    ax = template["axes"]
+    artists = template["artists"]
+
+    if kind == "histogram":
+
+        values = spec["values"]
+        edges = spec["x_edges"]
+
+        if not artists:
+            artists.append(ax.stairs(values, edges))
+            if spec["log"]:
+                ax.set_yscale("log")
+        else:
+            artists[0].set_data(values, edges)
+
+        top = max(1, float(values.max())) if values.size else 1.
+        ax.set_xlim(edges[0], edges[-1])
+        ax.set_ylim(0.5 if spec["log"] else 0., 1.2 * top)
+        template["text"].set_text(spec["text"])
+
+    elif kind == "histogram2d":
+
+        # bins can be uneven, so this is a pcolormesh, which is made afresh
+        # each time (the figure, axes and color bar are still reused).
+        values = spec["values"]
+
+        if artists:
+            artists.pop().remove()
+
+        artists.append(ax.pcolormesh(spec["x_edges"], spec["y_edges"], values, \
+        shading = "flat"))
+
+        if "colorbar" not in template:
+            template["colorbar"] = figure.colorbar(artists[0], ax = ax)
+        else:
+            template["colorbar"].update_normal(artists[0])
+
+        artists[0].set_clim(0, max(1, values.max()))
+        template["text"].set_text(spec["text"])
+
+    else:
+
+        if not artists:
+            for label in spec["labels"]:
+                if spec["style"] == "points":
+                    line, = ax.plot([], [], marker = ".", markersize = 2, \
+                    linestyle = "", label = label)
+                else:
+                    line, = ax.plot([], [], label = label)
+                artists.append(line)
+
+        for line, label, y in zip(artists, spec["labels"], spec["ys"]):
+            line.set_data(spec["x"], y)
+            line.set_label(label)
+
+        ax.relim()
+        ax.autoscale_view()
+
+        legend = ax.get_legend()
+        if len(artists) > 1:
+            ax.legend(markerscale = 4)
+        elif legend is not None:
+            legend.remove()
+
+    ax.set_title(spec["title"])
+    ax.set_xlabel(spec["xlabel"])
+    ax.set_ylabel(spec["ylabel"])
+
+    return figure
+
+###########################################################################
+# end of function _draw
+###########################################################################
+
+# here are functions to read and write a directory's hashes.
+
+def _read_manifest(directory):
+
+    try:
+        with open(os.path.join(directory, _MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _write_manifest(directory, manifest):
+
+    os.makedirs(directory, exist_ok = True)
+    scratch = os.path.join(directory, _MANIFEST + ".%d.tmp" % os.getpid())
+
+    with open(scratch, "w") as f:
+        json.dump(manifest, f, indent = 1, sort_keys = True)
+
+    os.replace(scratch, os.path.join(directory, _MANIFEST))
+
+###########################################################################
+
+# here is a function to make the specs for a standard set of plots for one
+# run: the pressures and temperatures against time, the corrected pressure
+# drops against time, and a histogram of each pressure drop.
+
+def run_plots(run, name, out_dir, dpi = 300):
+
+    import histogramObject as hb
+
+    seconds = (np.asarray(run["millis"], dtype = float) - run["millis"][0]) / 1000.
+    names = run.dtype.names if hasattr(run, "dtype") else run.names
+
+    pressures = {channel: run[channel] for channel in ("p0", "p1", "p2", "p3", "p4") \
+    if channel in names and np.any(np.asarray(run[channel]) > 0)}
+    temperatures = {"t" + channel[1:]: run["t" + channel[1:]] for channel in pressures}
+
+    specs = [
+        series_plot(os.path.join(out_dir, name + " pressures.png"), seconds, \
+        pressures, title = name + " pressures", xlabel = "time (s)", \
+        ylabel = "pressure (hPa)", dpi = dpi),
+        series_plot(os.path.join(out_dir, name + " temperatures.png"), seconds, \
+        temperatures, title = name + " temperatures", xlabel = "time (s)", \
+        ylabel = "temperature (C)", dpi = dpi),
+    ]
+
+    differentials = {channel: np.asarray(run[channel], dtype = float) \
+    for channel in ("dp01", "dp12") \
+    if channel in names and np.all(np.isfinite(run[channel]))}
+
+    if differentials:
+
+        specs.append(series_plot(os.path.join(out_dir, name + " differentials.png"), \
+        seconds, differentials, title = name + " corrected pressure drops", \
+        xlabel = "time (s)", ylabel = "pressure drop (Pa)", dpi = dpi))
+
+        for channel, values in differentials.items():
+            low, high = np.percentile(values, [0.5, 99.5]) if values.size else (0., 1.)
+            if high <= low:
+                high = low + 1.
+            h = hb.histo(name + " " + channel, 100, low, high)
+            h.hsetlabels(channel + " (Pa)", "samples")
+            h.hfill_array(values)
+            specs.append(histogram_plot(h, os.path.join(out_dir, \
+            name + " " + channel + " histogram.png"), dpi))
+
+    return specs
+
+###########################################################################
+# end of function run_plots
+###########################################################################
+
+if __name__ == "__main__":
+
+    import runCache as rc
+
+    parser = argparse.ArgumentParser(description = \
+    "draw the standard plots for a set of flowmeter data files")
+    parser.add_argument("files", nargs = "+")
+    parser.add_argument("--out", default = "Plots")
+    parser.add_argument("--dpi", type = int, default = 300)
+    parser.add_argument("-j", "--jobs", type = int, default = None)
+    parser.add_argument("--force", action = "store_true", \
+    help = "draw everything, even plots that haven't changed")
+    arguments = parser.parse_args()
+
+    specs = []
+    for filename in arguments.files:
+        name = os.path.splitext(os.path.basename(filename))[0]
+        specs += run_plots(rc.cached_load(filename), name, arguments.out, arguments.dpi)
+
+    print_render_report(render_all(specs, arguments.jobs, arguments.force))
@@ -0,0 +1,228 @@
+###################################################################
+
+# This file is runCache.py. It keeps a binary copy of every data file we
+# parse, so the text only has to be parsed once. The first time a file is
+# read, its columns are written out as one .npy file each; after that the
+# columns are memory mapped straight from those files, which takes next to
+# no time and copies nothing until the numbers are actually used.
+
+# A cached copy is tied to the data file's path, size and modification time
+# (and to the parser that made it). If the data file changes, the cached
+# copy is thrown away and rebuilt the next time the file is loaded.
+
+# use this way:
+#   import runCache as rc
+#
+#   run = rc.cached_load("Data/DPS310E_22_04_21_a.CSV")
+#   plt.scatter(run["millis"], run["p0"])
+#
+#   rc.print_load_report()
+#
+# by default the cache lives in a ".flowmeter_cache" directory next to the
+# data file; pass cache_dir to put it somewhere else.
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import flowmeterLoader as fl
+
+# bump this if the layout of the cache directories changes.
+_CACHE_FORMAT = 1
+
+# (filename, "cold" or "warm", seconds) for every cached_load call, so we
+# can see how much time the cache is saving.
+load_log = []
+
+###########################################################################
+
+# here is the class cached_load hands back: a set of named, equal-length
+# columns, indexed like a numpy structured array (run["p0"]).
+
+class run_columns:
+
+    __slots__ = ("columns", "names", "size", "from_cache", "load_seconds")
+
+    def __init__(self, columns, from_cache = False, load_seconds = 0.):
+
+        self.columns = columns
+        self.names = tuple(columns)
+        self.size = len(columns[self.names[0]]) if self.names else 0
+        self.from_cache = from_cache
+        self.load_seconds = load_seconds
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __len__(self):
+        return self.size
+
+###########################################################################
+# end of class run_columns
+###########################################################################
+
+# here is the function to load a data file through the cache. parser is
+# whatever turns the data file into columns: a function of the file name
+# returning a numpy structured array or a dictionary of equal-length arrays
+# (flowmeterLoader.load_dps310e, looked up when called, so a timed one
+# from instrumentation is used while that is turned on).
+
+def cached_load(filename, parser = None, cache_dir = None):
+
+    start_time = time.perf_counter()
+
+    if parser is None:
+        parser = fl.load_dps310e
+
+    filename = os.path.abspath(filename)
+    entry = _cache_entry(filename, cache_dir)
+    signature = _signature(filename, parser)
+
+    run = _read_entry(entry, signature)
+
+    if run is None:
+        _write_entry(entry, signature, _as_columns(parser(filename)))
+        run = _read_entry(entry, signature)
+        run.from_cache = False
+
+    run.load_seconds = time.perf_counter() - start_time
+    load_log.append((filename, "warm" if run.from_cache else "cold", run.load_seconds))
+
+    return run
+
+###########################################################################
+# end of function cached_load
+###########################################################################
+
+# here is a function to print how long each cached_load took, cold (parsed
+# from text) or warm (mapped from the cache).
+
+def print_load_report():
+
+    for kind in ("cold", "warm"):
+
+        times = [seconds for filename, how, seconds in load_log if how == kind]
+
+        if times:
+            print("%s loads: %d, total %.3f s, mean %.4f s" % \
+            (kind, len(times), sum(times), sum(times) / len(times)))
+
+    for filename, how, seconds in load_log:
+        print("  %-5s %9.4f s  %s" % (how, seconds, filename))
+
+###########################################################################
+# end of function print_load_report
+###########################################################################
+
+# here is a function to pick the directory holding the cached copy of a
+# file: one subdirectory per data file, named by a hash of its full path.
+
+def _cache_entry(filename, cache_dir):
+
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(filename), ".flowmeter_cache")
+
+    key = hashlib.sha1(filename.encode("utf-8")).hexdigest()[:20]
+
+    return os.path.join(cache_dir, key)
+
+###########################################################################
+# end of function _cache_entry
+###########################################################################
+
+# here is a function to describe the data file and parser a cached copy
+# has to match.
+
+def _signature(filename, parser):
+
+    status = os.stat(filename)
+
+    return {
+        "format": _CACHE_FORMAT,
+        "source": filename,
+        "size": status.st_size,
+        "mtime_ns": status.st_mtime_ns,
+        "parser": getattr(parser, "__module__", "") + "." + \
+        getattr(parser, "__qualname__", repr(parser)),
+    }
+
+###########################################################################
+# end of function _signature
+###########################################################################
+
+# here is a function to turn what a parser returns into a dictionary of
+# column arrays.
+
+def _as_columns(parsed):
+
+    if isinstance(parsed, dict):
+        return {name: np.asarray(values) for name, values in parsed.items()}
+
+    return {name: np.ascontiguousarray(parsed[name]) for name in parsed.dtype.names}
+
+###########################################################################
+# end of function _as_columns
+###########################################################################
+
+# here is a function to memory map a cached copy, or return None if there
+# isn't one or it's out of date.
+
+def _read_entry(entry, signature):
+
+    try:
+        with open(os.path.join(entry, "meta.json")) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if meta.get("signature") != signature:
+        return None
+
+    try:
+        columns = {name: np.load(os.path.join(entry, name + ".npy"), mmap_mode = "r") \
+        for name in meta["columns"]}
+    except (OSError, ValueError):
+        return None
+
+    return run_columns(columns, from_cache = True)
+
+###########################################################################
+# end of function _read_entry
+###########################################################################
+
+# here is a function to write a cached copy. It is built in a scratch
+# directory and then renamed into place, so nobody ever sees half of one.
+
+def _write_entry(entry, signature, columns):
+
+    parent = os.path.dirname(entry)
+    os.makedirs(parent, exist_ok = True)
+
+    scratch = tempfile.mkdtemp(dir = parent)
+
+    for name, values in columns.items():
+        np.save(os.path.join(scratch, name + ".npy"), values)
+
+    with open(os.path.join(scratch, "meta.json"), "w") as f:
+        json.dump({"signature": signature, "columns": list(columns)}, f)
+
+    if os.path.isdir(entry):
+        shutil.rmtree(entry, ignore_errors = True)
+
+    try:
+        os.replace(scratch, entry)
+    except OSError:
+        # somebody else got there first; theirs is just as good.
+        shutil.rmtree(scratch, ignore_errors = True)
+
+###########################################################################
+# end of function _write_entry
+###########################################################################
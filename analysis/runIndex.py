@@ -0,0 +1,737 @@
+###################################################################
+
+# This file is runIndex.py. It keeps an index of every run in a set of data
+# files in a small SQLite database, so finding the runs from a given day,
+# patient or flow rate doesn't mean opening and parsing every file. For
+# each run it records the file, where the run starts and stops in the file
+# (byte offsets), how many rows it has, its time range, the patient ID and
+# the steady segments in it (pump off and the plateaus, with their flow
+# rates and byte ranges). Reading a run or a segment back means seeking to
+# its first byte and parsing just those lines.
+
+# The formats it knows:
+#   dps310e      DPS310E_*.CSV lines (22 fields). A file is split into runs
+#                where millis goes backwards (the logger restarted), the
+#                patient ID changes or the clock jumps by more than
+#                run_gap_ms. Segments come from flowSegments, flow rates
+#                from venturiFlow.
+#   short_tube   the older unlabelled lines (11 fields), the same way.
+#   insert, long_tube, elevation
+#                the block formats of formatRegistry: a header line
+#                ("flow rate=0.66", a pump setting, an elevation) starts
+#                each block of rows. Each block is one run with one
+#                segment.
+
+# The index is updated incrementally: files that haven't changed since the
+# last update (same size and modification time) aren't opened; a file
+# that has only had lines added to the end (a logger still writing) is
+# re-read from the start of its last run; anything else is indexed again
+# from scratch. Files that have disappeared are dropped.
+
+# use this way:
+#   import runIndex as ri
+#
+#   ri.update_index("Data/run_index.sqlite", ["Data"])
+#   for run in ri.find_runs("Data/run_index.sqlite", date = "2022-04-21",
+#                           patient_id = 6):
+#       rows = ri.read_run(run)
+#
+#   for segment in ri.find_segments("Data/run_index.sqlite", flow = 0.66):
+#       rows = ri.read_run(segment)
+#
+# or from the command line:
+#   python runIndex.py update Data --db Data/run_index.sqlite
+#   python runIndex.py runs --db Data/run_index.sqlite --date 2022-04-21
+#   python runIndex.py segments --db Data/run_index.sqlite --flow 0.66
+
+import argparse
+import datetime
+import glob
+import hashlib
+import os
+import sqlite3
+
+import numpy as np
+
+import flowmeterLoader as fl
+import flowSegments as fs
+import formatRegistry as fr
+import venturiFlow as vf
+
+# bump this if the tables change; an index built by another version is
+# rebuilt from scratch.
+_INDEX_FORMAT = 3
+
+_schema = """
+CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY, path TEXT UNIQUE, format TEXT,
+    size INTEGER, mtime_ns INTEGER, indexed_bytes INTEGER, tail_hash TEXT);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY, file_id INTEGER, number INTEGER, label TEXT,
+    start_byte INTEGER, stop_byte INTEGER, nrows INTEGER,
+    start_ms INTEGER, stop_ms INTEGER, patient_id INTEGER, flow_rate REAL,
+    note TEXT);
+CREATE TABLE IF NOT EXISTS segments (
+    id INTEGER PRIMARY KEY, run_id INTEGER, kind TEXT, label TEXT,
+    start_row INTEGER, stop_row INTEGER, start_byte INTEGER, stop_byte INTEGER,
+    dp_mean REAL, flow_rate REAL);
+CREATE INDEX IF NOT EXISTS runs_by_file ON runs (file_id, number);
+CREATE INDEX IF NOT EXISTS runs_by_time ON runs (start_ms, stop_ms);
+CREATE INDEX IF NOT EXISTS runs_by_patient ON runs (patient_id);
+CREATE INDEX IF NOT EXISTS segments_by_run ON segments (run_id);
+CREATE INDEX IF NOT EXISTS segments_by_flow ON segments (flow_rate);
+"""
+
+# a DPS310E file is split into runs where the clock jumps by more than this.
+run_gap_ms = 60000
+
+# bytes read at a time while scanning a file.
+_chunk_bytes = 1 << 24
+
+###########################################################################
+
+# here is a function to open (and if need be create) the index database.
+
+def connect(db_path):
+
+    connection = sqlite3.connect(db_path)
+    connection.row_factory = sqlite3.Row
+
+    connection.executescript(_schema)
+
+    version = connection.execute("SELECT value FROM settings WHERE name = 'format'").fetchone()
+
+    # the tables may have other columns, so they are made again.
+    if version is None or int(version["value"]) != _INDEX_FORMAT:
+        with connection:
+            connection.execute("DROP TABLE segments")
+            connection.execute("DROP TABLE runs")
+            connection.execute("DROP TABLE files")
+        connection.executescript(_schema)
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO settings VALUES ('format', ?)", \
+            (str(_INDEX_FORMAT),))
+
+    return connection
+
+###########################################################################
+# end of function connect
+###########################################################################
+
+# here is the function to bring the index up to date with the files in
+# paths (files, directories or glob patterns; directories are searched for
+# files, not recursively). It hands back how many files were indexed from
+# scratch, appended to, left alone and dropped.
+
+def update_index(db_path, paths, verbose = False):
+
+    filenames = _expand(paths)
+    counts = {"indexed": 0, "appended": 0, "unchanged": 0, "dropped": 0}
+
+    connection = connect(db_path)
+
+    try:
+
+        # files that were indexed from these directories but are gone now.
+        directories = [os.path.abspath(path) for path in paths if os.path.isdir(path)]
+        for row in connection.execute("SELECT id, path FROM files").fetchall():
+            if row["path"] not in filenames and (os.path.dirname(row["path"]) in \
+            directories or not os.path.exists(row["path"])):
+                with connection:
+                    _forget_file(connection, row["id"])
+                counts["dropped"] += 1
+
+        for filename in sorted(filenames):
+
+            what = _update_file(connection, filename)
+            counts[what] += 1
+
+            if verbose and what != "unchanged":
+                print("%-9s %s" % (what, filename))
+
+    finally:
+        connection.close()
+
+    return counts
+
+###########################################################################
+# end of function update_index
+###########################################################################
+
+# here is a function to bring one file's entries up to date. It hands back
+# what it did: "indexed", "appended" or "unchanged".
+
+def _update_file(connection, filename):
+
+    status = os.stat(filename)
+    known = connection.execute("SELECT * FROM files WHERE path = ?", (filename,)).fetchone()
+
+    if known is not None and known["size"] == status.st_size and \
+    known["mtime_ns"] == status.st_mtime_ns:
+        return "unchanged"
+
+    # lines added to the end of a file we've seen: start again from the
+    # beginning of its last run, which may have carried on, under the
+    # set-up note it was found under (or from the top, if it had no runs).
+    if known is not None and known["format"] is not None and \
+    status.st_size >= known["indexed_bytes"] and \
+    _tail_hash(filename, known["indexed_bytes"]) == known["tail_hash"]:
+
+        last = connection.execute("SELECT * FROM runs WHERE file_id = ? " \
+        "ORDER BY number DESC LIMIT 1", (known["id"],)).fetchone()
+
+        start_byte = last["start_byte"] if last is not None else 0
+        first_number = last["number"] if last is not None else 0
+        note = last["note"] if last is not None else None
+
+        runs, indexed_bytes = _scan(filename, known["format"], start_byte, note)
+
+        with connection:
+            if last is not None:
+                _forget_runs(connection, "id = ?", (last["id"],))
+            _store_runs(connection, known["id"], runs, first_number)
+            connection.execute("UPDATE files SET size = ?, mtime_ns = ?, " \
+            "indexed_bytes = ?, tail_hash = ? WHERE id = ?", (status.st_size, \
+            status.st_mtime_ns, indexed_bytes, _tail_hash(filename, indexed_bytes), \
+            known["id"]))
+
+        return "appended"
+
+    file_format = sniff_format(filename)
+
+    runs, indexed_bytes = _scan(filename, file_format, 0) if file_format is not None \
+    else ([], 0)
+
+    with connection:
+
+        if known is not None:
+            _forget_file(connection, known["id"])
+
+        file_id = connection.execute("INSERT INTO files (path, format, size, mtime_ns, " \
+        "indexed_bytes, tail_hash) VALUES (?, ?, ?, ?, ?, ?)", (filename, file_format, \
+        status.st_size, status.st_mtime_ns, indexed_bytes, \
+        _tail_hash(filename, indexed_bytes))).lastrowid
+
+        _store_runs(connection, file_id, runs, 0)
+
+    return "indexed"
+
+###########################################################################
+# end of function _update_file
+###########################################################################
+
+# here are functions to take a file's runs (and their segments) out of the
+# index, or some of a file's runs picked by a WHERE clause.
+
+def _forget_file(connection, file_id):
+
+    _forget_runs(connection, "file_id = ?", (file_id,))
+    connection.execute("DELETE FROM files WHERE id = ?", (file_id,))
+
+def _forget_runs(connection, where, arguments):
+
+    connection.execute("DELETE FROM segments WHERE run_id IN (SELECT id FROM runs WHERE " \
+    + where + ")", arguments)
+    connection.execute("DELETE FROM runs WHERE " + where, arguments)
+
+###########################################################################
+# end of functions _forget_file and _forget_runs
+###########################################################################
+
+# here is a function to write runs found by _scan into the index,
+# numbering them on from first_number.
+
+def _store_runs(connection, file_id, runs, first_number):
+
+    for number, run in enumerate(runs, first_number):
+
+        run_id = connection.execute("INSERT INTO runs (file_id, number, label, " \
+        "start_byte, stop_byte, nrows, start_ms, stop_ms, patient_id, flow_rate, note) " \
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (file_id, number, run["label"], \
+        run["start_byte"], run["stop_byte"], run["nrows"], run["start_ms"], \
+        run["stop_ms"], run["patient_id"], run["flow_rate"], run["note"])).lastrowid
+
+        connection.executemany("INSERT INTO segments (run_id, kind, label, start_row, " \
+        "stop_row, start_byte, stop_byte, dp_mean, flow_rate) " \
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", [(run_id,) + segment \
+        for segment in run["segments"]])
+
+###########################################################################
+# end of function _store_runs
+###########################################################################
+
+# here is a function to work out which format a file is in (see
+# formatRegistry), or None if it isn't one of ours (a PDF, a spreadsheet...).
+
+def sniff_format(filename):
+
+    return fr.sniff_format(filename)
+
+###########################################################################
+# end of function sniff_format
+###########################################################################
+
+# here is a function to find a file's runs, starting start_byte bytes in
+# (under the set-up note given, for the block formats). It hands back a list of runs (dictionaries, one per row of the runs table
+# plus their segments) and how far into the file it got: the end of the
+# last complete line, so a line still being written is picked up next time.
+
+def _scan(filename, file_format, start_byte, note = None):
+
+    if file_format in ("dps310e", "short_tube"):
+        return _scan_dps310e(filename, 22 if file_format == "dps310e" else 11, start_byte)
+
+    return _scan_blocks(filename, file_format, start_byte, note)
+
+###########################################################################
+# end of function _scan
+###########################################################################
+
+# here is a function to read a DPS310E (or short tube) file from start_byte
+# on, a chunk at a time, keeping only what the index needs from each row:
+# where the line is, the clock, the patient and the three pressures used to
+# find segments and flow rates. Then it splits the rows into runs.
+
+def _scan_dps310e(filename, nfields, start_byte):
+
+    starts = []
+    stops = []
+    chunks = []
+
+    with open(filename, "rb") as f:
+
+        f.seek(start_byte)
+        position = start_byte
+        leftover = b""
+
+        while True:
+
+            block = f.read(_chunk_bytes)
+            if not block:
+                break
+
+            data = leftover + block
+            cut = data.rfind(b"\n") + 1
+            leftover = data[cut:]
+
+            if cut == 0:
+                continue
+
+            line_starts, line_stops, chunk = _parse_block(data[:cut], nfields)
+
+            starts.append(line_starts + position)
+            stops.append(line_stops + position)
+            chunks.append(chunk)
+
+            position = position + cut
+
+    if not chunks:
+        return [], position
+
+    starts = np.concatenate(starts)
+    stops = np.concatenate(stops)
+    rows = np.concatenate(chunks)
+
+    if rows.size == 0:
+        return [], position
+
+    # a new run wherever the logger restarted, the patient changed or the
+    # clock jumped.
+    breaks = (np.diff(rows["millis"]) < 0) | (np.diff(rows["patient_id"]) != 0) | \
+    (np.abs(np.diff(rows["utc_ms"])) > run_gap_ms)
+    edges = np.concatenate(([0], np.flatnonzero(breaks) + 1, [rows.size]))
+
+    ambient = fl.ambient_channel(rows)
+
+    runs = []
+
+    for first, last in zip(edges[:-1], edges[1:]):
+
+        piece = rows[first:last]
+        segments = _dps310e_segments(piece, ambient, starts[first:last], stops[first:last])
+
+        runs.append({"label": "run", "start_byte": int(starts[first]), \
+        "stop_byte": int(stops[last - 1]), "nrows": int(last - first), \
+        "start_ms": int(piece["utc_ms"][0]), "stop_ms": int(piece["utc_ms"][-1]), \
+        "patient_id": int(piece["patient_id"][0]), "flow_rate": None, \
+        "note": None, "segments": segments})
+
+    return runs, position
+
+###########################################################################
+# end of function _scan_dps310e
+###########################################################################
+
+# here is a function to parse a block of whole lines (bytes) and find
+# where each row that parsed starts and stops in the block.
+
+def _parse_block(data, nfields):
+
+    pieces = data.split(b"\n")[:-1]
+
+    stops = np.cumsum([len(piece) + 1 for piece in pieces])
+    starts = stops - np.array([len(piece) + 1 for piece in pieces])
+
+    keep = [i for i, piece in enumerate(pieces) if piece.count(b",") == nfields - 1]
+    lines = [pieces[i].decode("utf-8", "replace") for i in keep]
+
+    rows = fl.parse_lines(lines, nfields)
+
+    # a few lines with the right number of commas but garbage in them were
+    # dropped: find out which, one line at a time.
+    if rows.size != len(keep):
+        parsed = [fl.parse_lines([line], nfields) for line in lines]
+        keep = [i for i, row in zip(keep, parsed) if row.size == 1]
+        rows = np.concatenate([row for row in parsed if row.size == 1]) if keep \
+        else rows[:0]
+
+    keep = np.array(keep, dtype = np.int64)
+
+    return starts[keep], stops[keep], rows
+
+###########################################################################
+# end of function _parse_block
+###########################################################################
+
+# here is a function to find the segments of one DPS310E run and the flow
+# rate on each, as rows for the segments table.
+
+def _dps310e_segments(rows, ambient, starts, stops):
+
+    high, low = "p0", "p1"
+
+    good = fl.good_samples(rows, [high, low, ambient])
+    signal = 100. * (rows[high] - rows[ambient])
+    if not good.all() and good.any():
+        signal = vf._bridge_dropouts(signal, good)
+
+    segments = fs.find_segments(signal)
+    table = vf.summarize_runs([rows], high = high, low = low, ambient = ambient, \
+    segments = [segments])
+
+    return [(str(segment["kind"]), str(segment["label"]), int(segment["start"]), \
+    int(segment["stop"]), int(starts[segment["start"]]), \
+    int(stops[segment["stop"] - 1]), _number(row["dp_mean"]), \
+    0. if segment["kind"] == "baseline" else _number(row["flow_mean"])) \
+    for segment, row in zip(segments, table) if segment["kind"] != "transition"]
+
+###########################################################################
+# end of function _dps310e_segments
+###########################################################################
+
+# here is a function to read a block format file from start_byte on. A
+# header line starts a block; the rows after it, up to the next header, are
+# the block's run. The registry's marker function for the format says what
+# each line that isn't a data row is. note is the set-up note in force at
+# start_byte.
+
+def _scan_blocks(filename, file_format, start_byte, note = None):
+
+    marker = fr.formats[file_format]["marker"]
+
+    runs = []
+    run = None
+    position = start_byte
+
+    # for the insert files: the last set-up note ("diffuser on input") seen.
+    note = note or ""
+
+    with open(filename, "rb") as f:
+
+        f.seek(start_byte)
+
+        for raw in f:
+
+            if not raw.endswith(b"\n"):
+                break
+
+            line = raw.decode("utf-8", "replace")
+
+            if fr._data_row.match(line):
+                if run is not None:
+                    run["nrows"] += 1
+                    run["stop_byte"] = position + len(raw)
+                position = position + len(raw)
+                continue
+
+            found = marker(line) if line.strip(", \t\r\n") else None
+
+            if found is not None and found[0] == "section":
+                note = found[1]
+
+            elif found is not None:
+                if run is not None and run["nrows"] > 0:
+                    runs.append(run)
+                kind, label, header_value, flow_rate, utc_ms = found
+                start_ms = utc_ms if utc_ms >= 0 else None
+                run = {"label": (note + " " + label).strip(), "start_byte": position, \
+                "stop_byte": position + len(raw), "nrows": 0, "start_ms": start_ms, \
+                "stop_ms": start_ms, "patient_id": None, "flow_rate": _number(flow_rate), \
+                "note": note, "segments": []}
+
+            position = position + len(raw)
+
+    if run is not None and run["nrows"] > 0:
+        runs.append(run)
+
+    # each block is one steady stretch: one segment covering all of it.
+    for run in runs:
+        if run["flow_rate"] is not None:
+            kind = "baseline" if run["flow_rate"] == 0. else "plateau"
+            run["segments"] = [(kind, run["label"], 0, run["nrows"], \
+            run["start_byte"], run["stop_byte"], None, run["flow_rate"])]
+
+    return runs, position
+
+###########################################################################
+# end of function _scan_blocks
+###########################################################################
+
+# here is a function to turn NaN into None for the database.
+
+def _number(value):
+
+    value = float(value)
+
+    return None if np.isnan(value) else value
+
+###########################################################################
+# end of function _number
+###########################################################################
+
+# here is a function to hash the 4096 bytes before offset, to tell whether
+# a file has only been added to since it was indexed up to offset.
+
+def _tail_hash(filename, offset):
+
+    with open(filename, "rb") as f:
+        f.seek(max(0, offset - 4096))
+        return hashlib.sha1(f.read(min(offset, 4096))).hexdigest()
+
+###########################################################################
+# end of function _tail_hash
+###########################################################################
+
+# here is a function to turn a list of files, directories and glob
+# patterns into a set of absolute file names.
+
+def _expand(paths):
+
+    filenames = set()
+
+    for path in paths:
+
+        if os.path.isdir(path):
+            matches = [os.path.join(path, name) for name in os.listdir(path)]
+        else:
+            matches = glob.glob(path)
+
+        for name in matches:
+            if os.path.isfile(name) and not os.path.basename(name).startswith("."):
+                filenames.add(os.path.abspath(name))
+
+    return filenames
+
+###########################################################################
+# end of function _expand
+###########################################################################
+
+# here is the function to look runs up. Everything is optional:
+#   date         "yyyy-mm-dd": runs with some of their time on that (UTC) day
+#   start_ms, stop_ms  runs with some of their time between these
+#   patient_id   that patient's runs
+#   flow         runs with a segment within tolerance (L/s) of this flow
+#   file_format  one of the formats above
+#   path         runs in files whose path contains this
+# It hands back a list of dictionaries, one per run, with the file's path
+# and format along with the run's columns.
+
+def find_runs(db_path, date = None, start_ms = None, stop_ms = None, patient_id = None, \
+flow = None, tolerance = 0.05, file_format = None, path = None):
+
+    where, arguments = _conditions(date, start_ms, stop_ms, patient_id, file_format, path)
+
+    if flow is not None:
+        where.append("runs.id IN (SELECT run_id FROM segments WHERE flow_rate BETWEEN ? AND ?)")
+        arguments += [flow - tolerance, flow + tolerance]
+
+    query = "SELECT runs.*, files.path, files.format FROM runs JOIN files " \
+    "ON runs.file_id = files.id" + (" WHERE " + " AND ".join(where) if where else "") + \
+    " ORDER BY files.path, runs.number"
+
+    return _query(db_path, query, arguments)
+
+###########################################################################
+# end of function find_runs
+###########################################################################
+
+# here is the function to look segments up: the steady stretches of kind
+# ("plateau", "baseline" or None for both) within tolerance (L/s) of flow,
+# if given, in runs picked the same way as find_runs. Each comes with its
+# run's path, format, patient and times.
+
+def find_segments(db_path, flow = None, tolerance = 0.05, kind = "plateau", date = None, \
+start_ms = None, stop_ms = None, patient_id = None, file_format = None, path = None):
+
+    where, arguments = _conditions(date, start_ms, stop_ms, patient_id, file_format, path)
+
+    if flow is not None:
+        where.append("segments.flow_rate BETWEEN ? AND ?")
+        arguments += [flow - tolerance, flow + tolerance]
+
+    if kind is not None:
+        where.append("segments.kind = ?")
+        arguments.append(kind)
+
+    query = "SELECT segments.*, runs.number AS run_number, runs.patient_id, " \
+    "runs.start_ms, runs.stop_ms, files.path, files.format FROM segments " \
+    "JOIN runs ON segments.run_id = runs.id JOIN files ON runs.file_id = files.id" + \
+    (" WHERE " + " AND ".join(where) if where else "") + \
+    " ORDER BY files.path, runs.number, segments.start_row"
+
+    return _query(db_path, query, arguments)
+
+###########################################################################
+# end of function find_segments
+###########################################################################
+
+# here is a function to build the WHERE conditions find_runs and
+# find_segments have in common.
+
+def _conditions(date, start_ms, stop_ms, patient_id, file_format, path):
+
+    where = []
+    arguments = []
+
+    if date is not None:
+        day = datetime.datetime.strptime(date, "%Y-%m-%d").replace(tzinfo = datetime.timezone.utc)
+        start_ms = int(day.timestamp() * 1000)
+        stop_ms = start_ms + 86400000 - 1
+
+    if start_ms is not None:
+        where.append("runs.stop_ms >= ?")
+        arguments.append(int(start_ms))
+
+    if stop_ms is not None:
+        where.append("runs.start_ms <= ?")
+        arguments.append(int(stop_ms))
+
+    if patient_id is not None:
+        where.append("runs.patient_id = ?")
+        arguments.append(int(patient_id))
+
+    if file_format is not None:
+        where.append("files.format = ?")
+        arguments.append(file_format)
+
+    if path is not None:
+        where.append("files.path LIKE ?")
+        arguments.append("%" + path + "%")
+
+    return where, arguments
+
+###########################################################################
+# end of function _conditions
+###########################################################################
+
+# here is a function to run a query and hand back its rows as dictionaries.
+
+def _query(db_path, query, arguments):
+
+    connection = connect(db_path)
+
+    try:
+        return [dict(row) for row in connection.execute(query, arguments)]
+    finally:
+        connection.close()
+
+###########################################################################
+# end of function _query
+###########################################################################
+
+# here is the function to read a run or a segment (anything find_runs or
+# find_segments handed back) from its file: it reads just the bytes from
+# start_byte to stop_byte. DPS310E and short tube rows come back as a
+# structured array of fl.dps310e_dtype; rows from the block formats as
+# one of fr.block_dtype (with run counting from 0 within what was read).
+
+def read_run(entry):
+
+    if entry["format"] in ("dps310e", "short_tube"):
+        lines = read_lines(entry["path"], entry["start_byte"], entry["stop_byte"])
+        return fl.parse_lines(lines, 22 if entry["format"] == "dps310e" else 11)
+
+    with open(entry["path"], "rb") as f:
+        f.seek(entry["start_byte"])
+        data = f.read(entry["stop_byte"] - entry["start_byte"])
+
+    return fr.parse_block_bytes(data, entry["format"])
+
+###########################################################################
+# end of function read_run
+###########################################################################
+
+# here is a function to read the lines between two byte offsets of a file.
+
+def read_lines(filename, start_byte, stop_byte):
+
+    with open(filename, "rb") as f:
+        f.seek(start_byte)
+        data = f.read(stop_byte - start_byte)
+
+    return data.decode("utf-8", "replace").split("\n")[:-1] if data.endswith(b"\n") \
+    else data.decode("utf-8", "replace").split("\n")
+
+###########################################################################
+# end of function read_lines
+###########################################################################
+
+# here is a function to print runs or segments, one per line.
+
+def print_entries(entries):
+
+    for entry in entries:
+
+        when = ""
+        if entry.get("start_ms") is not None:
+            when = datetime.datetime.fromtimestamp(entry["start_ms"] / 1000., \
+            datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+        flow = entry.get("flow_rate")
+
+        label = entry["label"] if flow is None else "%s %.3f L/s" % (entry["label"], flow)
+        nrows = entry["nrows"] if "nrows" in entry else entry["stop_row"] - entry["start_row"]
+
+        print("%-19s %6s %-28s %10d %10d %8d %s" % (when, \
+        "" if entry["patient_id"] is None else entry["patient_id"], label[:28], \
+        entry["start_byte"], entry["stop_byte"], nrows, os.path.basename(entry["path"])))
+
+###########################################################################
+# end of function print_entries
+###########################################################################
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = \
+    "index the runs in flowmeter data files, and look them up")
+    parser.add_argument("command", choices = ("update", "runs", "segments"))
+    parser.add_argument("paths", nargs = "*", default = ["."])
+    parser.add_argument("--db", default = "run_index.sqlite")
+    parser.add_argument("--date", default = None, help = "yyyy-mm-dd")
+    parser.add_argument("--patient", type = int, default = None)
+    parser.add_argument("--flow", type = float, default = None, help = "L/s")
+    parser.add_argument("--tolerance", type = float, default = 0.05, help = "L/s")
+    parser.add_argument("--format", default = None)
+    arguments = parser.parse_args()
+
+    if arguments.command == "update":
+        print(update_index(arguments.db, arguments.paths, verbose = True))
+    elif arguments.command == "runs":
+        print_entries(find_runs(arguments.db, arguments.date, \
+        patient_id = arguments.patient, flow = arguments.flow, \
+        tolerance = arguments.tolerance, file_format = arguments.format))
+    else:
+        print_entries(find_segments(arguments.db, arguments.flow, arguments.tolerance, \
+        date = arguments.date, patient_id = arguments.patient, \
+        file_format = arguments.format))
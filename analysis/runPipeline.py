@@ -0,0 +1,458 @@
+###################################################################
+
+# This file is runPipeline.py. It runs the whole analysis over a set of
+# run files (DPS310E or short tube), one file per worker process, and puts
+# the results together in one table: for every segment of every run, the
+# baseline-corrected pressure drop and the flow rate. It also fills one
+# histogram of the flow over all the plateaus of all the runs.
+
+# Each run goes through these stages:
+#   load       the file, through runCache (so it's parsed only once)
+#   segment    flowSegments.find_segments on 100 * (high - ambient)
+#   baseline   the pump-off difference, and the corrected dp of every sample
+#   flow       venturiFlow.volumetric_flow of every sample, and the
+#              per-segment means and spreads
+#   histogram  the flow samples in the plateaus, binned
+# The output of every stage is saved (in "stages" in the runCache
+# directory), named by a hash of what went into it: the settings the stage
+# uses and a hash of the stage's input. Run the pipeline again and only
+# the stages whose settings or input changed are done again; change the
+# histogram binning and only the histograms are refilled. If a change
+# upstream doesn't change a stage's input (a new segment window that finds
+# the same segments), the stages after it aren't redone either.
+
+# use this way:
+#   import runPipeline as rp
+#
+#   table, h, report = rp.run_pipeline(glob.glob("Data/DPS310E_*.CSV"),
+#                                      {"window": 21, "nbins": 60})
+#   rp.print_table(table)
+#   h.hprint()
+#
+# or from the command line:
+#   python runPipeline.py "Data/DPS310E_*.CSV" --window 21 --out summary.csv
+
+import argparse
+import glob
+import hashlib
+import io
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import flowSegments as fs
+import flowmeterLoader as fl
+import histogramObject as hb
+import runCache as rc
+import venturiFlow as vf
+
+# bump this if what any stage works out changes, so old outputs get redone.
+_PIPELINE_VERSION = 1
+
+# the stages, in order, and the settings each one uses.
+stage_settings = (
+    ("load", ()),
+    ("segment", ("high", "ambient", "window", "threshold", "min_length", "tolerance")),
+    ("baseline", ("high", "low")),
+    ("flow", ("rho", "a1", "a2")),
+    ("histogram", ("nbins", "flow_low", "flow_high")),
+)
+
+# the settings, and what they are unless you say otherwise. ambient = None
+# picks the atmosphere sensor for the file format; threshold and tolerance
+# = None let find_segments work them out.
+default_settings = {
+    "high": "p0",
+    "low": "p1",
+    "ambient": None,
+    "window": 15,
+    "threshold": None,
+    "min_length": 30,
+    "tolerance": None,
+    "rho": vf.RHO_AIR,
+    "a1": vf.A1,
+    "a2": vf.A2,
+    "nbins": 100,
+    "flow_low": -1.,
+    "flow_high": 1.,
+}
+
+# one row per segment of every run: summary_dtype with the file it's from.
+table_dtype = np.dtype([("file", "U64")] + vf.summary_dtype.descr)
+
+###########################################################################
+
+# here is the function to run the pipeline over a list of files. settings
+# holds whichever of default_settings you want to change. nproc = None uses
+# every processor; nproc = 1 does everything in this process. cache_dir is
+# handed to runCache (None puts the cache next to each data file); force =
+# True redoes every stage. It hands back the table (table_dtype), the
+# histogram of plateau flows over all the runs, and a report: for every
+# file, a list of (stage, "done" or "saved", seconds).
+
+def run_pipeline(files, settings = None, nproc = None, cache_dir = None, force = False):
+
+    import multiprocessing
+
+    settings = _full_settings(settings)
+    jobs = [(os.path.abspath(filename), settings, cache_dir, force) for filename in files]
+
+    if nproc is None:
+        nproc = os.cpu_count() or 1
+    nproc = max(1, min(nproc, len(jobs)))
+
+    if nproc == 1:
+        results = list(map(_run_job, jobs))
+    else:
+        with multiprocessing.Pool(nproc) as pool:
+            results = pool.map(_run_job, jobs, chunksize = 1)
+
+    tables = []
+    h = _empty_histogram(settings)
+    report = {}
+
+    for filename, table, piece, stages in results:
+
+        rows = np.zeros(table.size, dtype = table_dtype)
+        for name in vf.summary_dtype.names:
+            rows[name] = table[name]
+        rows["file"] = os.path.basename(filename)
+        rows["run"] = len(tables)
+
+        tables.append(rows)
+        h.hmerge(piece)
+        report[filename] = stages
+
+    table = np.concatenate(tables) if tables else np.zeros(0, dtype = table_dtype)
+
+    return table, h, report
+
+###########################################################################
+# end of function run_pipeline
+###########################################################################
+
+# here is a function to fill in the settings nobody gave, and complain
+# about any nobody has heard of.
+
+def _full_settings(settings):
+
+    full = dict(default_settings)
+
+    for name, value in (settings or {}).items():
+        if name not in default_settings:
+            raise ValueError("unknown pipeline setting " + repr(name))
+        full[name] = value
+
+    return full
+
+###########################################################################
+# end of function _full_settings
+###########################################################################
+
+# here is the function each worker runs for one file: every stage in turn,
+# each one taken from its saved output if there is one.
+
+def _run_job(job):
+
+    filename, settings, cache_dir, force = job
+
+    stages = []
+
+    start_time = time.perf_counter()
+    run = rc.cached_load(filename, cache_dir = cache_dir)
+    stages.append(("load", "saved" if run.from_cache else "done", \
+    time.perf_counter() - start_time))
+
+    store = os.path.join(os.path.dirname(rc._cache_entry(filename, cache_dir)), "stages")
+
+    # the load stage's output is named by the data file (path, size and
+    # modification time), which is what runCache checks too. Every later
+    # stage's input is the run and the outputs of the stages before it.
+    digests = [_digest("load", rc._signature(filename, fl.load_dps310e), [])]
+
+    settings = dict(settings)
+    if settings["ambient"] is None:
+        settings["ambient"] = fl.ambient_channel(run)
+
+    outputs = {}
+
+    for stage, names in stage_settings[1:]:
+
+        used = {name: settings[name] for name in names}
+        key = _digest(stage, used, digests)
+
+        start_time = time.perf_counter()
+        output = None if force else _read_output(store, stage, key)
+        how = "saved"
+
+        if output is None:
+            output = _stages[stage](run, outputs, used)
+            output["digest"] = np.array(_digest_arrays(output))
+            _write_output(store, stage, key, output)
+            how = "done"
+
+        stages.append((stage, how, time.perf_counter() - start_time))
+
+        outputs[stage] = output
+        digests.append(str(output["digest"]))
+
+    h = hb.hload(io.BytesIO(outputs["histogram"]["histogram"].tobytes()))
+
+    return filename, outputs["flow"]["table"], h, stages
+
+###########################################################################
+# end of function _run_job
+###########################################################################
+
+# here are the stages after load. Each gets the run, the outputs of the
+# stages before it and its settings, and hands back a dictionary of arrays.
+
+def _segment_stage(run, outputs, used):
+
+    high, ambient = used["high"], used["ambient"]
+
+    good = fl.good_samples(run, [high, ambient])
+    signal = vf._bridge_dropouts(100. * (np.asarray(run[high], dtype = float) - \
+    np.asarray(run[ambient], dtype = float)), good)
+
+    return {"segments": fs.find_segments(signal, used["window"], used["threshold"], \
+    used["min_length"], used["tolerance"])}
+
+def _baseline_stage(run, outputs, used):
+
+    high = np.asarray(run[used["high"]], dtype = float)
+    low = np.asarray(run[used["low"]], dtype = float)
+    good = fl.good_samples(run, [used["high"], used["low"]])
+
+    # the pump-off difference (hPa) is the first baseline segment's.
+    segments = outputs["segment"]["segments"]
+    baselines = segments[segments["kind"] == "baseline"]
+
+    off = np.zeros(high.size, dtype = bool)
+    if baselines.size > 0:
+        off[baselines[0]["start"]:baselines[0]["stop"]] = True
+    off &= good
+
+    baseline = np.mean(high[off] - low[off]) if off.any() else 0.
+
+    dp = vf.corrected_differential(high, low) - 100. * baseline
+    dp[~good] = np.nan
+
+    return {"baseline": np.array(baseline), "dp": dp}
+
+def _flow_stage(run, outputs, used):
+
+    segments = outputs["segment"]["segments"]
+    dp = outputs["baseline"]["dp"]
+
+    flow = vf.volumetric_flow(dp, used["rho"], used["a1"], used["a2"])
+
+    group = fs.segment_index(segments, dp.size)
+    group[np.isnan(dp)] = -1
+
+    count, dp_mean, dp_std = vf.group_mean_std(dp, group, segments.size)
+    count, flow_mean, flow_std = vf.group_mean_std(flow, group, segments.size)
+
+    table = np.zeros(segments.size, dtype = vf.summary_dtype)
+    for name in ("label", "kind", "start", "stop"):
+        table[name] = segments[name]
+    table["n"] = count
+    table["dp_mean"] = dp_mean
+    table["dp_std"] = dp_std
+    table["density_mean"] = used["rho"]
+    table["flow_mean"] = flow_mean
+    table["flow_std"] = flow_std
+
+    return {"flow": flow, "table": table}
+
+def _histogram_stage(run, outputs, used):
+
+    segments = outputs["segment"]["segments"]
+    flow = outputs["flow"]["flow"]
+
+    plateau = np.zeros(flow.size, dtype = bool)
+    for segment in segments[segments["kind"] == "plateau"]:
+        plateau[segment["start"]:segment["stop"]] = True
+    plateau &= np.isfinite(flow)
+
+    h = _empty_histogram(used)
+    h.hfill_array(flow[plateau])
+
+    # kept as the bytes of an hsave file, so it comes back exactly.
+    saved = io.BytesIO()
+    h.hsave(saved)
+
+    return {"histogram": np.frombuffer(saved.getvalue(), dtype = np.uint8)}
+
+_stages = {"segment": _segment_stage, "baseline": _baseline_stage, \
+"flow": _flow_stage, "histogram": _histogram_stage}
+
+###########################################################################
+# end of the stage functions
+###########################################################################
+
+# here are functions to make the (empty) histogram of plateau flows.
+
+def _histogram_arguments(settings):
+
+    return "plateau flow", int(settings["nbins"]), float(settings["flow_low"]), \
+    float(settings["flow_high"])
+
+def _empty_histogram(settings):
+
+    h = hb.histo(*_histogram_arguments(settings))
+    h.hsetlabels("flow (L/s)", "samples")
+
+    return h
+
+###########################################################################
+# end of functions _histogram_arguments and _empty_histogram
+###########################################################################
+
+# here are functions to work out the hashes that name stage outputs: one
+# from a stage's name, settings and the hashes of its inputs, and one from
+# the arrays a stage hands back (which go into the later stages' inputs).
+
+def _digest(stage, used, input_digests):
+
+    return hashlib.sha1(json.dumps([_PIPELINE_VERSION, stage, used, input_digests], \
+    sort_keys = True).encode()).hexdigest()
+
+def _digest_arrays(output):
+
+    digest = hashlib.sha1()
+
+    for name in sorted(output):
+        values = np.ascontiguousarray(output[name])
+        digest.update(name.encode())
+        digest.update(str((values.dtype.str, values.shape)).encode())
+        digest.update(values.tobytes())
+
+    return digest.hexdigest()
+
+###########################################################################
+# end of functions _digest and _digest_arrays
+###########################################################################
+
+# here are functions to read a saved stage output (None if there isn't
+# one) and to save one. Outputs are written to a scratch file and renamed
+# into place, so a worker never sees half of one.
+
+def _read_output(store, stage, key):
+
+    try:
+        with np.load(os.path.join(store, stage, key + ".npz"), allow_pickle = False) as saved:
+            return {name: saved[name] for name in saved.files}
+    except (OSError, ValueError):
+        return None
+
+def _write_output(store, stage, key, output):
+
+    directory = os.path.join(store, stage)
+    os.makedirs(directory, exist_ok = True)
+
+    handle, scratch = tempfile.mkstemp(dir = directory, suffix = ".npz")
+    with os.fdopen(handle, "wb") as f:
+        np.savez(f, **output)
+
+    os.replace(scratch, os.path.join(directory, key + ".npz"))
+
+###########################################################################
+# end of functions _read_output and _write_output
+###########################################################################
+
+# here is a function to print the table, one line per segment. Pass kind =
+# None to include the baselines and transitions too.
+
+def print_table(table, kind = "plateau"):
+
+    print("%-24s %-12s %7s %7s %6s %10s %8s %9s %8s" % ("file", "segment", \
+    "start", "stop", "n", "dp (Pa)", "+/-", "Q (L/s)", "+/-"))
+
+    for row in table:
+
+        if kind is not None and row["kind"] != kind:
+            continue
+
+        print("%-24s %-12s %7d %7d %6d %10.3f %8.3f %9.4f %8.4f" % \
+        (row["file"][:24], row["label"], row["start"], row["stop"], row["n"], \
+        row["dp_mean"], row["dp_std"], row["flow_mean"], row["flow_std"]))
+
+###########################################################################
+# end of function print_table
+###########################################################################
+
+# here is a function to print which stages were done and which were taken
+# from their saved outputs.
+
+def print_stage_report(report):
+
+    for stage, names in stage_settings:
+
+        done = [seconds for stages in report.values() for name, how, seconds in stages \
+        if name == stage and how == "done"]
+        saved = [seconds for stages in report.values() for name, how, seconds in stages \
+        if name == stage and how == "saved"]
+
+        print("%-10s done %4d (%8.3f s)   saved %4d (%8.3f s)" % (stage, len(done), \
+        sum(done), len(saved), sum(saved)))
+
+###########################################################################
+# end of function print_stage_report
+###########################################################################
+
+# here is a function to write the table to a CSV file.
+
+def save_table(table, filename):
+
+    with open(filename, "w") as f:
+        f.write(",".join(table.dtype.names) + "\n")
+        for row in table:
+            f.write(",".join(str(value) for value in row.tolist()) + "\n")
+
+###########################################################################
+# end of function save_table
+###########################################################################
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = \
+    "run the flow analysis over many run files and make one summary table")
+    parser.add_argument("files", nargs = "+", help = "run files or glob patterns")
+    parser.add_argument("--nproc", type = int, default = None)
+    parser.add_argument("--cache-dir", default = None)
+    parser.add_argument("--force", action = "store_true", help = "redo every stage")
+    parser.add_argument("--out", default = None, help = "CSV file for the table")
+    parser.add_argument("--histogram", default = None, help = ".npz file for the histogram")
+    parser.add_argument("--all-segments", action = "store_true", \
+    help = "print baselines and transitions too")
+
+    for name, value in default_settings.items():
+        kind = str if name in ("high", "low", "ambient") else \
+        int if name in ("window", "min_length", "nbins") else float
+        parser.add_argument("--" + name.replace("_", "-"), type = kind, default = value)
+
+    arguments = parser.parse_args()
+
+    files = []
+    for pattern in arguments.files:
+        matches = sorted(glob.glob(pattern))
+        files.extend(matches if matches else [pattern])
+
+    settings = {name: getattr(arguments, name) for name in default_settings}
+
+    table, h, report = run_pipeline(files, settings, arguments.nproc, \
+    arguments.cache_dir, arguments.force)
+
+    print_table(table, None if arguments.all_segments else "plateau")
+    print()
+    print_stage_report(report)
+
+    if arguments.out is not None:
+        save_table(table, arguments.out)
+
+    if arguments.histogram is not None:
+        h.hsave(arguments.histogram)
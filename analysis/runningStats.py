@@ -0,0 +1,617 @@
+###################################################################
+
+# This file is runningStats.py. It keeps statistics that are updated a
+# sample (or a chunk of samples) at a time, using a fixed amount of memory
+# however long the recording gets:
+#   running_stats        mean and variance of everything so far (Welford)
+#   exponential_stats    exponentially weighted mean and variance
+#   window_stats         mean and variance of the last "window" samples
+#   baseline_tracker     the pump-off baseline, re-estimated whenever the
+#                        flow is off, so sensor drift over a long session is
+#                        followed rather than fixed by the first few samples
+# Each has update(x) for one sample and update_array(values) for a chunk;
+# feeding the same samples either way gives the same answer (up to rounding).
+
+# The firmware works out its offsets once, from number_to_average = 10
+# samples at startup. baseline_tracker starts the same way, then keeps
+# going: whenever the signal is steady and close to the no-flow level, the
+# baseline is pulled towards it with an exponential average.
+
+# use this way:
+#   import flowmeterLoader as fl
+#   import runningStats as rs
+#
+#   stats = rs.running_stats()
+#   for chunk in fl.iter_dps310e_chunks("Data/DPS310E_22_04_21_a.CSV"):
+#       stats.update_array(chunk["p0"])
+#   print(stats.mean, stats.std)
+#
+#   run = fl.load_dps310e("Data/DPS310E_22_04_21_a.CSV")
+#   baseline = rs.tracked_baseline(run, "p0", "p1")
+#   dp = 100. * (run["p0"] - run["p1"]) - baseline
+
+import math
+
+import numpy as np
+
+import flowmeterLoader as fl
+
+# samples handled in one go by the update_array functions, so the scratch
+# arrays stay small however big the chunk handed in is.
+_BLOCK = 65536
+
+###########################################################################
+
+# here is a class for the mean and variance of every sample seen so far,
+# using Welford's update (and Chan et al.'s formula for adding a whole chunk
+# of samples, or another running_stats, at once).
+
+class running_stats:
+
+    __slots__ = ("count", "mean", "m2", "minimum", "maximum")
+
+    def __init__(self):
+
+        self.count = 0
+        self.mean = 0.
+        self.m2 = 0.
+        self.minimum = math.inf
+        self.maximum = -math.inf
+
+    @property
+    def variance(self):
+        return self.m2 / self.count if self.count > 0 else math.nan
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    ###########################################################################
+
+    # here is a function to add one sample.
+
+    def update(self, x):
+
+        x = float(x)
+
+        self.count = self.count + 1
+        delta = x - self.mean
+        self.mean = self.mean + delta / self.count
+        self.m2 = self.m2 + delta * (x - self.mean)
+
+        self.minimum = min(self.minimum, x)
+        self.maximum = max(self.maximum, x)
+
+    ###########################################################################
+    # end of function update
+    ###########################################################################
+
+    # here is a function to add a chunk of samples.
+
+    def update_array(self, values):
+
+        values = np.asarray(values, dtype = float).ravel()
+
+        if values.size == 0:
+            return
+
+        mean = values.mean()
+        deviation = values - mean
+
+        self._combine(values.size, mean, np.dot(deviation, deviation), \
+        values.min(), values.max())
+
+    ###########################################################################
+    # end of function update_array
+    ###########################################################################
+
+    # here is a function to add in the samples another running_stats has
+    # seen, as if they had all been fed to this one.
+
+    def merge(self, other):
+
+        if other.count > 0:
+            self._combine(other.count, other.mean, other.m2, other.minimum, \
+            other.maximum)
+
+    ###########################################################################
+    # end of function merge
+    ###########################################################################
+
+    def _combine(self, count, mean, m2, minimum, maximum):
+
+        total = self.count + count
+        delta = mean - self.mean
+
+        self.mean = self.mean + delta * count / total
+        self.m2 = self.m2 + m2 + delta * delta * self.count * count / total
+        self.count = total
+
+        self.minimum = min(self.minimum, float(minimum))
+        self.maximum = max(self.maximum, float(maximum))
+
+###########################################################################
+# end of class running_stats
+###########################################################################
+
+# here is a class for the exponentially weighted mean and variance: each
+# new sample gets weight alpha and everything before it is scaled down by
+# (1 - alpha). Give either alpha or halflife, the number of samples after
+# which a sample's weight has dropped by half.
+
+class exponential_stats:
+
+    __slots__ = ("alpha", "count", "offset", "_mean", "_variance")
+
+    def __init__(self, alpha = None, halflife = None):
+
+        if alpha is None:
+            if halflife is None or halflife <= 0:
+                raise ValueError("exponential_stats needs alpha or a positive halflife")
+            alpha = 1. - 0.5 ** (1. / halflife)
+
+        if not 0. < alpha <= 1.:
+            raise ValueError("alpha has to be between 0 and 1")
+
+        self.alpha = float(alpha)
+        self.count = 0
+
+        # the mean is kept relative to the first sample, so that a small
+        # wobble on 1000 hPa keeps all its digits.
+        self.offset = 0.
+        self._mean = 0.
+        self._variance = 0.
+
+    @property
+    def mean(self):
+        return self._mean + self.offset if self.count > 0 else math.nan
+
+    @property
+    def variance(self):
+        return self._variance if self.count > 0 else math.nan
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    ###########################################################################
+
+    # here is a function to add one sample.
+
+    def update(self, x):
+
+        x = float(x)
+
+        if self.count == 0:
+            self.offset = x
+
+        x = x - self.offset
+
+        if self.count == 0:
+            self._mean = x
+        else:
+            delta = x - self._mean
+            increment = self.alpha * delta
+            self._mean = self._mean + increment
+            self._variance = (1. - self.alpha) * (self._variance + delta * increment)
+
+        self.count = self.count + 1
+
+    ###########################################################################
+    # end of function update
+    ###########################################################################
+
+    # here is a function to add a chunk of samples. It hands back the mean
+    # and standard deviation after each one.
+
+    def update_array(self, values):
+
+        values = np.asarray(values, dtype = float).ravel()
+
+        means = np.empty(values.size)
+        stds = np.empty(values.size)
+
+        if values.size == 0:
+            return means, stds
+
+        start = 0
+
+        # the first sample ever just sets the mean.
+        if self.count == 0:
+            self.update(values[0])
+            means[0] = self.mean
+            stds[0] = 0.
+            start = 1
+
+        for first in range(start, values.size, _BLOCK):
+
+            x = values[first:first + _BLOCK] - self.offset
+
+            # mean: m_k = (1 - alpha) m_(k-1) + alpha x_k
+            mean = exponential_filter(x, self.alpha, self._mean)
+
+            # variance: v_k = (1 - alpha) v_(k-1) + alpha (1 - alpha) d_k^2
+            # with d_k = x_k - m_(k-1)
+            previous = np.concatenate(([self._mean], mean[:-1]))
+            delta = x - previous
+            variance = exponential_filter((1. - self.alpha) * delta * delta, \
+            self.alpha, self._variance)
+
+            means[first:first + x.size] = mean + self.offset
+            stds[first:first + x.size] = np.sqrt(variance)
+
+            self._mean = mean[-1]
+            self._variance = variance[-1]
+            self.count = self.count + x.size
+
+        return means, stds
+
+    ###########################################################################
+    # end of function update_array
+    ###########################################################################
+
+###########################################################################
+# end of class exponential_stats
+###########################################################################
+
+# here is a class for the mean and variance of the last "window" samples.
+# It holds on to just those samples, plus running sums of them, so each
+# update costs the same however long it has been going. The sums are
+# worked out again from the samples every time the window comes round, so
+# rounding errors can't build up.
+
+class window_stats:
+
+    __slots__ = ("window", "count", "offset", "_values", "_next", "_sum", "_sumsq")
+
+    def __init__(self, window):
+
+        if window < 1:
+            raise ValueError("window_stats needs a window of at least 1 sample")
+
+        self.window = int(window)
+        self.count = 0
+        self.offset = 0.
+
+        # the last "window" samples (relative to offset), oldest at _next
+        # once the window is full.
+        self._values = np.zeros(self.window)
+        self._next = 0
+        self._sum = 0.
+        self._sumsq = 0.
+
+    @property
+    def full(self):
+        return self.count >= self.window
+
+    @property
+    def mean(self):
+        n = min(self.count, self.window)
+        return self._sum / n + self.offset if n > 0 else math.nan
+
+    @property
+    def variance(self):
+        n = min(self.count, self.window)
+        if n == 0:
+            return math.nan
+        mean = self._sum / n
+        return max(self._sumsq / n - mean * mean, 0.)
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    ###########################################################################
+
+    # here is a function to add one sample (dropping the oldest one once
+    # the window is full).
+
+    def update(self, x):
+
+        if self.count == 0:
+            self.offset = float(x)
+
+        x = float(x) - self.offset
+
+        if self.count >= self.window:
+            old = self._values[self._next]
+            self._sum = self._sum - old
+            self._sumsq = self._sumsq - old * old
+
+        self._values[self._next] = x
+        self._sum = self._sum + x
+        self._sumsq = self._sumsq + x * x
+
+        self._next = (self._next + 1) % self.window
+        self.count = self.count + 1
+
+        if self._next == 0:
+            self._sum = float(self._values.sum())
+            self._sumsq = float(np.dot(self._values, self._values))
+
+    ###########################################################################
+    # end of function update
+    ###########################################################################
+
+    # here is a function to add a chunk of samples. It hands back the mean
+    # and standard deviation of the window ending at each one (over fewer
+    # samples until the window has filled up).
+
+    def update_array(self, values):
+
+        values = np.asarray(values, dtype = float).ravel()
+
+        means = np.empty(values.size)
+        stds = np.empty(values.size)
+
+        if values.size == 0:
+            return means, stds
+
+        if self.count == 0:
+            self.offset = float(values[0])
+
+        for first in range(0, values.size, _BLOCK):
+
+            x = values[first:first + _BLOCK] - self.offset
+
+            # the samples already in the window, oldest first, then the new
+            # ones, and running sums over all of them.
+            held = min(self.count, self.window)
+            history = np.roll(self._values, -self._next)[self.window - held:] \
+            if self.count >= self.window else self._values[:held]
+            joined = np.concatenate((history, x))
+
+            running = np.concatenate(([0.], np.cumsum(joined)))
+            running_sq = np.concatenate(([0.], np.cumsum(joined * joined)))
+
+            right = np.arange(held + 1, joined.size + 1)
+            left = np.maximum(right - self.window, 0)
+            n = right - left
+
+            mean = (running[right] - running[left]) / n
+            variance = np.maximum((running_sq[right] - running_sq[left]) / n - \
+            mean * mean, 0.)
+
+            means[first:first + x.size] = mean + self.offset
+            stds[first:first + x.size] = np.sqrt(variance)
+
+            # keep the last "window" samples, in the order update expects.
+            self.count = self.count + x.size
+            tail = joined[-self.window:]
+            self._values[:] = 0.
+            self._values[:tail.size] = tail
+            self._next = tail.size % self.window
+            self._sum = float(tail.sum())
+            self._sumsq = float(np.dot(tail, tail))
+
+        return means, stds
+
+    ###########################################################################
+    # end of function update_array
+    ###########################################################################
+
+###########################################################################
+# end of class window_stats
+###########################################################################
+
+# here is a class to follow the pump-off baseline through a long session.
+# It watches a signal that jumps when the flow comes on (a sensor against
+# the atmosphere, say 100 * (p0 - p4)) and keeps the baseline of the values
+# being corrected (say 100 * (p0 - p1)):
+#   - the first "startup" samples are taken to be pump off, the way the
+#     firmware does, and give the starting baseline, the no-flow level of
+#     the signal and its noise;
+#   - after that, a sample counts as no-flow when the last "window" samples
+#     of the signal are steady (std below threshold) and close to the
+#     no-flow level (within tolerance);
+#   - each no-flow sample moves the baseline (and the no-flow level)
+#     towards it with an exponential average with the given halflife.
+# threshold defaults to four times the startup noise and tolerance to five
+# times the threshold, but at least min_threshold and min_tolerance (in the
+# signal's units; the defaults suit signals in Pa, where turning the pump
+# on moves a sensor against the atmosphere by 20 Pa or more). If the values
+# aren't given, the signal is the values.
+
+class baseline_tracker:
+
+    def __init__(self, window = 15, halflife = 500, threshold = None, \
+    tolerance = None, startup = 10, min_threshold = 1., min_tolerance = 5.):
+
+        self.startup = max(1, int(startup))
+        self.min_threshold = min_threshold
+        self.min_tolerance = min_tolerance
+        self.threshold = threshold
+        self.tolerance = tolerance
+
+        self.no_flow = False
+        self.no_flow_samples = 0
+        self.count = 0
+
+        self._window = window_stats(window)
+        self._startup_signal = running_stats()
+        self._startup_values = running_stats()
+        self._level = exponential_stats(halflife = halflife)
+        self._baseline = exponential_stats(halflife = halflife)
+
+    @property
+    def baseline(self):
+        if self._baseline.count > 0:
+            return self._baseline.mean
+        return self._startup_values.mean if self._startup_values.count > 0 else math.nan
+
+    @property
+    def level(self):
+        if self._level.count > 0:
+            return self._level.mean
+        return self._startup_signal.mean if self._startup_signal.count > 0 else math.nan
+
+    ###########################################################################
+
+    # here is a function to add one sample; it returns the baseline.
+
+    def update(self, signal, value = None):
+
+        self.update_array([signal], None if value is None else [value])
+
+        return self.baseline
+
+    ###########################################################################
+    # end of function update
+    ###########################################################################
+
+    # here is a function to add a chunk of samples. It hands back the
+    # baseline in effect at each sample.
+
+    def update_array(self, signal, values = None):
+
+        signal = np.asarray(signal, dtype = float).ravel()
+        values = signal if values is None else np.asarray(values, dtype = float).ravel()
+
+        if values.size != signal.size:
+            raise ValueError("signal and values have to be the same length")
+
+        baselines = np.empty(signal.size)
+        first = 0
+
+        # startup: the plain average, like the firmware's.
+        if self._startup_signal.count < self.startup:
+
+            first = min(self.startup - self._startup_signal.count, signal.size)
+
+            for i in range(first):
+                self._startup_signal.update(signal[i])
+                self._startup_values.update(values[i])
+                baselines[i] = self._startup_values.mean
+
+            self._window.update_array(signal[:first])
+
+            if self._startup_signal.count == self.startup:
+                self._start_tracking()
+
+        # then a block at a time. The no-flow level used to pick out the
+        # no-flow samples is the one from the start of each block, which is
+        # fine as long as the blocks are short next to the halflife.
+        block = max(1, self._window.window * 8)
+
+        for start in range(first, signal.size, block):
+
+            stop = min(start + block, signal.size)
+            s = signal[start:stop]
+            v = values[start:stop]
+
+            mean, std = self._window.update_array(s)
+            quiet = (std <= self.threshold) & (np.abs(mean - self.level) <= self.tolerance)
+
+            before = self.baseline
+            nquiet = int(np.count_nonzero(quiet))
+
+            if nquiet > 0:
+                self._level.update_array(s[quiet])
+                tracked, unused = self._baseline.update_array(v[quiet])
+                which = np.cumsum(quiet) - 1
+                baselines[start:stop] = np.where(which >= 0, \
+                tracked[np.maximum(which, 0)], before)
+            else:
+                baselines[start:stop] = before
+
+            self.no_flow = bool(quiet[-1])
+            self.no_flow_samples = self.no_flow_samples + nquiet
+
+        self.count = self.count + signal.size
+
+        return baselines
+
+    ###########################################################################
+    # end of function update_array
+    ###########################################################################
+
+    # here is a function to switch from the startup average to tracking.
+
+    def _start_tracking(self):
+
+        noise = self._startup_signal.std
+
+        if self.threshold is None:
+            self.threshold = max(4. * noise, self.min_threshold)
+        if self.tolerance is None:
+            self.tolerance = max(5. * self.threshold, self.min_tolerance)
+
+        self._level.update(self._startup_signal.mean)
+        self._baseline.update(self._startup_values.mean)
+
+    ###########################################################################
+    # end of function _start_tracking
+    ###########################################################################
+
+###########################################################################
+# end of class baseline_tracker
+###########################################################################
+
+# here is a function to run an exponential filter,
+#   y_k = (1 - alpha) y_(k-1) + alpha u_k,   starting from y_0 = start,
+# over a whole array without a python loop. Writing d = 1 - alpha,
+#   y_k = d^k (start + alpha sum_(j<=k) u_j / d^j)
+# which is a cumulative sum; it is done in blocks short enough that d^k
+# doesn't underflow.
+
+def exponential_filter(inputs, alpha, start = 0.):
+
+    inputs = np.asarray(inputs, dtype = float)
+    decay = 1. - alpha
+
+    if decay <= 0.:
+        return inputs.copy()
+
+    block = int(max(1, min(4096, -500. / math.log(decay))))
+
+    outputs = np.empty(inputs.size)
+    previous = start
+
+    for first in range(0, inputs.size, block):
+
+        u = inputs[first:first + block]
+        powers = decay ** np.arange(1, u.size + 1)
+
+        y = powers * (previous + alpha * np.cumsum(u / powers))
+
+        outputs[first:first + u.size] = y
+        previous = y[-1]
+
+    return outputs
+
+###########################################################################
+# end of function exponential_filter
+###########################################################################
+
+# here is a function to track the baseline of 100 * (high - low), in Pa,
+# through a whole run (a structured array from flowmeterLoader, or anything
+# indexed by channel name). The no-flow periods are found from
+# 100 * (high - ambient); ambient = None picks the atmosphere sensor for the
+# file format. Samples where a sensor dropped out are skipped and get the
+# baseline from the sample before.
+
+def tracked_baseline(run, high = "p0", low = "p1", ambient = None, **options):
+
+    if ambient is None:
+        ambient = fl.ambient_channel(run)
+
+    high_values = np.asarray(run[high], dtype = float)
+    good = fl.good_samples(run, [high, low, ambient])
+
+    signal = 100. * (high_values - np.asarray(run[ambient], dtype = float))
+    values = 100. * (high_values - np.asarray(run[low], dtype = float))
+
+    tracker = baseline_tracker(**options)
+    tracked = tracker.update_array(signal[good], values[good])
+
+    # spread the good samples' baselines over the bad ones.
+    which = np.cumsum(good) - 1
+
+    if tracked.size == 0:
+        return np.full(high_values.size, np.nan)
+
+    return tracked[np.maximum(which, 0)]
+
+###########################################################################
+# end of function tracked_baseline
+###########################################################################
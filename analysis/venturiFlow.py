@@ -0,0 +1,293 @@
+###################################################################
+
+# This file is venturiFlow.py. It turns flowmeter pressure readings into
+# flow rates using Bernoulli's equation for the venturi insert, for whole
+# arrays of samples (and whole lists of runs) at once.
+
+# For air of density rho flowing through a tube of area A1 that narrows to
+# A2, the pressure drop between the two is
+#   dp = (rho / 2) * Q**2 * (1 / A2**2 - 1 / A1**2)
+# so the volumetric flow is
+#   Q = sqrt(2 dp / (rho (1 / A2**2 - 1 / A1**2)))
+# e.g. 0.15 L/s gives dp = 1.3 Pa for the short tube insert.
+
+# Pressures come from the DPS310s in hPa; differences are worked out in Pa
+# and corrected by the pump-off (baseline) difference, the same way the
+# flowmeter firmware does it for "corrected P0 - P1 in Pa".
+
+# use this way:
+#   import flowmeterLoader as fl
+#   import venturiFlow as vf
+#
+#   runs = [fl.load_dps310e(name) for name in glob.glob("Data/DPS310E_*.CSV")]
+#   table = vf.summarize_runs(runs, high = "p0", low = "p1")
+#   vf.print_summary(table)
+
+import numpy as np
+
+import flowmeterLoader as fl
+import flowSegments as fs
+
+# insert geometry, m^2: tube and constriction
+A1 = 0.02 * 0.025
+A2 = 0.02 * 0.005
+
+# air density we've been assuming, kg/m^3
+RHO_AIR = 1.22
+
+# specific gas constant for dry air, J/(kg K)
+R_AIR = 287.05
+
+# one row per segment of each run.
+summary_dtype = np.dtype([
+    ("run", np.int32),
+    ("label", "U16"),
+    ("kind", "U10"),
+    ("start", np.int64),
+    ("stop", np.int64),
+    ("n", np.int64),
+    ("dp_mean", np.float64),       # Pa, baseline corrected
+    ("dp_std", np.float64),
+    ("density_mean", np.float64),  # kg/m^3
+    ("flow_mean", np.float64),     # L/s
+    ("flow_std", np.float64),
+])
+
+###########################################################################
+
+# here is a function to calculate baseline-corrected pressure differences
+# in Pascals from pressures in hPa. baseline_high and baseline_low are the
+# pump-off pressures (or arrays of them, one per sample); leave them out to
+# get the raw difference.
+
+def corrected_differential(high, low, baseline_high = 0., baseline_low = 0.):
+
+    high = np.asarray(high, dtype = float)
+    low = np.asarray(low, dtype = float)
+
+    return 100. * ((high - low) - (np.asarray(baseline_high) - np.asarray(baseline_low)))
+
+###########################################################################
+# end of function corrected_differential
+###########################################################################
+
+# here is a function to calculate the density of air (kg/m^3) from the ideal
+# gas law, given pressure in hPa and temperature in degrees C.
+
+def air_density(pressure_hPa, temperature_C):
+
+    return 100. * np.asarray(pressure_hPa, dtype = float) / \
+    (R_AIR * (np.asarray(temperature_C, dtype = float) + 273.15))
+
+###########################################################################
+# end of function air_density
+###########################################################################
+
+# here is a function to calculate the volumetric flow, in L/s, from a
+# pressure drop in Pa. A negative pressure drop means the air is going the
+# other way, so it gives a negative flow of the same size. Everything
+# broadcasts, so dp (and rho) can be arrays of any shape.
+
+def volumetric_flow(dp, rho = RHO_AIR, a1 = A1, a2 = A2):
+
+    dp = np.asarray(dp, dtype = float)
+    geometry = 1. / a2 ** 2 - 1. / a1 ** 2
+
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        return 1000. * np.sign(dp) * np.sqrt(2. * np.abs(dp) / (rho * geometry))
+
+###########################################################################
+# end of function volumetric_flow
+###########################################################################
+
+# here is a function to go the other way: the pressure drop (Pa) we expect
+# for a flow in L/s.
+
+def expected_differential(flow, rho = RHO_AIR, a1 = A1, a2 = A2):
+
+    q = np.asarray(flow, dtype = float) / 1000.
+    geometry = 1. / a2 ** 2 - 1. / a1 ** 2
+
+    return np.sign(q) * 0.5 * rho * q * q * geometry
+
+###########################################################################
+# end of function expected_differential
+###########################################################################
+
+# here is a function to work out the mean and standard deviation of values
+# in each group, where group[i] says which group values[i] belongs to (-1
+# for none). np.bincount does all the groups in one pass.
+
+def group_mean_std(values, group, ngroups):
+
+    keep = group >= 0
+    group = group[keep]
+    values = values[keep]
+
+    count = np.bincount(group, minlength = ngroups)
+    total = np.bincount(group, weights = values, minlength = ngroups)
+
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        mean = total / count
+        deviation = values - mean[group]
+        variance = np.bincount(group, weights = deviation * deviation, \
+        minlength = ngroups) / count
+
+    return count, mean, np.sqrt(variance)
+
+###########################################################################
+# end of function group_mean_std
+###########################################################################
+
+# here is the function to take a whole list of runs (structured arrays from
+# flowmeterLoader, or anything indexed by channel name) and make one table
+# of baseline-corrected pressure drops and flow rates for every segment of
+# every run. For each run:
+#   - samples where one of the sensors dropped out (read zero) are left out;
+#   - the segments are found from 100 * (segment_channel - ambient), or
+#     handed in through segments (a list, one array per run). ambient = None
+#     picks the atmosphere sensor for the file format;
+#   - the pump-off baseline is the first baseline segment;
+#   - dp = 100 * ((high - low) - <high - low>_baseline), in Pa;
+#   - the air density comes from the low channel's pressure and
+#     temperature_channel if given, otherwise it is RHO_AIR.
+# The per-sample arithmetic is done on all the runs stuck end to end, in one
+# go, and the per-segment averages with one np.bincount.
+
+def summarize_runs(runs, high = "p0", low = "p1", ambient = None, \
+segment_channel = None, temperature_channel = None, segments = None, \
+a1 = A1, a2 = A2):
+
+    if segment_channel is None:
+        segment_channel = high
+
+    high_all = []
+    low_all = []
+    temperature_all = []
+    group_all = []
+    baseline_all = []
+    rows = []
+
+    for irun, run in enumerate(runs):
+
+        high_values = np.asarray(run[high], dtype = float)
+        low_values = np.asarray(run[low], dtype = float)
+
+        good = fl.good_samples(run, [high, low])
+
+        if segments is None:
+            run_ambient = fl.ambient_channel(run) if ambient is None else ambient
+            signal = 100. * (np.asarray(run[segment_channel], dtype = float) - \
+            np.asarray(run[run_ambient], dtype = float))
+            run_segments = fs.find_segments(_bridge_dropouts(signal, \
+            good & fl.good_samples(run, [segment_channel, run_ambient])))
+        else:
+            run_segments = segments[irun]
+
+        # which segment (numbered across all runs) each sample is in
+        group = fs.segment_index(run_segments, high_values.size)
+        group = np.where((group >= 0) & good, group + len(rows), -1)
+
+        # pump-off difference, in hPa, for this run
+        baselines = run_segments[run_segments["kind"] == "baseline"]
+        off = np.zeros(high_values.size, dtype = bool)
+        if baselines.size > 0:
+            off[baselines[0]["start"]:baselines[0]["stop"]] = True
+        off &= good
+        if off.any():
+            baseline = np.mean(high_values[off] - low_values[off])
+        else:
+            baseline = 0.
+
+        high_all.append(high_values)
+        low_all.append(low_values)
+        group_all.append(group)
+        baseline_all.append(np.full(high_values.size, baseline))
+
+        if temperature_channel is not None:
+            temperature_all.append(np.asarray(run[temperature_channel], dtype = float))
+
+        for segment in run_segments:
+            rows.append((irun, segment["label"], segment["kind"], \
+            segment["start"], segment["stop"]))
+
+    table = np.zeros(len(rows), dtype = summary_dtype)
+
+    if not rows:
+        return table
+
+    high_all = np.concatenate(high_all)
+    low_all = np.concatenate(low_all)
+    group_all = np.concatenate(group_all)
+    baseline_all = np.concatenate(baseline_all)
+
+    # now the physics, for every sample of every run at once.
+    dp = corrected_differential(high_all, low_all) - 100. * baseline_all
+
+    if temperature_channel is not None:
+        rho = air_density(low_all, np.concatenate(temperature_all))
+    else:
+        rho = np.full(dp.size, RHO_AIR)
+
+    flow = volumetric_flow(dp, rho, a1, a2)
+
+    # and the per-segment averages.
+    ngroups = len(rows)
+    count, dp_mean, dp_std = group_mean_std(dp, group_all, ngroups)
+    count, density_mean, density_std = group_mean_std(rho, group_all, ngroups)
+    count, flow_mean, flow_std = group_mean_std(flow, group_all, ngroups)
+
+    for name, column in zip(("run", "label", "kind", "start", "stop"), zip(*rows)):
+        table[name] = column
+
+    table["n"] = count
+    table["dp_mean"] = dp_mean
+    table["dp_std"] = dp_std
+    table["density_mean"] = density_mean
+    table["flow_mean"] = flow_mean
+    table["flow_std"] = flow_std
+
+    return table
+
+###########################################################################
+# end of function summarize_runs
+###########################################################################
+
+# here is a function to fill in the samples where a sensor dropped out by
+# drawing straight lines across from the good samples on either side, so
+# they don't look like steps to the segment finder.
+
+def _bridge_dropouts(values, good):
+
+    if good.all() or not good.any():
+        return values
+
+    index = np.arange(values.size)
+
+    return np.interp(index, index[good], values[good])
+
+###########################################################################
+# end of function _bridge_dropouts
+###########################################################################
+
+# here is a function to print a summary table, one line per segment. Pass
+# kind = None to include the baselines and transitions too.
+
+def print_summary(table, kind = "plateau"):
+
+    print("%4s %-12s %7s %7s %6s %10s %8s %9s %9s %8s" % ("run", "segment", \
+    "start", "stop", "n", "dp (Pa)", "+/-", "rho", "Q (L/s)", "+/-"))
+
+    for row in table:
+
+        if kind is not None and row["kind"] != kind:
+            continue
+
+        print("%4d %-12s %7d %7d %6d %10.3f %8.3f %9.4f %9.4f %8.4f" % \
+        (row["run"], row["label"], row["start"], row["stop"], row["n"], \
+        row["dp_mean"], row["dp_std"], row["density_mean"], \
+        row["flow_mean"], row["flow_std"]))
+
+###########################################################################
+# end of function print_summary
+###########################################################################